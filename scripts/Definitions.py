@@ -7,11 +7,7 @@
 --------------------------------------------------------------------------------
 Input data
 '''
-import h5py
-import os
-from helping_functions import get_true_min_maxX
-from helping_functions import get_true_min_maxY
-from helping_functions import get_number_voxel
+from voxel_config import VoxelizationConfig
 
 
 path_buildjob_h5 = '/home/jan/Documents/Trainingsdaten/ZP_4/ZP_4_full_part.h5'
@@ -21,36 +17,28 @@ part_name = 'ZP4_combined'
 #mode_df = 'mean' #way how to deal with data points which occur multiple times
 voxel_size = 100
 num_layers_per_voxel = 10
-max_slice_number_part = 1593 # doesn't need to be manually added
+output_format = 'groups' #'groups': one group per voxel and slice, 'csr': few large columns + offsets table per layer (storage reduced version only), 'dense': one chunked dataset per part (non reduced version only)
+compression = None #compression profile of the written datasets (see compression_profiles.py, choose with: python compression_profiles.py --tune ...), None -> 'none' and 'shuffle-gzip' for 'dense'
+max_slice_number_part = 1593 # doesn't need to be manually added (None -> highest slice number in the hdf5)
 #a funtion needs to be built in which checks whether a Slice data is there or not (for topmost voxel)
 '''
 -------------------------------------------------------------------------------
 Basic operations and calculations
+The bounding box scan and the grid calculations are done lazily by the config
+(nothing is scanned or created when this module is imported). The output folder
+is created by config.make_output_folder() when a run starts
 '''
-os.mkdir(path_voxel_h5_folder)
-
-#path_voxel_h5 = path_voxel_h5_folder+name_voxel_h5_file
-
-minX = int(get_true_min_maxX(path_buildjob_h5, part_name, max_slice_number_part)[0])
-maxX = int(get_true_min_maxX(path_buildjob_h5, part_name, max_slice_number_part)[1])
-minY = int(get_true_min_maxY(path_buildjob_h5, part_name, max_slice_number_part)[0])
-maxY = int(get_true_min_maxY(path_buildjob_h5, part_name, max_slice_number_part)[1])
-
-print('maxX ' + str(maxX))
-print('minX ' + str(minX))
-print('maxy ' + str(maxY))
-print('minY ' + str(minY))
-
-length_x_part = abs(maxX-minX)
-length_y_part = abs(maxY-minY)
-
-num_voxels = get_number_voxel(length_x_part, length_y_part, max_slice_number_part, voxel_size, num_layers_per_voxel) #number_of_layers_part was changed to max_slice_number_part
-num_voxels_x = int(num_voxels[0])
-num_voxels_y = int(num_voxels[1])
-num_voxels_z = int(num_voxels[2])
-
-print('num_voxels_x ' + str(num_voxels_x))
-print('num_voxels_y ' + str(num_voxels_y))
-print('num_voxels_z ' + str(num_voxels_z))
-
-num_z_list = [i for i in range(num_voxels_z)]
+config = VoxelizationConfig(path_buildjob_h5, path_voxel_h5_folder, part_name,
+                            voxel_size = voxel_size,
+                            num_layers_per_voxel = num_layers_per_voxel,
+                            max_slice_number_part = max_slice_number_part,
+                            output_format = output_format,
+                            compression = compression)
+
+#the derived values can still be imported by name (from Definitions import minX), they are computed on first access
+DERIVED_NAMES = ('minX', 'maxX', 'minY', 'maxY', 'num_voxels_x', 'num_voxels_y', 'num_voxels_z', 'num_z_list')
+
+def __getattr__(name):
+    if name in DERIVED_NAMES:
+        return getattr(config, name)
+    raise AttributeError("module 'Definitions' has no attribute '{}'".format(name))
@@ -0,0 +1,273 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Batch mode which voxelizes all the parts of a buildjob in one scheduled job. The
+part groups are discovered in the buildjob hdf5, every part gets its own output
+folder (output_root/part_name) with its own config json and manifest. One process
+pool is shared by all parts: it scans the bounds of the parts without a cached
+scan and afterwards computes the slices of all parts. Every process keeps the
+buildjob open for all its tasks, the binned slices are written by this process
+(one writer per part, closed as soon as the part is finished)
+'''
+import concurrent.futures
+import h5py
+import itertools
+import json
+import numpy as np
+import os
+import time
+import instrumentation
+from helping_functions import get_slice_loader
+from get_part_bounds import scan_part_group_bounds, load_cached_bounds, save_cached_bounds, summarize_bounds, get_part_bounds_from_attributes
+from voxel_config import VoxelizationConfig, get_slice_numbers
+from create_hdf_per_single_vox_layer_storage_reduced import bin_slice_array, get_slice_columns
+from slice_scheduler import get_slice_order
+from voxel_writer import create_voxel_layer_writer
+from run_manifest import RunManifest, prepare_manifest, get_pending_slices
+from voxel_index import build_voxel_index
+from voxel_features import get_feature_extractor, build_feature_table
+
+BATCH_FILE_NAME = 'voxelization_batch.json'
+GRID_SOURCES = ('scan', 'attributes')
+
+
+'''
+-------------------------------------------------------------------------------
+discover_parts:
+function that finds all the part groups of a buildjob (groups with Slice subgroups)
+
+inputs:
+h5_path = str of path to the buildjob hdf5
+
+outputs:
+dict of part name -> greatest slice number of the part
+'''
+def discover_parts(h5_path):
+    parts = {}
+    with h5py.File(h5_path,'r') as h5:
+        for part_name, part in h5.items():
+            if not isinstance(part, h5py.Group):
+                continue
+            slice_numbers = get_slice_numbers(part)
+            if slice_numbers:
+                parts[part_name] = max(slice_numbers)
+    return parts
+
+
+'''
+-------------------------------------------------------------------------------
+create_batch_configs:
+function that creates one VoxelizationConfig per part of a buildjob
+
+inputs:
+h5_path = str of path to the buildjob hdf5
+output_root = str of the folder which gets one subfolder per part
+part_names = list of str of the parts to voxelize (None -> all discovered parts)
+**config_kwargs = voxel parameters of VoxelizationConfig (voxel_size, num_layers_per_voxel, ...)
+
+outputs:
+list of VoxelizationConfig
+'''
+def create_batch_configs(h5_path, output_root, part_names = None, **config_kwargs):
+    parts = discover_parts(h5_path)
+    if part_names is not None:
+        missing = [part_name for part_name in part_names if part_name not in parts]
+        if missing:
+            raise KeyError('parts {} not found in {}'.format(missing, h5_path))
+        parts = {part_name: parts[part_name] for part_name in part_names}
+    return [VoxelizationConfig(h5_path, os.path.join(output_root, part_name), part_name, max_slice_number_part = max_slice_number, **config_kwargs)
+            for part_name, max_slice_number in parts.items()]
+
+
+#set in every process of the pool, the buildjobs stay open for all the tasks of the process
+compute_state = {}
+
+def init_compute_process(instrumentation_settings):
+    compute_state['h5_files'] = {}
+    instrumentation.init_process(instrumentation_settings)
+
+def get_h5_file(h5_path):
+    h5_files = compute_state.setdefault('h5_files', {})
+    if h5_path not in h5_files:
+        h5_files[h5_path] = h5py.File(h5_path, 'r')
+    return h5_files[h5_path]
+
+
+'''
+-------------------------------------------------------------------------------
+scan_part:
+task of the pool: bounds scan of all the slices of a part (see scan_slice_bounds)
+'''
+def scan_part(h5_path, part_name, max_slice_number):
+    return scan_part_group_bounds(get_h5_file(h5_path)[part_name], range(max_slice_number))
+
+
+'''
+-------------------------------------------------------------------------------
+compute_part_slice:
+task of the pool: reads, filters and bins one slice of a part
+
+inputs:
+config = resolved VoxelizationConfig of the part
+num_slice = int of the slice number (0 -> Slice00001)
+
+outputs:
+tuple of part name, num_slice, sorted slice array, offsets and the instrumentation
+snapshot of the task
+'''
+def compute_part_slice(config, num_slice):
+    part = get_h5_file(config.path_buildjob_h5)[config.part_name]
+    Slice_name = config.get_slice_name(num_slice)
+    if Slice_name in part:
+        #read into the reused buffers of the process (see SliceLoader)
+        loader = get_slice_loader()
+        with instrumentation.span('read'):
+            loader.read(part[Slice_name])
+        array_not_docked = loader.filter(config.reduction_mode)
+    else:
+        array_not_docked = np.empty([0,4], dtype = int)
+    array_sorted, offsets = bin_slice_array(array_not_docked, config)
+    return config.part_name, num_slice, array_sorted, offsets, instrumentation.collect()
+
+
+'''
+-------------------------------------------------------------------------------
+resolve_batch_grids:
+function that sets the bounds of every part: out of the sidecar cache, the part
+attributes or a scan in the shared pool. Parts without datapoints are returned
+separately and not voxelized
+'''
+def resolve_batch_grids(configs, executor, grid_source = 'scan'):
+    skipped = {}
+    scans = {}
+    for config in configs:
+        if grid_source == 'attributes':
+            config.bounds = get_part_bounds_from_attributes(config.path_buildjob_h5, config.part_name, config.max_slice_number)
+            continue
+        bounds = load_cached_bounds(config.path_buildjob_h5, config.part_name, config.max_slice_number)
+        if bounds is None:
+            scans[executor.submit(scan_part, config.path_buildjob_h5, config.part_name, config.max_slice_number)] = config
+        else:
+            try:
+                config.bounds = summarize_bounds(bounds, config.path_buildjob_h5, config.part_name)
+            except ValueError as error:
+                skipped[config.part_name] = str(error)
+
+    for future in concurrent.futures.as_completed(scans):
+        config = scans[future]
+        bounds = future.result()
+        save_cached_bounds(config.path_buildjob_h5, config.part_name, config.max_slice_number, bounds)
+        try:
+            config.bounds = summarize_bounds(bounds, config.path_buildjob_h5, config.part_name)
+        except ValueError as error:
+            skipped[config.part_name] = str(error)
+
+    return [config.resolve() for config in configs if config.part_name not in skipped], skipped
+
+
+'''
+-------------------------------------------------------------------------------
+run_batch:
+function that voxelizes all the parts of a buildjob in one scheduled job. The
+slices are handed out part by part (largest first within a part), so only a few
+parts have open writers at a time. Completed slices are recorded in the manifest
+of every part (see run_manifest.py), so an interrupted batch can be resumed
+
+inputs:
+configs = list of VoxelizationConfig (see create_batch_configs, output_format 'groups' or 'csr')
+max_workers = int of number of processes of the shared pool (None -> number of CPUs)
+grid_source = str of where the bounds come from: 'scan' (cached scan) or 'attributes' (part attributes)
+restart = bool whether slices completed by an earlier run are computed again
+max_in_flight = int of number of slices submitted but not written (None -> 2*max_workers)
+
+outputs:
+dict of part name -> dict with folder, number of written slices and status
+'''
+def run_batch(configs, max_workers = None, grid_source = 'scan', restart = False, max_in_flight = None):
+    for config in configs:
+        if config.output_format not in ('groups', 'csr'):
+            raise ValueError('the batch mode writes the storage reduced layouts groups and csr, not {}'.format(config.output_format))
+    if grid_source not in GRID_SOURCES:
+        raise ValueError('grid_source has to be one of {}, not {}'.format(GRID_SOURCES, grid_source))
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    if max_in_flight is None:
+        max_in_flight = 2*max_workers
+    start_time = time.time()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = max_workers, initializer = init_compute_process, initargs = (instrumentation.get_settings(),)) as executor:
+        configs, skipped = resolve_batch_grids(configs, executor, grid_source)
+        result = {part_name: {'folder': None, 'num_slices': 0, 'status': 'skipped: {}'.format(reason)} for part_name, reason in skipped.items()}
+
+        configs_by_part = {}
+        num_pending = {}
+        tasks = []
+        for config in configs:
+            config.make_output_folder()
+            config.save_json(os.path.join(config.path_voxel_h5_folder, 'voxelization_config.json'))
+            completed = prepare_manifest(config, restart)
+            slice_numbers = get_pending_slices(config, completed, get_slice_order(config))
+            configs_by_part[config.part_name] = config
+            num_pending[config.part_name] = len(slice_numbers)
+            result[config.part_name] = {'folder': config.path_voxel_h5_folder, 'num_slices': 0, 'status': 'done'}
+            tasks.extend((config, num_slice) for num_slice in slice_numbers)
+
+        writers = {}
+        manifests = {}
+        task_iterator = iter(tasks)
+        in_flight = set(executor.submit(compute_part_slice, *task) for task in itertools.islice(task_iterator, max_in_flight))
+        try:
+            while in_flight:
+                done, in_flight = concurrent.futures.wait(in_flight, return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    part_name, num_slice, array_sorted, offsets, snapshot = future.result()
+                    instrumentation.merge(snapshot)
+                    config = configs_by_part[part_name]
+                    if part_name not in writers:
+                        writers[part_name] = create_voxel_layer_writer(config.output_format, config.path_voxel_h5_folder, config.num_voxels_x, config.num_voxels_y, config.num_layers_per_voxel,
+                                                                       flush_policy = 'slice', compression = config.compression, skip_empty = config.skip_empty_voxels, features = get_feature_extractor(config))
+                        manifests[part_name] = RunManifest(config.path_voxel_h5_folder, 'batch')
+                    for num_z, num_slice_voxel in config.get_voxel_layers(num_slice):
+                        writers[part_name].add_slice(num_z, num_slice_voxel, get_slice_columns(array_sorted), offsets, config.num_voxels_x)
+                        writers[part_name].end_slice()
+                        manifests[part_name].mark_completed(num_z, num_slice_voxel)
+                    result[part_name]['num_slices'] += 1
+
+                    num_pending[part_name] -= 1
+                    if num_pending[part_name] == 0:
+                        writers.pop(part_name).close()
+                        print('part {} done ({:.1f} s since start)'.format(part_name, time.time() - start_time))
+                    for task in itertools.islice(task_iterator, 1):
+                        in_flight.add(executor.submit(compute_part_slice, *task))
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+    for config in configs:
+        build_voxel_index(config.path_voxel_h5_folder)
+        if config.features:
+            build_feature_table(config.path_voxel_h5_folder)
+
+    print('batch of {} parts ({} skipped) took {} s'.format(len(result), len(skipped), time.time() - start_time))
+    return result
+
+
+'''
+-------------------------------------------------------------------------------
+save_batch_json:
+function that writes the result of run_batch (parts, folders, status) into the
+output root
+'''
+def save_batch_json(path_buildjob_h5, output_root, result):
+    with open(os.path.join(output_root, BATCH_FILE_NAME), 'w') as json_file:
+        json.dump({'path_buildjob_h5': path_buildjob_h5, 'parts': result}, json_file, indent = 4)
+
+
+if __name__ == '__main__':
+    path_buildjob_h5 = '/home/jan/Documents/CodeTDMStoHDF/Ausgangsdaten/examplerRun.h5'
+    output_root = '/home/jan/Documents/Trainingsdaten/examplerRun_voxel_100_10'
+    configs = create_batch_configs(path_buildjob_h5, output_root, voxel_size = 100, num_layers_per_voxel = 10)
+    os.makedirs(output_root, exist_ok = True)
+    save_batch_json(path_buildjob_h5, output_root, run_batch(configs))
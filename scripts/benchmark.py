@@ -0,0 +1,368 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+End to end benchmark of the voxelization on a synthetic buildjob (see
+synthetic_buildjob.py), so performance changes can be compared on any machine:
+
+stages:    read, filter, bin of sampled slices (best of repeat) next to the legacy
+           functions they replaced (get_2D_data_from_h5_filtered with pandas, the
+           mask of create_single_voxel_array_storage_reduced per voxel)
+pipeline:  wall time of every scheduler on the whole part and its stage times
+           out of the instrumentation (see instrumentation.py)
+checks:    the filtered slices and the binned voxels equal the legacy outputs,
+           the voxel indexes of all the schedulers are equal
+
+Every run is appended as one json line to the history file. A run is compared to
+the last run with the same parameters, timings which got slower by more than the
+tolerance are reported as regressions. The script exits with 1 if a check failed
+or a regression was found (test_benchmark.py runs the checks with pytest)
+
+usage:
+python benchmark.py --workdir /tmp/voxel_benchmark --slices 40 --points 20000 --voxel-size 100 --layers 10
+'''
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import numpy as np
+import os
+import shutil
+import subprocess
+import sys
+import time
+import h5py
+import instrumentation
+from synthetic_buildjob import create_synthetic_buildjob, get_synthetic_parameters
+from voxel_config import VoxelizationConfig
+from voxel_index import load_voxel_index
+from helping_functions import get_2D_data_from_h5_filtered, filter_slice_columns, dock_array_to_zero, partition_array_by_voxel, get_voxel_segment, create_single_voxel_array_storage_reduced
+
+BENCHMARK_HISTORY_FILE_NAME = 'benchmark_history.jsonl'
+SCHEDULERS = ('layer', 'slice', 'pipeline')
+#modes where dropping identical rows first (legacy pandas filter) doesn't change the result
+LEGACY_COMPARABLE_MODES = ('max', 'min', 'first', 'last')
+
+
+'''
+-------------------------------------------------------------------------------
+time_function:
+function that returns the best time of repeat calls of function and its last result
+'''
+def time_function(function, repeat = 3):
+    best_seconds = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        best_seconds = min(best_seconds, time.perf_counter() - start_time)
+    return best_seconds, result
+
+
+def read_raw_columns(h5_path, part_name, Slice_name):
+    with h5py.File(h5_path, 'r') as h5:
+        return tuple(h5[part_name][Slice_name][column_name][:] for column_name in ('X-Axis', 'Y-Axis', 'Area', 'Intensity'))
+
+
+'''
+-------------------------------------------------------------------------------
+benchmark_stages:
+function that times read, filter and bin of some slices and the legacy functions
+and checks the new outputs against the legacy outputs
+
+inputs:
+config = VoxelizationConfig of the benchmark part
+slice_numbers = list of the sampled slice numbers (missing slices are skipped)
+repeat = int of number of calls per timing (the best is taken)
+legacy = bool whether the legacy functions are timed and compared
+
+outputs:
+tuple of dict stage -> seconds (summed over the slices) and dict check -> bool
+'''
+def benchmark_stages(config, slice_numbers, repeat = 3, legacy = True):
+    config.resolve()
+    stages = dict.fromkeys(('read', 'filter', 'bin') + (('legacy_filter', 'legacy_bin') if legacy else ()), 0.0)
+    checks = {}
+    with h5py.File(config.path_buildjob_h5, 'r') as h5:
+        slice_names = [config.get_slice_name(num_slice) for num_slice in slice_numbers if config.get_slice_name(num_slice) in h5[config.part_name]]
+
+    for Slice_name in slice_names:
+        seconds, raw_columns = time_function(lambda: read_raw_columns(config.path_buildjob_h5, config.part_name, Slice_name), repeat)
+        stages['read'] += seconds
+        seconds, array_filtered = time_function(lambda: filter_slice_columns(*raw_columns, mode = config.reduction_mode), repeat)
+        stages['filter'] += seconds
+        #dock_array_to_zero works in place -> every call gets a copy
+        seconds, (array_sorted, offsets) = time_function(lambda: partition_array_by_voxel(dock_array_to_zero(array_filtered.copy(), config.minX, config.minY), config.voxel_size, config.num_voxels_x, config.num_voxels_y), repeat)
+        stages['bin'] += seconds
+        if not legacy:
+            continue
+
+        with contextlib.redirect_stdout(io.StringIO()): #the legacy filter prints its timings
+            seconds, df_legacy = time_function(lambda: get_2D_data_from_h5_filtered(config.path_buildjob_h5, config.part_name, Slice_name, config.reduction_mode), 1)
+        stages['legacy_filter'] += seconds
+        if config.reduction_mode in LEGACY_COMPARABLE_MODES:
+            checks['filter_equals_legacy'] = checks.get('filter_equals_legacy', True) and np.array_equal(array_filtered, df_legacy.values.astype(array_filtered.dtype))
+
+        array_docked = dock_array_to_zero(array_filtered.copy(), config.minX, config.minY)
+        start_time = time.perf_counter()
+        legacy_voxels = [[create_single_voxel_array_storage_reduced(n_vox_x, n_vox_y, config.voxel_size, array_docked.copy()) for n_vox_x in range(config.num_voxels_x)] for n_vox_y in range(config.num_voxels_y)]
+        stages['legacy_bin'] += time.perf_counter() - start_time
+        bin_equal = True
+        for n_vox_y in range(config.num_voxels_y):
+            for n_vox_x in range(config.num_voxels_x):
+                voxel_segment = get_voxel_segment(array_sorted, offsets, n_vox_x, n_vox_y, config.num_voxels_x)
+                legacy_voxel = legacy_voxels[n_vox_y][n_vox_x]
+                bin_equal = bin_equal and np.array_equal(voxel_segment[np.lexsort(voxel_segment.T[::-1])], legacy_voxel[np.lexsort(legacy_voxel.T[::-1])])
+        checks['bin_equals_legacy'] = checks.get('bin_equals_legacy', True) and bin_equal
+    return stages, checks
+
+
+'''
+-------------------------------------------------------------------------------
+run_scheduler:
+function that voxelizes the part of config with one scheduler (all slices again)
+'''
+def run_scheduler(scheduler, config, max_workers = None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        if scheduler == 'layer':
+            from create_hdf_per_single_vox_layer_storage_reduced import create_voxel_layers
+            create_voxel_layers(config, max_workers = max_workers or 4, restart = True)
+        elif scheduler == 'slice':
+            from slice_scheduler import run_slice_scheduler
+            run_slice_scheduler(config, max_workers = max_workers, restart = True)
+        elif scheduler == 'pipeline':
+            from streaming_pipeline import run_streaming_pipeline
+            run_streaming_pipeline(config, max_workers = max_workers, report = False, restart = True)
+        else:
+            raise ValueError('scheduler has to be one of {}, not {}'.format(SCHEDULERS, scheduler))
+
+
+def indexes_equal(index, other_index):
+    #field by field (the statistics of empty voxels are NaN), the csr offsets depend on the order the slices were written in
+    field_names = [field_name for field_name in index.dtype.names if field_name != 'offset']
+    return index.shape == other_index.shape and all(np.array_equal(index[field_name], other_index[field_name], equal_nan = index.dtype[field_name].kind == 'f') for field_name in field_names)
+
+
+'''
+-------------------------------------------------------------------------------
+benchmark_pipeline:
+function that times the full voxelization of the part with every scheduler and
+checks that all the schedulers write the same voxels (voxel index)
+
+inputs:
+config_kwargs = dict of the VoxelizationConfig arguments without the output folder
+path_output_folder = str of the folder which gets one voxel folder per scheduler
+schedulers = list of the schedulers (see SCHEDULERS)
+max_workers = int of number of processes (None -> default of the scheduler)
+
+outputs:
+tuple of dict scheduler -> {'seconds', 'spans' (total seconds per stage), 'counters'}
+and dict check -> bool
+'''
+def benchmark_pipeline(config_kwargs, path_output_folder, schedulers = SCHEDULERS, max_workers = None):
+    results = {}
+    indexes = {}
+    for scheduler in schedulers:
+        path_voxel_h5_folder = os.path.join(path_output_folder, scheduler)
+        shutil.rmtree(path_voxel_h5_folder, ignore_errors = True)
+        config = VoxelizationConfig(path_voxel_h5_folder = path_voxel_h5_folder, **config_kwargs)
+
+        instrumentation.collect() #drops data of an earlier run
+        instrumentation.enable(track_memory = False) #tracemalloc would slow the timed run down
+        start_time = time.perf_counter()
+        try:
+            run_scheduler(scheduler, config, max_workers)
+        finally:
+            seconds = time.perf_counter() - start_time
+            snapshot = instrumentation.collect() or instrumentation.create_empty_snapshot()
+            instrumentation.disable()
+        results[scheduler] = {'seconds': seconds,
+                              'spans': {name: span_data['total_s'] for name, span_data in sorted(snapshot['spans'].items())},
+                              'counters': dict(sorted(snapshot['counters'].items()))}
+        indexes[scheduler] = load_voxel_index(path_voxel_h5_folder)
+
+    reference = schedulers[0]
+    checks = {'{}_equals_{}'.format(scheduler, reference): indexes_equal(indexes[scheduler], indexes[reference]) for scheduler in schedulers[1:]}
+    return results, checks
+
+
+'''
+-------------------------------------------------------------------------------
+get_git_commit:
+function that returns the short hash of the checked out commit (None outside of git)
+'''
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = os.path.dirname(os.path.abspath(__file__)),
+                              capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+'''
+-------------------------------------------------------------------------------
+get_timings / find_regressions:
+get_timings flattens the timings of a benchmark result to name -> seconds,
+find_regressions compares them with the last run of the history with the same
+parameters and returns the timings which got slower by more than tolerance
+'''
+def get_timings(result):
+    timings = {'stage/' + name: seconds for name, seconds in result['stages'].items()}
+    for scheduler, scheduler_result in result['pipeline'].items():
+        timings['pipeline/' + scheduler] = scheduler_result['seconds']
+        timings.update({'pipeline/{}/{}'.format(scheduler, name): seconds for name, seconds in scheduler_result['spans'].items()})
+    return timings
+
+
+def load_history(path_history):
+    if not os.path.isfile(path_history):
+        return []
+    with open(path_history) as history_file:
+        return [json.loads(line) for line in history_file if line.strip()]
+
+
+def find_regressions(result, history, tolerance = 0.2, min_seconds = 0.01):
+    previous = [entry for entry in history if entry['parameters'] == result['parameters']]
+    if not previous:
+        return []
+    previous_timings = get_timings(previous[-1])
+    regressions = []
+    for name, seconds in get_timings(result).items():
+        previous_seconds = previous_timings.get(name)
+        #very short timings are mostly noise
+        if previous_seconds is not None and seconds >= min_seconds and seconds > previous_seconds*(1 + tolerance):
+            regressions.append({'name': name, 'previous_s': previous_seconds, 'current_s': seconds, 'previous_commit': previous[-1].get('commit')})
+    return regressions
+
+
+'''
+-------------------------------------------------------------------------------
+get_synthetic_buildjob:
+function that writes the synthetic buildjob, unless the file already exists with
+the same generation parameters (writing it takes longer than a small benchmark)
+
+outputs:
+dict of the generation parameters
+'''
+def get_synthetic_buildjob(path_buildjob_h5, buildjob_kwargs):
+    arguments = inspect.signature(create_synthetic_buildjob).bind(path_buildjob_h5, **buildjob_kwargs)
+    arguments.apply_defaults()
+    requested = {name: value for name, value in arguments.arguments.items() if name != 'path'}
+    requested['dtype'] = np.dtype(requested['dtype']).name
+    requested = json.loads(json.dumps(requested)) #tuples -> lists like in the stored parameters
+    if os.path.isfile(path_buildjob_h5) and get_synthetic_parameters(path_buildjob_h5) == requested:
+        return requested
+    return create_synthetic_buildjob(path_buildjob_h5, **buildjob_kwargs)
+
+
+'''
+-------------------------------------------------------------------------------
+run_benchmark:
+function that creates (or reuses) the synthetic buildjob, runs the stage and the
+pipeline benchmark, appends the result to the history and reports regressions
+
+inputs:
+path_workdir = str of the folder of the synthetic buildjob, the voxel folders and the history
+buildjob_kwargs = dict of arguments of create_synthetic_buildjob
+voxel_size = int of voxel x and y dimensions
+num_layers_per_voxel = int of number of slices per voxel
+output_format = str of the layout ('groups' or 'csr')
+reduction_mode = str of the reduction of multiple x,y-occurences
+schedulers = list of the benchmarked schedulers
+num_sample_slices = int of number of slices of the stage benchmark
+repeat = int of number of calls per stage timing
+legacy = bool whether the legacy functions are benchmarked and compared
+max_workers = int of number of processes of the schedulers
+tolerance = float of relative slowdown which counts as regression
+path_history = str of the history file (None -> workdir/benchmark_history.jsonl)
+
+outputs:
+dict of the result with the keys 'regressions' and 'checks'
+'''
+def run_benchmark(path_workdir, buildjob_kwargs = None, voxel_size = 100, num_layers_per_voxel = 10, output_format = 'groups', reduction_mode = 'max',
+                  schedulers = SCHEDULERS, num_sample_slices = 3, repeat = 3, legacy = True, max_workers = None, tolerance = 0.2, path_history = None):
+    os.makedirs(path_workdir, exist_ok = True)
+    path_buildjob_h5 = os.path.join(path_workdir, 'synthetic_buildjob.h5')
+    parameters_buildjob = get_synthetic_buildjob(path_buildjob_h5, buildjob_kwargs or {})
+
+    part_name = parameters_buildjob['part_names'][0]
+    config_kwargs = {'path_buildjob_h5': path_buildjob_h5, 'part_name': part_name, 'voxel_size': voxel_size, 'num_layers_per_voxel': num_layers_per_voxel,
+                     'output_format': output_format, 'reduction_mode': reduction_mode}
+    sample_config = VoxelizationConfig(path_voxel_h5_folder = None, **config_kwargs)
+    slice_numbers = np.linspace(0, sample_config.max_slice_number - 1, num_sample_slices).astype(int).tolist()
+
+    stages, stage_checks = benchmark_stages(sample_config, slice_numbers, repeat, legacy)
+    pipeline, pipeline_checks = benchmark_pipeline(config_kwargs, os.path.join(path_workdir, 'voxels'), list(schedulers), max_workers)
+
+    result = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'commit': get_git_commit(),
+              'cpu_count': os.cpu_count(),
+              'parameters': {'buildjob': parameters_buildjob, 'voxel_size': voxel_size, 'num_layers_per_voxel': num_layers_per_voxel,
+                             'output_format': output_format, 'reduction_mode': reduction_mode, 'sample_slices': slice_numbers,
+                             'repeat': repeat, 'max_workers': max_workers},
+              'stages': stages,
+              'pipeline': pipeline,
+              'checks': dict(stage_checks, **pipeline_checks)}
+
+    if path_history is None:
+        path_history = os.path.join(path_workdir, BENCHMARK_HISTORY_FILE_NAME)
+    regressions = find_regressions(result, load_history(path_history), tolerance)
+    with open(path_history, 'a') as history_file:
+        history_file.write(json.dumps(result) + '\n')
+    result['regressions'] = regressions
+    return result
+
+
+'''
+-------------------------------------------------------------------------------
+get_failures:
+function that returns the failed checks and the regressions of a result (empty
+list -> the benchmark passed)
+'''
+def get_failures(result):
+    return (['check {}'.format(name) for name, passed in result['checks'].items() if not passed] +
+            ['regression {}'.format(regression['name']) for regression in result['regressions']])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'benchmark of the voxelization on a synthetic buildjob')
+    parser.add_argument('--workdir', required = True, help = 'folder of the synthetic buildjob, the voxel outputs and the history')
+    parser.add_argument('--slices', type = int, default = 40, help = 'number of slices of the synthetic part')
+    parser.add_argument('--points', type = int, default = 20000, help = 'mean number of datapoints per slice')
+    parser.add_argument('--footprint', default = 'rectangle', help = 'shape of the synthetic part')
+    parser.add_argument('--size', type = int, nargs = 2, default = [1000, 600], help = 'width and height of the synthetic part')
+    parser.add_argument('--voxel-size', type = int, default = 100, help = 'x and y dimension of a voxel')
+    parser.add_argument('--layers', type = int, default = 10, help = 'number of slices per voxel')
+    parser.add_argument('--format', default = 'groups', choices = ('groups', 'csr'), help = 'layout of the voxel files')
+    parser.add_argument('--schedulers', nargs = '+', default = list(SCHEDULERS), choices = SCHEDULERS, help = 'benchmarked schedulers')
+    parser.add_argument('--workers', type = int, default = None, help = 'number of processes of the schedulers')
+    parser.add_argument('--sample-slices', type = int, default = 3, help = 'number of slices of the stage benchmark')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'number of calls per stage timing (the best is taken)')
+    parser.add_argument('--no-legacy', action = 'store_true', help = 'skip the legacy functions (slow for small voxels)')
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = 'relative slowdown reported as regression')
+    parser.add_argument('--history', default = None, help = 'path of the history (default: <workdir>/benchmark_history.jsonl)')
+    args = parser.parse_args()
+
+    result = run_benchmark(args.workdir, buildjob_kwargs = {'num_slices': args.slices, 'points_per_slice': args.points, 'footprint': args.footprint, 'footprint_size': args.size},
+                           voxel_size = args.voxel_size, num_layers_per_voxel = args.layers, output_format = args.format, schedulers = args.schedulers,
+                           num_sample_slices = args.sample_slices, repeat = args.repeat, legacy = not args.no_legacy, max_workers = args.workers,
+                           tolerance = args.tolerance, path_history = args.history)
+
+    print('{:<34}{:>12}'.format('stage (sampled slices)', 'seconds'))
+    for name, seconds in result['stages'].items():
+        print('{:<34}{:>12.4f}'.format(name, seconds))
+    print('{:<34}{:>12}'.format('pipeline', 'seconds'))
+    for scheduler, scheduler_result in result['pipeline'].items():
+        print('{:<34}{:>12.4f}'.format(scheduler, scheduler_result['seconds']))
+        for name, seconds in scheduler_result['spans'].items():
+            print('  {:<32}{:>12.4f}'.format(name, seconds))
+    for name, passed in result['checks'].items():
+        print('check {:<28}{:>12}'.format(name, 'ok' if passed else 'FAILED'))
+    for regression in result['regressions']:
+        print('REGRESSION {name}: {previous_s:.4f} s -> {current_s:.4f} s (since {previous_commit})'.format(**regression))
+    #exit code 1 for failed checks and regressions, so a CI job can gate on the benchmark
+    failures = get_failures(result)
+    if failures:
+        print('benchmark failed: {}'.format(', '.join(failures)))
+        sys.exit(1)
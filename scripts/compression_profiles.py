@@ -0,0 +1,143 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Named compression/filter profiles for all the datasets written by the voxel
+writers and a benchmark (--tune) which writes and reads back a few real slices
+with every profile to find the best tradeoff for a storage tier
+
+usage:
+python compression_profiles.py --tune path_buildjob_h5 part_name --slices 10 20 30
+'''
+import h5py
+import numpy as np
+import os
+import time
+import argparse
+import tempfile
+
+#Blosc/Zstd filters are only available if the hdf5plugin package is installed
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+
+'''
+-------------------------------------------------------------------------------
+COMPRESSION_PROFILES:
+keyword arguments for h5py's create_dataset of every profile. 'scaleoffset' is
+lossless for integer columns only and is left out for float columns
+'''
+COMPRESSION_PROFILES = {
+    'none': {},
+    'lzf': {'compression': 'lzf'},
+    'gzip-1': {'compression': 'gzip', 'compression_opts': 1},
+    'gzip-4': {'compression': 'gzip', 'compression_opts': 4},
+    'gzip-9': {'compression': 'gzip', 'compression_opts': 9},
+    'shuffle-gzip': {'shuffle': True, 'compression': 'gzip', 'compression_opts': 4},
+    'scaleoffset': {'scaleoffset': 0},
+    'scaleoffset-gzip': {'scaleoffset': 0, 'compression': 'gzip', 'compression_opts': 4},
+}
+
+if hdf5plugin is not None:
+    COMPRESSION_PROFILES['blosc-lz4'] = dict(hdf5plugin.Blosc(cname = 'lz4', clevel = 5, shuffle = hdf5plugin.Blosc.SHUFFLE))
+    COMPRESSION_PROFILES['blosc-zstd'] = dict(hdf5plugin.Blosc(cname = 'zstd', clevel = 5, shuffle = hdf5plugin.Blosc.SHUFFLE))
+    COMPRESSION_PROFILES['zstd'] = dict(hdf5plugin.Zstd(clevel = 3))
+
+
+'''
+-------------------------------------------------------------------------------
+get_dataset_kwargs:
+function that returns the keyword arguments of a profile for create_dataset
+
+inputs:
+profile = str of the name of the profile (see COMPRESSION_PROFILES)
+dtype = dtype of the dataset (scaleoffset is only used for integer dtypes)
+
+outputs:
+dict of keyword arguments
+'''
+def get_dataset_kwargs(profile, dtype = None):
+    if profile not in COMPRESSION_PROFILES:
+        raise ValueError('compression profile has to be one of {}, not {}'.format(sorted(COMPRESSION_PROFILES), profile))
+    kwargs = dict(COMPRESSION_PROFILES[profile])
+    if 'scaleoffset' in kwargs and (dtype is None or not np.issubdtype(np.dtype(dtype), np.integer)):
+        del kwargs['scaleoffset']
+    return kwargs
+
+
+'''
+-------------------------------------------------------------------------------
+tune_compression_profiles:
+function that writes the columns of some real slices with every profile into a
+temporary hdf5 and reads them back
+
+inputs:
+h5_path = str of path to the buildjob hdf5
+part_name = str of name of the part
+slice_numbers = list of slice numbers to sample (0 -> Slice00001)
+profiles = list of names of the profiles to test (default: all available)
+chunk_size = int of chunk length of the columns
+
+outputs:
+list of dicts with profile, bytes_raw, bytes_written, ratio, write_MB_s and read_MB_s
+(throughputs are relative to the raw size)
+'''
+def tune_compression_profiles(h5_path, part_name, slice_numbers, profiles = None, chunk_size = 2**16):
+    from helping_functions import get_2D_data_from_h5_filtered_np
+
+    if profiles is None:
+        profiles = list(COMPRESSION_PROFILES)
+
+    arrays = [get_2D_data_from_h5_filtered_np(h5_path, part_name, 'Slice' + str("{:05d}".format(num_slice+1))) for num_slice in slice_numbers]
+    array = np.vstack(arrays)
+    columns = {'X-Axis': array[:,0], 'Y-Axis': array[:,1], 'Area': array[:,2], 'Intensity': array[:,3]}
+    bytes_raw = sum(column.nbytes for column in columns.values())
+    if bytes_raw == 0:
+        raise ValueError('the sampled slices {} of {} are empty'.format(list(slice_numbers), part_name))
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        for profile in profiles:
+            path = os.path.join(tmp_folder, '{}.hdf5'.format(profile))
+
+            start_time = time.time()
+            with h5py.File(path, 'w') as h5:
+                for column_name, column in columns.items():
+                    h5.create_dataset(column_name, data = column, chunks = (min(chunk_size, column.size),), **get_dataset_kwargs(profile, column.dtype))
+            write_time = time.time() - start_time
+
+            start_time = time.time()
+            with h5py.File(path, 'r') as h5:
+                for column_name, column in columns.items():
+                    if not np.array_equal(h5[column_name][:], column):
+                        raise ValueError('profile {} is not lossless for {}'.format(profile, column_name))
+            read_time = time.time() - start_time
+
+            bytes_written = os.path.getsize(path)
+            results.append({'profile': profile,
+                            'bytes_raw': bytes_raw,
+                            'bytes_written': bytes_written,
+                            'ratio': bytes_raw / bytes_written,
+                            'write_MB_s': bytes_raw / 1024**2 / max(write_time, 1e-9),
+                            'read_MB_s': bytes_raw / 1024**2 / max(read_time, 1e-9)})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'compression profiles of the voxel writers')
+    parser.add_argument('--tune', nargs = 2, metavar = ('BUILDJOB_H5', 'PART_NAME'), help = 'benchmark all profiles on real slices')
+    parser.add_argument('--slices', nargs = '+', type = int, default = [0], help = 'slice numbers to sample (0 -> Slice00001)')
+    parser.add_argument('--profiles', nargs = '+', default = None, help = 'profiles to benchmark (default: all available)')
+    args = parser.parse_args()
+
+    if args.tune is None:
+        for profile in COMPRESSION_PROFILES:
+            print(profile)
+    else:
+        results = tune_compression_profiles(args.tune[0], args.tune[1], args.slices, args.profiles)
+        print('{:<18}{:>14}{:>10}{:>14}{:>14}'.format('profile', 'bytes', 'ratio', 'write MB/s', 'read MB/s'))
+        for result in results:
+            print('{:<18}{:>14}{:>10.2f}{:>14.1f}{:>14.1f}'.format(result['profile'], result['bytes_written'], result['ratio'], result['write_MB_s'], result['read_MB_s']))
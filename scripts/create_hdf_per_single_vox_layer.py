@@ -8,57 +8,106 @@ The function is used to create voxels
 import h5py
 import numpy as np
 import time
-from Definitions import  minX, minY, num_voxels_x, num_voxels_y, path_buildjob_h5, num_layers_per_voxel, part_name,  voxel_size, num_z_list, path_voxel_h5_folder #path_voxel_h5,
-from helping_functions import get_2D_data_from_h5_filtered_np, dock_array_to_zero, create_single_voxel_array
+from helping_functions import get_2D_data_from_h5_filtered_np, dock_array_to_zero, partition_array_by_voxel, get_voxel_segment, fill_voxel_array, fill_dense_slice
+from voxel_writer import VoxelLayerWriter, DenseVoxelWriter
+from run_manifest import RunManifest, prepare_manifest, get_pending_slices
+import instrumentation
+import collections
 import concurrent.futures
+import itertools
 import multiprocessing
 import os
 
-def create_single_vox_layer (num_z):
-    path = path_voxel_h5_folder + '/Voxel_layer:_{}.hdf5'.format(num_z)
-    start_time_1 = time.time()
-    for num_slice in range(num_layers_per_voxel*num_z, num_layers_per_voxel*(num_z+1)):
-        start_time_2 = time.time()
-        print('num_slice: ' + str(num_slice))
-        #start_time = time.time()
-        # getting the data of the part_hdf5
-        #check whether slice is existing in h5 file is performed in get_2D_data_from_h5_filtered_np
-        array_not_docked = get_2D_data_from_h5_filtered_np(path_buildjob_h5, part_name, 'Slice' + str("{:05d}".format(num_slice+1))) #"{:05d}" -> 1 becomes 00001 for accessibility in h5 file
-        array = dock_array_to_zero(array_not_docked, minX, minY) #docking the values of the dataframe to 0
+def create_single_vox_layer (num_z, config, completed = frozenset()):
+    manifest = RunManifest(config.path_voxel_h5_folder, 'layer_{}'.format(num_z))
+    #one open handle per layer file, the data of every slice is written in one batch
+    with VoxelLayerWriter(config.path_voxel_h5_folder, flush_policy = 'slice', file_name = 'Voxel_layer:_{}.hdf5', compression = config.compression) as writer:
+        for num_slice in get_pending_slices(config, completed, range(config.num_layers_per_voxel*num_z, config.num_layers_per_voxel*(num_z+1))):
+            #start_time = time.time()
+            # getting the data of the part_hdf5
+            #check whether slice is existing in h5 file is performed in get_2D_data_from_h5_filtered_np
+            array_not_docked = get_2D_data_from_h5_filtered_np(config.path_buildjob_h5, config.part_name, config.get_slice_name(num_slice), config.reduction_mode)
+            array = dock_array_to_zero(array_not_docked, config.minX, config.minY) #docking the values of the dataframe to 0
+            #binning all the datapoints of the slice into the voxel grid once instead of masking the slice for every voxel
+            with instrumentation.span('bin'):
+                array_sorted, offsets = partition_array_by_voxel(array, config.voxel_size, config.num_voxels_x, config.num_voxels_y)
 
-        for n_vox_y_init in range(num_voxels_y): #iterating over number of voxels in y-direction
-            #print('n_vox_y_init: ' + str(n_vox_y_init))
-            for n_vox_x_init in range(num_voxels_x):#iterating over number of voxels in x-direction
-                #print('n_vox_x_init: '+ str(n_vox_x_init))
-                array_voxel_final = create_single_voxel_array(n_vox_x_init, n_vox_y_init, voxel_size, array)
+            for n_vox_y_init in range(config.num_voxels_y): #iterating over number of voxels in y-direction
+                #print('n_vox_y_init: ' + str(n_vox_y_init))
+                for n_vox_x_init in range(config.num_voxels_x):#iterating over number of voxels in x-direction
+                    #print('n_vox_x_init: '+ str(n_vox_x_init))
+                    array_voxel_final = fill_voxel_array(get_voxel_segment(array_sorted, offsets, n_vox_x_init, n_vox_y_init, config.num_voxels_x), n_vox_x_init, n_vox_y_init, config.voxel_size)
 
+                    #the voxel data is collected by the writer and written to the layer file in one batch per slice
+                    writer.add_voxel(num_z, n_vox_x_init, n_vox_y_init, num_slice-num_z*config.num_layers_per_voxel, {'X-Axis': np.repeat(np.arange(0,config.voxel_size,1),config.voxel_size),
+                                                                                                                  'Y-Axis': np.tile(np.arange(0,config.voxel_size,1),config.voxel_size),
+                                                                                                                  'Area': array_voxel_final[:,2],
+                                                                                                                  'Intensity': array_voxel_final[:,3]})
+            writer.end_slice()
+            manifest.mark_completed(num_z, num_slice-num_z*config.num_layers_per_voxel)
+    return instrumentation.collect()
 
-                #check if File is already existing -> path still needs to be defined
-                if not os.path.isfile(path):
-                    voxel_hdf = h5py.File(path, "w")
-                    voxel_hdf.close()
+'''
+dense output mode: the slices of a voxel layer are filled into one block of shape
+(num_layers_per_voxel, Y, X, channels) which is written by the parent process into
+one chunked dataset per part (coordinate grids are implied by the position)
+'''
+def create_dense_vox_layer (num_z, config):
+    layer_block = []
+    for num_slice in range(config.num_layers_per_voxel*num_z, config.num_layers_per_voxel*(num_z+1)):
+        array_not_docked = get_2D_data_from_h5_filtered_np(config.path_buildjob_h5, config.part_name, config.get_slice_name(num_slice), config.reduction_mode)
+        array = dock_array_to_zero(array_not_docked, config.minX, config.minY)
+        with instrumentation.span('bin'):
+            layer_block.append(fill_dense_slice(array, config.voxel_size, config.num_voxels_x, config.num_voxels_y))
+    return np.stack(layer_block), instrumentation.collect()
+
+'''
+create_voxel_layers:
+function that resolves the config once in this process and fills all the voxel
+layers in a process pool (the workers get the resolved config). Slices completed
+by an earlier run with the same inputs are skipped (see run_manifest.py), in the
+dense mode only whole voxel layers are skipped. A dense layer block is the full
+(layers, Y, X, channels) grid of a voxel layer, so at most max_workers layers are
+computed ahead of the writer
+'''
+def create_voxel_layers (config, max_workers = 4, restart = False):
+    if config.is_strided:
+        raise ValueError('the full grid and the dense layout are written without overlapping voxels, use the storage reduced layouts for stride_xy/stride_z')
+    config.resolve()
+    config.make_output_folder()
+    config.save_json(os.path.join(config.path_voxel_h5_folder, 'voxelization_config.json'))
+    completed = prepare_manifest(config, restart, full_grid = config.output_format != 'dense')
+    num_z_list = sorted(set(num_slice//config.num_layers_per_voxel for num_slice in get_pending_slices(config, completed)))
 
-                with h5py.File(path, "a") as voxel_hdf:
-                    #creating a voxel with the numbers of voxels in both direction in its name and filling it with data
-                    #if group is already existing don't create a new group
-                    if 'voxel_{}_{}_{}'.format(n_vox_x_init,n_vox_y_init, num_z) not in voxel_hdf:
-                        voxel_hdf.create_group('voxel_{}_{}_{}'.format(n_vox_x_init,n_vox_y_init,num_z))
-                    voxel_hdf['voxel_{}_{}_{}'.format(n_vox_x_init,n_vox_y_init,num_z)].create_group('slice_{}'.format(num_slice-num_z*num_layers_per_voxel)) #-num_z*num_slices_vox wegen
-                    voxel_hdf['voxel_{}_{}_{}'.format(n_vox_x_init,n_vox_y_init,num_z)]['slice_{}'.format(num_slice-num_z*num_layers_per_voxel)].create_dataset('X-Axis',data = np.repeat(np.arange(0,voxel_size,1),voxel_size))
-                    voxel_hdf['voxel_{}_{}_{}'.format(n_vox_x_init,n_vox_y_init,num_z)]['slice_{}'.format(num_slice-num_z*num_layers_per_voxel)].create_dataset('Y-Axis',data = np.tile(np.arange(0,voxel_size,1),voxel_size))
-                    voxel_hdf['voxel_{}_{}_{}'.format(n_vox_x_init,n_vox_y_init,num_z)]['slice_{}'.format(num_slice-num_z*num_layers_per_voxel)].create_dataset('Area', data = array_voxel_final[:,2])
-                    voxel_hdf['voxel_{}_{}_{}'.format(n_vox_x_init,n_vox_y_init,num_z)]['slice_{}'.format(num_slice-num_z*num_layers_per_voxel)].create_dataset('Intensity', data = array_voxel_final[:,3])
-        print('filling slice {} took {} s'.format(num_slice, time.time() - start_time_2))
-    print("layer filling took %s seconds ---" % (time.time() - start_time_1))
+    with concurrent.futures.ProcessPoolExecutor(max_workers = max_workers, initializer = instrumentation.init_process, initargs = (instrumentation.get_settings(),)) as executor:
+        if config.output_format == 'dense':
+            #only the parent process writes into the single dense file
+            with DenseVoxelWriter(config.path_voxel_h5_folder + '/Voxels_dense.hdf5', config.part_name, config.num_voxels_x, config.num_voxels_y, config.num_voxels_z, config.voxel_size, config.num_layers_per_voxel, compression = config.compression) as writer:
+                manifest = RunManifest(config.path_voxel_h5_folder)
+                num_z_iterator = iter(num_z_list)
+                in_flight = collections.deque((num_z, executor.submit(create_dense_vox_layer, num_z, config)) for num_z in itertools.islice(num_z_iterator, max_workers))
+                while in_flight:
+                    #the layers are written in num_z order, the next layer is submitted before the write
+                    num_z, future = in_flight.popleft()
+                    layer_block, snapshot = future.result()
+                    for num_z_next in itertools.islice(num_z_iterator, 1):
+                        in_flight.append((num_z_next, executor.submit(create_dense_vox_layer, num_z_next, config)))
+                    instrumentation.merge(snapshot)
+                    writer.write_layer(num_z, layer_block)
+                    for num_slice_voxel in range(config.num_layers_per_voxel):
+                        manifest.mark_completed(num_z, num_slice_voxel)
+        else:
+            for snapshot in executor.map(create_single_vox_layer, num_z_list, itertools.repeat(config), itertools.repeat(completed)):
+                instrumentation.merge(snapshot)
 
 
 if __name__ == '__main__':
+    from Definitions import config
     #1.Step creating an empty hdf5 file for the voxels
     #voxel_hdf = h5py.File(path_voxel_h5, "w")
     #voxel_hdf.close()
     #2. Multiprocessed filling up of voxel layers
-    with concurrent.futures.ProcessPoolExecutor(max_workers = 4) as executor:
-        executor.map(create_single_vox_layer, num_z_list)
+    create_voxel_layers(config, max_workers = 4)
 
 #    p1 = multiprocessing.Process(target=create_single_vox_layer, args=(0, ))
 #    p2 = multiprocessing.Process(target=create_single_vox_layer, args=(1, ))
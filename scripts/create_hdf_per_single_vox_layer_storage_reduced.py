@@ -8,57 +8,101 @@ The function is used to create voxels
 import h5py
 import numpy as np
 import time
-from Definitions import  minX, minY, num_voxels_x, num_voxels_y, path_buildjob_h5, num_layers_per_voxel, part_name,  voxel_size, num_z_list, path_voxel_h5_folder #path_voxel_h5,
-from helping_functions import get_2D_data_from_h5_filtered_np, dock_array_to_zero, create_single_voxel_array_storage_reduced
+from helping_functions import get_2D_data_from_h5_filtered_np, dock_array_to_zero, partition_array_by_voxel, partition_array_by_window
+from voxel_writer import create_voxel_layer_writer
+from run_manifest import RunManifest, prepare_manifest, get_pending_slices
+from voxel_index import build_voxel_index
+from voxel_features import get_feature_extractor, build_feature_table
+import instrumentation
 import concurrent.futures
+import itertools
 import multiprocessing
 import os
 
-def create_single_vox_layer (num_z):
-    path = path_voxel_h5_folder + '/Voxel_layer_{}.hdf5'.format(num_z)
-    start_time_1 = time.time()
-    for num_slice in range(num_layers_per_voxel*num_z, num_layers_per_voxel*(num_z+1)):
-        start_time_2 = time.time()
-        print('num_slice: ' + str(num_slice))
-        #start_time = time.time()
-        # getting the data of the part_hdf5
-        #check whether slice is existing in h5 file is performed in get_2D_data_from_h5_filtered_np
-        array_not_docked = get_2D_data_from_h5_filtered_np(path_buildjob_h5, part_name, 'Slice' + str("{:05d}".format(num_slice+1))) #"{:05d}" -> 1 becomes 00001 for accessibility in h5 file
-        array = dock_array_to_zero(array_not_docked, minX, minY) #docking the values of the dataframe to 0
+'''
+create_slice_array:
+function that reads, filters, docks and bins one slice of the part. Returns the
+slice array sorted by voxel (voxel coordinates) and the offsets of the voxels
+(see partition_array_by_voxel)
+'''
+def create_slice_array (num_slice, config):
+    # getting the data of the part_hdf5
+    #check whether slice is existing in h5 file is performed in get_2D_data_from_h5_filtered_np
+    array_not_docked = get_2D_data_from_h5_filtered_np(config.path_buildjob_h5, config.part_name, config.get_slice_name(num_slice), config.reduction_mode)
+    return bin_slice_array(array_not_docked, config)
 
-        for n_vox_y_init in range(num_voxels_y): #iterating over number of voxels in y-direction
-            #print('n_vox_y_init: ' + str(n_vox_y_init))
-            for n_vox_x_init in range(num_voxels_x):#iterating over number of voxels in x-direction
-                #print('n_vox_x_init: '+ str(n_vox_x_init))
-                array_voxel_final = create_single_voxel_array_storage_reduced(n_vox_x_init, n_vox_y_init, voxel_size, array)
+'''
+bin_slice_array:
+function that docks a filtered slice array to zero and bins it into the voxel grid
+(overlapping voxels of a config with stride_xy < voxel_size, see partition_array_by_window)
+'''
+def bin_slice_array (array_not_docked, config):
+    with instrumentation.span('bin'):
+        array = dock_array_to_zero(array_not_docked, config.minX, config.minY) #docking the values of the dataframe to 0
+        if config.voxel_stride != config.voxel_size:
+            return partition_array_by_window(array, config.voxel_size, config.voxel_stride, config.num_voxels_x, config.num_voxels_y)
+        #binning all the datapoints of the slice into the voxel grid once instead of masking the slice for every voxel
+        return partition_array_by_voxel(array, config.voxel_size, config.num_voxels_x, config.num_voxels_y)
 
+'''
+get_slice_columns:
+function that returns the columns of the voxel files out of a binned slice array
+'''
+def get_slice_columns (array_sorted):
+    return {'X-Axis': array_sorted[:,0],
+            'Y-Axis': array_sorted[:,1],
+            'Area': array_sorted[:,2],
+            'Intensity': array_sorted[:,3]}
 
-                #check if File is already existing -> path still needs to be defined
-                if not os.path.isfile(path):
-                    voxel_hdf = h5py.File(path, "w")
-                    voxel_hdf.close()
+def create_single_vox_layer (num_z, config, completed = frozenset()):
+    manifest = RunManifest(config.path_voxel_h5_folder, 'layer_{}'.format(num_z))
+    #one open handle per layer file, the data of every slice is written in one batch
+    with create_voxel_layer_writer(config.output_format, config.path_voxel_h5_folder, config.num_voxels_x, config.num_voxels_y, config.num_layers_per_voxel, flush_policy = 'slice', compression = config.compression, skip_empty = config.skip_empty_voxels, features = get_feature_extractor(config)) as writer:
+        for num_slice in config.get_layer_slices(num_z):
+            num_slice_voxel = num_slice - num_z*config.layer_stride
+            if (num_z, num_slice_voxel) in completed:
+                continue
+            array_sorted, offsets = create_slice_array(num_slice, config)
+
+            #all the voxels of the slice are handed to the writer at once and written in one batch per slice
+            writer.add_slice(num_z, num_slice_voxel, get_slice_columns(array_sorted), offsets, config.num_voxels_x)
+            writer.end_slice()
+            #the slice is flushed -> it is skipped by a rerun
+            manifest.mark_completed(num_z, num_slice_voxel)
+    #the spans and counters of the layer go back to the parent process (see instrumentation.py)
+    return instrumentation.collect()
+
+
+'''
+create_voxel_layers:
+function that resolves the config once in this process and fills all the voxel
+layers in a process pool (the workers get the resolved config). Slices completed
+by an earlier run with the same inputs are skipped (see run_manifest.py). With
+overlapping voxel layers (stride_z) a slice is read by every layer task which
+contains it, the slice scheduler and the pipeline read it once
+'''
+def create_voxel_layers (config, max_workers = 4, restart = False):
+    config.resolve()
+    config.make_output_folder()
+    config.save_json(os.path.join(config.path_voxel_h5_folder, 'voxelization_config.json'))
+    completed = prepare_manifest(config, restart)
+    num_z_list = sorted(set(num_z for num_slice in get_pending_slices(config, completed) for num_z, num_slice_voxel in config.get_voxel_layers(num_slice) if (num_z, num_slice_voxel) not in completed))
 
-                with h5py.File(path, "a") as voxel_hdf:
-                    #creating a voxel with the numbers of voxels in both direction in its name and filling it with data
-                    #if group is already existing don't create a new group
-                    if 'voxel_{}_{}_{}'.format(n_vox_x_init,n_vox_y_init, num_z) not in voxel_hdf:
-                        voxel_hdf.create_group('voxel_{}_{}_{}'.format(n_vox_x_init,n_vox_y_init,num_z))
-                    voxel_hdf['voxel_{}_{}_{}'.format(n_vox_x_init,n_vox_y_init,num_z)].create_group('slice_{}'.format(num_slice-num_z*num_layers_per_voxel)) #-num_z*num_slices_vox wegen
-                    voxel_hdf['voxel_{}_{}_{}'.format(n_vox_x_init,n_vox_y_init,num_z)]['slice_{}'.format(num_slice-num_z*num_layers_per_voxel)].create_dataset('X-Axis',data = array_voxel_final[:,0])
-                    voxel_hdf['voxel_{}_{}_{}'.format(n_vox_x_init,n_vox_y_init,num_z)]['slice_{}'.format(num_slice-num_z*num_layers_per_voxel)].create_dataset('Y-Axis',data = array_voxel_final[:,1])
-                    voxel_hdf['voxel_{}_{}_{}'.format(n_vox_x_init,n_vox_y_init,num_z)]['slice_{}'.format(num_slice-num_z*num_layers_per_voxel)].create_dataset('Area', data = array_voxel_final[:,2])
-                    voxel_hdf['voxel_{}_{}_{}'.format(n_vox_x_init,n_vox_y_init,num_z)]['slice_{}'.format(num_slice-num_z*num_layers_per_voxel)].create_dataset('Intensity', data = array_voxel_final[:,3])
-        print('filling slice {} took {} s'.format(num_slice, time.time() - start_time_2))
-    print("layer filling took %s seconds ---" % (time.time() - start_time_1))
+    with concurrent.futures.ProcessPoolExecutor(max_workers = max_workers, initializer = instrumentation.init_process, initargs = (instrumentation.get_settings(),)) as executor:
+        for snapshot in executor.map(create_single_vox_layer, num_z_list, itertools.repeat(config), itertools.repeat(completed)):
+            instrumentation.merge(snapshot)
+    build_voxel_index(config.path_voxel_h5_folder)
+    if config.features:
+        build_feature_table(config.path_voxel_h5_folder)
 
 
 if __name__ == '__main__':
+    from Definitions import config
     #1.Step creating an empty hdf5 file for the voxels
     #voxel_hdf = h5py.File(path_voxel_h5, "w")
     #voxel_hdf.close()
     #2. Multiprocessed filling up of voxel layers
-    with concurrent.futures.ProcessPoolExecutor(max_workers = 4) as executor:
-        executor.map(create_single_vox_layer, num_z_list)
+    create_voxel_layers(config, max_workers = 4)
 
     # both processes finished
     print("Done!")
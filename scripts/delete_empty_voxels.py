@@ -9,25 +9,104 @@ The function is used to delete voxels that are completely empty
 import h5py
 import numpy as np
 import os
+import instrumentation
+import shutil
+import subprocess
+from voxel_writer import load_voxel_tables
 
 
-def delete_empty_voxels(voxel_folder, num_layers_per_voxel):
-    h5_list = os.listdir(voxel_folder)
+'''
+-------------------------------------------------------------------------------
+get_empty_voxel_keys:
+function that returns the names of the empty voxel groups of a layer file of the
+'groups' layout. Layers written with a grid_shape (see VoxelLayerWriter) have an
+occupancy bitmap in their tables (voxel_tables/layer_{z}.npz), so no voxel data
+is read. For older files every slice of every voxel is looked at
 
-    for h5_file in h5_list:
-        with h5py.File(voxel_folder + '/' + h5_file,'a') as h5:
-            key_list = h5.keys()
-            for key in key_list:
-                size_slice_cnt = 0
-                for num_slice in range(num_layers_per_voxel):
-                    size_slice = h5[key]['slice_{}'.format(num_slice)]['Area'].size #could be any other data column instead of 'Area' as well
-                    size_slice_cnt += size_slice
-                if size_slice_cnt == 0:
-                    del h5[key]
+inputs:
+h5 = open h5py.File of the layer file
+num_layers_per_voxel = int of number of slices per voxel
+occupancy = np bool array of shape (num_voxels_x, num_voxels_y) or None
+
+outputs:
+list of the names of the empty voxel groups
+'''
+def get_empty_voxel_keys(h5, num_layers_per_voxel, occupancy = None):
+    voxel_keys = [key for key in h5.keys() if key.startswith('voxel_')]
+    if occupancy is not None:
+        empty_keys = []
+        for key in voxel_keys:
+            n_vox_x, n_vox_y, _ = (int(value) for value in key[len('voxel_'):].split('_'))
+            if not occupancy[n_vox_x, n_vox_y]:
+                empty_keys.append(key)
+        return empty_keys
+
+    empty_keys = []
+    for key in voxel_keys:
+        size_slice_cnt = 0
+        for num_slice in range(num_layers_per_voxel):
+            slice_name = 'slice_{}'.format(num_slice)
+            if slice_name in h5[key]:
+                size_slice_cnt += h5[key][slice_name]['Area'].size #could be any other data column instead of 'Area' as well
+        if size_slice_cnt == 0:
+            empty_keys.append(key)
+    return empty_keys
+
+
+'''
+-------------------------------------------------------------------------------
+repack_h5_file:
+function that rewrites a hdf5 file, so the space of deleted objects is given back
+(hdf5 doesn't shrink a file on del). h5repack is used if it is installed,
+otherwise all the objects and attributes are copied into a new file with h5py
+'''
+def repack_h5_file(path_h5):
+    path_repacked = path_h5 + '.repack'
+    if shutil.which('h5repack') is not None:
+        subprocess.run(['h5repack', path_h5, path_repacked], check = True)
+    else:
+        with h5py.File(path_h5, 'r') as h5, h5py.File(path_repacked, 'w') as h5_repacked:
+            for key, value in h5.attrs.items():
+                h5_repacked.attrs[key] = value
+            for key in h5.keys():
+                h5.copy(h5[key], h5_repacked, name = key)
+    os.replace(path_repacked, path_h5)
 
 
+'''
+-------------------------------------------------------------------------------
+delete_empty_voxels:
+function that deletes the empty voxel groups of all the layer files of a folder
+
+inputs:
+voxel_folder = str of the folder of the voxel layer files
+num_layers_per_voxel = int of number of slices per voxel
+repack = bool whether the files with deleted voxels are repacked afterwards
 
+outputs:
+dict of file name -> number of deleted voxels
+'''
+def delete_empty_voxels(voxel_folder, num_layers_per_voxel, repack = False):
+    h5_list = [file_name for file_name in os.listdir(voxel_folder) if file_name.endswith('.hdf5')] #the folder also holds e.g. voxelization_config.json
+
+    num_deleted = {}
+    for h5_file in h5_list:
+        with instrumentation.span('prune'), h5py.File(voxel_folder + '/' + h5_file,'a') as h5:
+            #in the csr and dense layout empty voxels don't have any objects which could be deleted
+            if h5.attrs.get('layout', 'groups') != 'groups':
+                continue
+            tables = load_voxel_tables(voxel_folder, int(h5.attrs['num_z'])) if 'num_z' in h5.attrs else None
+            occupancy = tables['occupancy'] if tables is not None and 'occupancy' in tables else None
+            empty_keys = get_empty_voxel_keys(h5, num_layers_per_voxel, occupancy)
+            for key in empty_keys:
+                del h5[key]
+        num_deleted[h5_file] = len(empty_keys)
 
+        if repack and empty_keys:
+            size_before = os.path.getsize(voxel_folder + '/' + h5_file)
+            repack_h5_file(voxel_folder + '/' + h5_file)
+            print('{}: {} empty voxels deleted, {} -> {} bytes'.format(h5_file, len(empty_keys), size_before, os.path.getsize(voxel_folder + '/' + h5_file)))
+    return num_deleted
 
 
 
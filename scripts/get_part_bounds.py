@@ -0,0 +1,235 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+The functions are used to get the true bounding box of a part in a single pass
+over the buildjob hdf5 (replacing get_true_min_maxX/get_true_min_maxY which open
+the file once per slice and read it once per value)
+'''
+import h5py
+import numpy as np
+import os
+import json
+import concurrent.futures
+from helping_functions import get_attributes_from_hdf_5
+
+
+'''
+-------------------------------------------------------------------------------
+scan_slice_bounds:
+function that opens the buildjob hdf5 once and reads X-Axis and Y-Axis of every
+slice in the given range together
+
+inputs:
+h5_path = str of path to the buildjob hdf5
+part_name = str of name of the part
+slice_numbers = list/range of slice numbers (0 -> Slice00001)
+
+outputs:
+np array of shape (len(slice_numbers), 5) with minX, maxX, minY, maxY and the number
+of datapoints of every slice (bounds are NaN and number of datapoints is 0 for
+missing or empty slices)
+'''
+def scan_slice_bounds(h5_path, part_name, slice_numbers):
+    with h5py.File(h5_path,'r') as h5:
+        return scan_part_group_bounds(h5[part_name], slice_numbers)
+
+
+'''
+-------------------------------------------------------------------------------
+scan_part_group_bounds:
+function that does the scan of scan_slice_bounds on the group of a part of an
+already opened hdf5 (so a process can keep the buildjob open for several parts)
+'''
+def scan_part_group_bounds(part, slice_numbers):
+    slice_numbers = list(slice_numbers)
+    bounds = np.full([len(slice_numbers), 5], np.nan)
+    bounds[:,4] = 0
+
+    for i, num_slice in enumerate(slice_numbers):
+        Slice_name = 'Slice'+str("{:05d}".format(num_slice+1))
+        if Slice_name not in part:
+            continue
+        X_Axis = part[Slice_name]['X-Axis'][:]
+        Y_Axis = part[Slice_name]['Y-Axis'][:]
+        #the number of datapoints is the length all the columns have in common (see get_2D_data_from_h5_filtered_np)
+        bounds[i,4] = min(X_Axis.size, Y_Axis.size, part[Slice_name]['Area'].size, part[Slice_name]['Intensity'].size)
+        if X_Axis.size != 0 and Y_Axis.size != 0:
+            bounds[i,0:4] = X_Axis.min(), X_Axis.max(), Y_Axis.min(), Y_Axis.max()
+    return bounds
+
+
+'''
+-------------------------------------------------------------------------------
+get_bounds_cache_key:
+function that creates the key which identifies a cached scan result. If the
+buildjob hdf5 is changed (size or modification time) the cache is invalid
+
+inputs:
+h5_path = str of path to the buildjob hdf5
+part_name = str of name of the part
+max_slice_number = greatest number of slices of the part of interest
+
+outputs:
+dict with the absolute path, size, mtime of the hdf5, part name and max slice number
+'''
+def get_bounds_cache_key(h5_path, part_name, max_slice_number):
+    stat = os.stat(h5_path)
+    return {'path': os.path.abspath(h5_path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'part_name': part_name,
+            'max_slice_number': int(max_slice_number)}
+
+
+'''
+-------------------------------------------------------------------------------
+get_bounds_cache_path:
+function that returns the path of the sidecar cache file of a part scan, which
+is stored next to the buildjob hdf5
+
+inputs:
+h5_path = str of path to the buildjob hdf5
+part_name = str of name of the part
+
+outputs:
+str of the path of the cache file
+'''
+def get_bounds_cache_path(h5_path, part_name):
+    return '{}.{}.bounds.npz'.format(h5_path, part_name)
+
+
+'''
+-------------------------------------------------------------------------------
+get_part_bounds:
+function that goes through all the slices once and finds the minimal and maximal
+x- and y-values of the part as well as the bounds and number of datapoints of
+every slice. The result is cached in a sidecar file, so a rerun with new voxel
+settings doesn't need to scan the hdf5 again
+
+inputs:
+h5_path = str of path to the buildjob hdf5
+part_name = str of name of the part
+max_slice_number = greatest number of slices of the part of interest
+max_workers = int of number of processes for the scan (None or 1 -> scan in this process)
+use_cache = bool whether the sidecar cache is read and written
+cache_path = str of path of the cache file (default: see get_bounds_cache_path)
+
+outputs:
+dict with minX, maxX, minY, maxY of the part and the arrays slice_minX, slice_maxX,
+slice_minY, slice_maxY and num_points per slice
+'''
+def get_part_bounds(h5_path, part_name, max_slice_number, max_workers = None, use_cache = True, cache_path = None):
+    bounds = load_cached_bounds(h5_path, part_name, max_slice_number, cache_path) if use_cache else None
+
+    if bounds is None:
+        if max_workers is None or max_workers <= 1:
+            bounds = scan_slice_bounds(h5_path, part_name, range(max_slice_number))
+        else:
+            #every process gets a contiguous block of slices and opens the hdf5 only once
+            slice_blocks = np.array_split(np.arange(max_slice_number), max_workers)
+            slice_blocks = [block.tolist() for block in slice_blocks if block.size != 0]
+            with concurrent.futures.ProcessPoolExecutor(max_workers = max_workers) as executor:
+                bounds_list = list(executor.map(scan_slice_bounds, [h5_path]*len(slice_blocks), [part_name]*len(slice_blocks), slice_blocks))
+            bounds = np.vstack(bounds_list)
+
+        if use_cache:
+            save_cached_bounds(h5_path, part_name, max_slice_number, bounds, cache_path)
+
+    return summarize_bounds(bounds, h5_path, part_name)
+
+
+'''
+-------------------------------------------------------------------------------
+load_cached_bounds:
+function that returns the cached scan array of a part (see scan_slice_bounds) or
+None if there is no valid cache
+'''
+def load_cached_bounds(h5_path, part_name, max_slice_number, cache_path = None):
+    if cache_path is None:
+        cache_path = get_bounds_cache_path(h5_path, part_name)
+    if not os.path.isfile(cache_path):
+        return None
+    with np.load(cache_path) as cache:
+        if json.loads(str(cache['key'])) == get_bounds_cache_key(h5_path, part_name, max_slice_number):
+            return cache['bounds']
+    return None
+
+
+'''
+-------------------------------------------------------------------------------
+save_cached_bounds:
+function that writes the scan array of a part into the sidecar cache. The file is
+written under a temporary name and renamed, so runs which scan the same part at
+the same time (e.g. the shards of voxel_shards.py) never read a half written cache
+'''
+def save_cached_bounds(h5_path, part_name, max_slice_number, bounds, cache_path = None):
+    if cache_path is None:
+        cache_path = get_bounds_cache_path(h5_path, part_name)
+    path_temporary = '{}.{}.tmp'.format(cache_path, os.getpid())
+    try:
+        with open(path_temporary, 'wb') as cache_file:
+            np.savez(cache_file, key = json.dumps(get_bounds_cache_key(h5_path, part_name, max_slice_number)), bounds = bounds)
+        os.replace(path_temporary, cache_path)
+    except OSError:
+        print('bounds of {} could not be cached in {}'.format(part_name, cache_path))
+
+
+'''
+-------------------------------------------------------------------------------
+summarize_bounds:
+function that turns the scan array of a part into the dict of get_part_bounds
+'''
+def summarize_bounds(bounds, h5_path, part_name):
+    if np.all(np.isnan(bounds[:,0])):
+        raise ValueError('no datapoints found for part {} in {}'.format(part_name, h5_path))
+
+    return {'minX': np.nanmin(bounds[:,0]),
+            'maxX': np.nanmax(bounds[:,1]),
+            'minY': np.nanmin(bounds[:,2]),
+            'maxY': np.nanmax(bounds[:,3]),
+            'slice_minX': bounds[:,0],
+            'slice_maxX': bounds[:,1],
+            'slice_minY': bounds[:,2],
+            'slice_maxY': bounds[:,3],
+            'num_points': bounds[:,4].astype(np.int64)}
+
+
+'''
+-------------------------------------------------------------------------------
+get_part_bounds_from_attributes:
+function that takes the bounding box of a part out of its hdf5 attributes (minX,
+maxX, minY, maxY written with the buildjob) instead of scanning the slices. The
+attributes have to be in the units of X-Axis and Y-Axis. The per slice values are
+unknown (NaN bounds, 0 datapoints)
+
+inputs:
+h5_path = str of path to the buildjob hdf5
+part_name = str of name of the part
+max_slice_number = greatest number of slices of the part of interest
+
+outputs:
+dict like get_part_bounds
+'''
+def get_part_bounds_from_attributes(h5_path, part_name, max_slice_number):
+    attrs_dict = get_attributes_from_hdf_5(h5_path, part_name)
+    missing = [key for key in ('minX', 'maxX', 'minY', 'maxY') if key not in attrs_dict]
+    if missing:
+        raise KeyError('part {} in {} has no attributes {}'.format(part_name, h5_path, missing))
+    bounds = np.full([max_slice_number, 5], np.nan)
+    bounds[:,4] = 0
+    return {'minX': float(attrs_dict['minX']),
+            'maxX': float(attrs_dict['maxX']),
+            'minY': float(attrs_dict['minY']),
+            'maxY': float(attrs_dict['maxY']),
+            'slice_minX': bounds[:,0],
+            'slice_maxX': bounds[:,1],
+            'slice_minY': bounds[:,2],
+            'slice_maxY': bounds[:,3],
+            'num_points': bounds[:,4].astype(np.int64)}
+
+
+if __name__ == "__main__":
+    bounds = get_part_bounds('/home/jan/Documents/Trainingsdaten/ZP_4/ZP_4_full_part.h5', 'ZP4_combined', 1593, max_workers = 4)
+    print('minX {} maxX {} minY {} maxY {}'.format(bounds['minX'], bounds['maxX'], bounds['minY'], bounds['maxY']))
@@ -10,7 +10,9 @@ import h5py
 import numpy as np
 import math
 import pandas as pd
+import threading
 import time
+import instrumentation
 
 '''
 get_2D_data_from_h5_filtered
@@ -73,28 +75,11 @@ def get_2D_data_from_h5_filtered(h5_path, part_name, Slice_name, mode):
     df_int = df_int.loc[(df_int['area'] != 0) & (df_int['intensity'] != 0)]
 
 
-    #Step 3: Get a df with all the rows where a certain x,y combination occurs multiple times
-    df_multi_xy = df_int[df_int.duplicated(['x','y'], keep = False)].reset_index()
-
-    #Step 4: get a new df out of df_multi_xy with x,y and mean/max of area and intensity for all x,y occurences
-    df_compact = pd.DataFrame(columns=['x','y','area','intensity']) #initialize df_compact
-
-    print("till iterating from {} {} seconds ---".format (Slice_name,time.time() - start_time))
-    for ind in range (df_multi_xy.shape[0]):
-        if mode == 'mean':
-            area_mean = df_multi_xy.loc[(df_multi_xy['x']== df_multi_xy.iloc[ind]['x']) & (df_multi_xy['y'] == df_multi_xy.iloc[ind]['y'])]['area'].mean().astype(int)
-            intensity_mean = df_multi_xy.loc[(df_multi_xy['x']== df_multi_xy.iloc[ind]['x']) & (df_multi_xy['y'] == df_multi_xy.iloc[ind]['y'])]['intensity'].mean().astype(int)
-            df_compact = df_compact.append({'x': df_multi_xy.iloc[ind]['x'], 'y':df_multi_xy.iloc[ind]['y'], 'area':area_mean , 'intensity':intensity_mean}, ignore_index=True)
-        if mode == 'max':
-            area_max = df_multi_xy.loc[(df_multi_xy['x']== df_multi_xy.iloc[ind]['x']) & (df_multi_xy['y'] == df_multi_xy.iloc[ind]['y'])]['area'].max().astype(int)
-            intensity_max = df_multi_xy.loc[(df_multi_xy['x']== df_multi_xy.iloc[ind]['x']) & (df_multi_xy['y'] == df_multi_xy.iloc[ind]['y'])]['intensity'].max().astype(int)
-            df_compact = df_compact.append({'x': df_multi_xy.iloc[ind]['x'], 'y':df_multi_xy.iloc[ind]['y'], 'area':area_max , 'intensity':intensity_max}, ignore_index=True)
-    df_compact = df_compact.drop_duplicates()
-
-    #Step 5: remove df_multi_xy from df_int and append df_compact
-    df_multi_xy_removed = df_int.drop(df_int[df_int.duplicated(['x','y'], keep = False)].index)
-
-    df_final = df_multi_xy_removed.append(df_compact)
+    #Step 3: combine all the rows where a certain x,y combination occurs multiple times
+    #into one row with the mean/max of area and intensity (one sort instead of a row append loop)
+    print("till reducing from {} {} seconds ---".format (Slice_name,time.time() - start_time))
+    array_reduced = reduce_duplicate_xy(df_int.values, mode)
+    df_final = pd.DataFrame(array_reduced, columns=['x','y','area','intensity'])
     print("df creation for {} took {} seconds ---".format (Slice_name,time.time() - start_time))
     return (df_final)
 
@@ -621,111 +606,248 @@ def fill_voxel_per_slice(num_slice):
 
 '''
 --------------------------------------------------------------------------------
+reduce_duplicate_xy:
+This function combines all the datapoints of an array which share the same
+x,y-combination into a single datapoint. x and y are packed into one integer key,
+the array is sorted once by that key and every x,y-group becomes a contiguous
+segment which is reduced with numpy's reduceat -> O(n log n) instead of a full
+array scan for every duplicate
+
+inputs:
+array = np array with the columns x, y, area, intensity
+mode = str of the reduction used for area and intensity of multiple x,y-occurences:
+       'max', 'min', 'mean', 'sum', 'count' (number of occurences), 'first' or
+       'last' (first/last occurence in the original order of the array)
 
+outputs:
+np array with the columns x, y, area, intensity where every x,y-combination
+occurs once (sorted by x and y)
 '''
-def get_2D_data_from_h5_filtered_np(h5_path, part_name, Slice_name):
-    #opening h5 and getting the data
-    start_time = time.time()
+REDUCTION_MODES = ('max', 'min', 'mean', 'sum', 'count', 'first', 'last')
+
+def reduce_duplicate_xy(array, mode = 'max'):
+    if mode not in REDUCTION_MODES:
+        raise ValueError('mode has to be one of {}, not {}'.format(REDUCTION_MODES, mode))
+
+    array = np.asarray(array)
+    if array.shape[0] == 0:
+        return np.empty([0,4], dtype = array.dtype)
+
+    #packing x and y into one key, shifted to 0 so the key can't overflow
+    x_key = array[:,0].astype(np.int64) - np.int64(array[:,0].min())
+    y_key = array[:,1].astype(np.int64) - np.int64(array[:,1].min())
+    xy_key = x_key * (y_key.max() + 1) + y_key
+
+    #stable sort -> inside of each group the original order is kept (needed for 'first'/'last')
+    order = np.argsort(xy_key, kind = 'stable')
+    xy_key_sorted = xy_key[order]
+    array_sorted = array[order]
+
+    group_starts = np.flatnonzero(np.concatenate(([True], xy_key_sorted[1:] != xy_key_sorted[:-1])))
+    group_ends = np.append(group_starts[1:], array_sorted.shape[0])
+    values = array_sorted[:,2:]
+
+    if mode == 'max':
+        reduced_values = np.maximum.reduceat(values, group_starts, axis=0)
+    elif mode == 'min':
+        reduced_values = np.minimum.reduceat(values, group_starts, axis=0)
+    elif mode == 'sum':
+        reduced_values = np.add.reduceat(values, group_starts, axis=0)
+    elif mode == 'mean':
+        counts = (group_ends - group_starts)[:,np.newaxis]
+        reduced_values = np.add.reduceat(values.astype(np.float64), group_starts, axis=0) / counts
+    elif mode == 'count':
+        reduced_values = np.repeat((group_ends - group_starts)[:,np.newaxis], 2, axis=1)
+    elif mode == 'first':
+        reduced_values = values[group_starts]
+    elif mode == 'last':
+        reduced_values = values[group_ends - 1]
+
+    array_reduced = np.empty([group_starts.size, 4], dtype = array.dtype)
+    array_reduced[:,[0,1]] = array_sorted[group_starts][:,[0,1]]
+    array_reduced[:,[2,3]] = reduced_values #mean of int arrays is cut to int like in the pandas version
+    return array_reduced
 
-    with h5py.File(h5_path,'r') as h5:
-        #check whether slice exists -> if not: empty array returned
-        if Slice_name in h5[part_name]:
-            Y_Axis = np.array(h5[part_name][Slice_name]['Y-Axis'][:]).astype(int)
-            Area = np.array(h5[part_name][Slice_name]['Area'][:]).astype(int)
-            Intensity = np.array(h5[part_name][Slice_name]['Intensity'][:]).astype(int)
-            X_Axis = np.array(h5[part_name][Slice_name]['X-Axis'][:]).astype(int)
-
-            X_Axis_size = X_Axis.size
-            Y_Axis_size = Y_Axis.size
-            Area_size = Area.size
-            Intensity_size = Intensity.size
-
-            #if dimensions aren't equal the following code block is entered
-            if not X_Axis_size == Y_Axis_size == Area_size == Intensity_size:
-
-                #determine the lowest value among the different sizes
-                size_arr = np.array([X_Axis_size, Y_Axis_size, Area_size, Intensity_size])
-                min_size = size_arr.min()
-
-                if X_Axis_size != min_size:
-                    diff_size_x = X_Axis_size - min_size #calculating the difference between the actual value and the minimum and substracting it from the array
-                    X_Axis_new = np.delete(X_Axis, -diff_size_x)
-                    X_Axis = X_Axis_new
-                    X_Axis_size = X_Axis.size
-
-                if Y_Axis_size != min_size:
-                    diff_size_y = Y_Axis_size - min_size
-                    Y_Axis_new = np.delete(Y_Axis, -diff_size_y)
-                    Y_Axis = Y_Axis_new
-                    Y_Axis_size = Y_Axis.size
-
-                if Area_size != min_size:
-                    diff_size_area = Area_size - min_size
-                    Area_new = np.delete(Area, -diff_size_area)
-                    Area = Area_new
-                    Area_size = Area.size
-
-                if Intensity_size != min_size:
-                    diff_size_intensity = Intensity_size - min_size
-                    Intensity_new = np.delete(Intensity, -diff_size_intensity)
-                    Intensity = Intensity_new
-                    Intensity_size = Intensity.size
-
-                #by reducing all the dimensions to the minimum equal dimensions are guaranteed
-                #there is a risk of deleting more than just one datapoint without noticing -> maybe add an alert after more than 5(?) while iterations
-            print(str(X_Axis_size)+ ' datapoints found')
-            combos = np.stack((X_Axis, Y_Axis, Area, Intensity), axis=-1)
-
-            #filtering out the datapoints where area and intensity are =0
-            area_zeros = np.where(combos[:,2]== 0)
-            intensity_zeros = np.where(combos[:,3]==0)
-            zero_area_intensity_indices = np.intersect1d(area_zeros, intensity_zeros) #array of indices where area AND intensity are = 0
-
-            #deleting all the datapoints where area AND intensity are = 0
-            combos_wo_only_zeros = np.delete(combos, zero_area_intensity_indices, axis=0)
-            print(str(combos_wo_only_zeros.shape[0]) + ' datapoints where area != 0 AND intensity != 0')
-
-            combos_wo_only_zeros_unique, unique_indices = np.unique(combos_wo_only_zeros[:,[0,1]],axis=0, return_index = True)
-            combos_unique = combos_wo_only_zeros[unique_indices]
-            print(str(combos_unique.shape[0]) + ' unique datapoints where area != 0 AND intensity != 0')
-
-            Index_range = np.arange(combos_wo_only_zeros.shape[0])
-            indices_of_interest = np.setdiff1d(Index_range, unique_indices) #all the indices belonging to non unique x,y-combinations
-
-            combo_processed_array = np.empty([0,4],dtype= int)
-            start_time = time.time()
-            combos_wo_only_zeros_copy = np.copy(combos_wo_only_zeros)
-            index_counter = 0
-            shape_counter = 0
-            indices_list = []
+'''
+--------------------------------------------------------------------------------
+SliceLoader:
+class that loads the columns of slices into buffers which are reused for every
+slice of a process (or thread, see get_slice_loader) instead of several new arrays
+per slice: the columns are read with read_direct straight into the integer buffer
+(the hdf5 library casts float columns like astype(int)), columns of different
+length are cut by reading the common length only and the datapoints where area
+AND intensity are 0 are removed by compacting the buffer with a mask. The buffers
+only grow if a slice has more datapoints than all the slices before
+
+The columns are kept as int32 (x, y, area and intensity of the buildjobs fit into
+it by far, half of the int64 of astype(int)). A slice with values outside of
+int32 (the cast clamps them to the limits) is loaded again as int64. int16 isn't
+used, docking to zero and the 'sum' reduction can leave its range
+
+usage:
+loader = get_slice_loader()
+loader.read(h5[part_name][Slice_name])
+array = loader.filter('max') #new array, the buffers are reused by the next slice
+'''
+SLICE_COLUMN_NAMES = ('X-Axis', 'Y-Axis', 'Area', 'Intensity')
+
+class SliceLoader:
+    def __init__(self, dtype = np.int32):
+        self.dtype = np.dtype(dtype)
+        self.buffers = {} #dtype -> array of shape (5, capacity): the 4 columns and a scratch row for the compaction
+        self.masks = np.empty([2,0], dtype = bool)
+        self.buffer = None
+        self.num_points = 0
+
+    def get_buffer(self, dtype, num_points):
+        buffer = self.buffers.get(dtype)
+        if buffer is None or buffer.shape[1] < num_points:
+            #some headroom, so slowly growing slices don't reallocate every time
+            capacity = max(num_points, 0 if buffer is None else buffer.shape[1]*5//4)
+            buffer = self.buffers[dtype] = np.empty([5, capacity], dtype = dtype)
+        if self.masks.shape[1] < buffer.shape[1]:
+            self.masks = np.empty([2, buffer.shape[1]], dtype = bool)
+        return buffer
+
+    def is_clamped(self, columns):
+        limits = np.iinfo(columns.dtype)
+        return columns.size != 0 and (columns.min() <= limits.min or columns.max() >= limits.max)
+
+    def count_trimmed(self, sizes):
+        #the longer columns are cut to the common length (their last values are dropped)
+        if min(sizes) != max(sizes):
+            instrumentation.count('values_trimmed', sum(sizes) - 4*min(sizes))
+
+    @property
+    def columns(self):
+        #view of shape (4, num_points) of the loaded slice
+        return self.buffer[:4, :self.num_points]
+
+    def read(self, slice_group):
+        datasets = [slice_group[column_name] for column_name in SLICE_COLUMN_NAMES]
+        sizes = [dataset.size for dataset in datasets]
+        self.count_trimmed(sizes)
+        self.num_points = min(sizes)
+        for dtype in (self.dtype, np.dtype(np.int64)):
+            self.buffer = self.get_buffer(dtype, self.num_points)
+            if self.num_points != 0:
+                for row, dataset in enumerate(datasets):
+                    dataset.read_direct(self.buffer[row], np.s_[0:self.num_points], np.s_[0:self.num_points])
+            if dtype == np.int64 or not self.is_clamped(self.columns):
+                break
+        return self.columns
+
+    def load_columns(self, X_Axis, Y_Axis, Area, Intensity):
+        #columns which were already read (e.g. by a prefetching reader) are copied into the buffer
+        raw_columns = [np.asarray(column) for column in (X_Axis, Y_Axis, Area, Intensity)]
+        sizes = [column.size for column in raw_columns]
+        self.count_trimmed(sizes)
+        self.num_points = min(sizes)
+        limits = np.iinfo(self.dtype)
+        fits = self.num_points == 0 or all(column[:self.num_points].min() > limits.min and column[:self.num_points].max() < limits.max for column in raw_columns)
+        self.buffer = self.get_buffer(self.dtype if fits else np.dtype(np.int64), self.num_points)
+        for row, column in enumerate(raw_columns):
+            np.copyto(self.buffer[row, :self.num_points], column[:self.num_points], casting = 'unsafe')
+        return self.columns
+
+    def filter(self, mode = 'max'):
+        columns = self.columns
+        num_points = self.num_points
+        instrumentation.count('points_in', num_points)
+
+        with instrumentation.span('zero-filter'):
+            #keep = area != 0 OR intensity != 0, computed into the reused masks
+            keep = self.masks[0, :num_points]
+            np.not_equal(columns[2], 0, out = keep)
+            np.logical_or(keep, np.not_equal(columns[3], 0, out = self.masks[1, :num_points]), out = keep)
+            num_kept = int(np.count_nonzero(keep))
+            if num_kept != num_points:
+                scratch = self.buffer[4, :num_kept]
+                for column in columns:
+                    np.compress(keep, column, out = scratch)
+                    column[:num_kept] = scratch
+        instrumentation.count('points_filtered', num_kept)
+
+        #all the datapoints with the same x,y-combination are reduced to one datapoint (e.g. max of area and intensity)
+        with instrumentation.span('dedup'):
+            array_reduced = reduce_duplicate_xy(columns[:, :num_kept].T, mode)
+        instrumentation.count('points_unique', array_reduced.shape[0])
+        return array_reduced
 
-            print("vor iterieren %s seconds ---" % (time.time() - start_time))
-            for index in indices_of_interest:
-                xy_combo = combos_wo_only_zeros[:,[0,1]][index]
-                if np.where((combo_processed_array[:,0] == xy_combo[0])*(combo_processed_array[:,1] == xy_combo[1]))[0].size == 0:
-                    index_counter += 1
-                    xy_combo = combos_wo_only_zeros[:,[0,1]][index]
-                    indices_relevant = np.where((combos_wo_only_zeros[:,0] == xy_combo[0])*(combos_wo_only_zeros[:,1] == xy_combo[1]))[0]
-                    max_area_of_combo = np.amax(combos_wo_only_zeros[:,2][indices_relevant])
-                    max_intensity_of_combo = np.amax(combos_wo_only_zeros[:,3][indices_relevant])
 
-                    max_combos = np.stack((xy_combo[0], xy_combo[1], max_area_of_combo, max_intensity_of_combo), axis=-1)
+'''
+--------------------------------------------------------------------------------
+get_slice_loader:
+function that returns the SliceLoader of the calling thread (one set of buffers
+per worker process, the reader thread of the pipeline has its own)
+'''
+slice_loaders = threading.local()
 
-                    combos_wo_only_zeros_copy = np.vstack((combos_wo_only_zeros_copy, max_combos))
-                    shape_counter += indices_relevant.shape[0]
-                    indices_list.append(list(indices_relevant))
+def get_slice_loader():
+    loader = getattr(slice_loaders, 'loader', None)
+    if loader is None:
+        loader = slice_loaders.loader = SliceLoader()
+    return loader
 
-                    combo_processed_array =  np.vstack((combo_processed_array, max_combos))
+'''
+--------------------------------------------------------------------------------
+filter_slice_columns:
+function that does the filtering of get_2D_data_from_h5_filtered_np on the raw
+columns of a slice which were already read (e.g. by a prefetching reader): the
+columns are cut to equal length, datapoints where area AND intensity are 0 are
+removed and multiple x,y-occurences are reduced with reduce_duplicate_xy (the
+columns are copied into the buffers of the SliceLoader of the thread)
 
-            indices_relevant = np.hstack(indices_list)
-            combos_wo_only_zeros_copy = np.delete(combos_wo_only_zeros_copy, indices_relevant, axis = 0)
-        else:
-            combos_wo_only_zeros_copy = np.empty([0,4],dtype= int)
-            print('{} is not existing -> empty array created'.format(Slice_name))
+inputs:
+X_Axis, Y_Axis, Area, Intensity = np arrays of the raw columns of the slice
+mode = str of the reduction for multiple x,y-occurences (see reduce_duplicate_xy)
 
-        #df = pd.DataFrame(combos_wo_only_zeros_copy, columns=['x','y','area','intensity'])
-        print("array creation took %s seconds ---" % (time.time() - start_time))
-        return(combos_wo_only_zeros_copy)
+outputs:
+np array with columns x, y, area, intensity
+'''
+def filter_slice_columns(X_Axis, Y_Axis, Area, Intensity, mode = 'max'):
+    loader = get_slice_loader()
+    loader.load_columns(X_Axis, Y_Axis, Area, Intensity)
+    return loader.filter(mode)
+
+'''
+--------------------------------------------------------------------------------
+trim_columns_to_min_size:
+function that cuts the columns of a slice to the length of the shortest column
+(the last values of the longer columns are dropped, the columns are views)
+'''
+def trim_columns_to_min_size(X_Axis, Y_Axis, Area, Intensity):
+    #determine the lowest value among the different sizes
+    min_size = min(X_Axis.size, Y_Axis.size, Area.size, Intensity.size)
+    return tuple(column[:min_size] for column in (X_Axis, Y_Axis, Area, Intensity))
+
+'''
+--------------------------------------------------------------------------------
+get_2D_data_from_h5_filtered_np:
+numpy version of get_2D_data_from_h5_filtered. The columns of the slice are cut
+to equal length, datapoints where area AND intensity are 0 are removed and
+datapoints with the same x,y-combination are reduced with reduce_duplicate_xy.
+The columns are read into the reused buffers of the SliceLoader of the thread
+
+inputs:
+h5_path = str of path of the hdf5 of the relevant buildjob
+part_name = str of the name of the part of interest
+Slice_name = str of the slice of interest
+mode = str of the reduction for multiple x,y-occurences (see reduce_duplicate_xy), default 'max'
+
+outputs:
+np array with columns x, y, area, intensity (empty array if the slice doesn't exist)
+'''
+def get_2D_data_from_h5_filtered_np(h5_path, part_name, Slice_name, mode = 'max'):
+    loader = get_slice_loader()
+    #opening h5 and getting the data
+    with h5py.File(h5_path,'r') as h5:
+        #check whether slice exists -> if not: empty array returned
+        if Slice_name not in h5[part_name]:
+            return np.empty([0,4], dtype = loader.dtype)
+        with instrumentation.span('read'):
+            loader.read(h5[part_name][Slice_name])
+    return loader.filter(mode)
 
 '''
 -------------------------------------------------------------------------------
@@ -804,3 +926,180 @@ def create_single_voxel_array_storage_reduced (current_n_vox_x, current_n_vox_y,
         final_voxel_array = voxel_array
 
     return final_voxel_array
+
+'''
+--------------------------------------------------------------------------------
+partition_array_by_voxel:
+function that bins all the datapoints of a (docked) slice array into the voxel
+grid at once. The voxel index of every datapoint is computed once, the array is
+sorted by this index and an offsets table marks the start and end of each voxel
+-> the datapoints of a voxel are a contiguous (zero-copy) slice of the sorted
+array and the cost doesn't depend on the number of voxels anymore (replaces the
+mask over the whole slice for every voxel in create_single_voxel_array(_storage_reduced))
+
+inputs:
+array = np array of the slice docked to zero with columns x, y, area, intensity
+voxel_size = int of voxel x and y dimensions
+num_voxels_x = int of number of voxels in x-direction
+num_voxels_y = int of number of voxels in y-direction
+local_coordinates = bool whether x and y are changed to the coordinates inside
+                    the voxel (like in create_single_voxel_array_storage_reduced)
+
+outputs:
+tuple of the sorted array and the offsets array of size num_voxels_x*num_voxels_y+1,
+the datapoints of voxel (n_vox_x, n_vox_y) are
+array_sorted[offsets[n_vox_y*num_voxels_x + n_vox_x]:offsets[n_vox_y*num_voxels_x + n_vox_x + 1]]
+(see get_voxel_segment). Datapoints outside of the voxel grid are dropped
+'''
+def partition_array_by_voxel(array, voxel_size, num_voxels_x, num_voxels_y, local_coordinates = True):
+    n_vox_x = array[:,0] // voxel_size
+    n_vox_y = array[:,1] // voxel_size
+
+    inside_grid = (n_vox_x >= 0) & (n_vox_x < num_voxels_x) & (n_vox_y >= 0) & (n_vox_y < num_voxels_y)
+    if not inside_grid.all():
+        array = array[inside_grid]
+        n_vox_x = n_vox_x[inside_grid]
+        n_vox_y = n_vox_y[inside_grid]
+
+    voxel_index = n_vox_y * num_voxels_x + n_vox_x #same order as the loops over y and x in create_single_vox_layer
+
+    #stable sort -> datapoints of a voxel keep the order of the slice array
+    order = np.argsort(voxel_index, kind = 'stable')
+    array_sorted = array[order]
+    if local_coordinates:
+        array_sorted[:,0] -= n_vox_x[order] * voxel_size
+        array_sorted[:,1] -= n_vox_y[order] * voxel_size
+
+    offsets = np.zeros(num_voxels_x*num_voxels_y + 1, dtype = np.int64)
+    np.cumsum(np.bincount(voxel_index, minlength = num_voxels_x*num_voxels_y), out = offsets[1:])
+    return array_sorted, offsets
+
+'''
+--------------------------------------------------------------------------------
+partition_array_by_window:
+function that bins all the datapoints of a (docked) slice array into overlapping
+windows of size voxel_size which start every stride datapoints (stride < voxel_size
+-> windows overlap). The datapoints are binned only once into cells of size
+gcd(voxel_size, stride) with partition_array_by_voxel; a window is made of
+voxel_size/cell x voxel_size/cell cells and the cells of one row of a window are
+contiguous in the cell sorted array, so a window is gathered out of one segment
+per cell row. The runtime grows with the size of the output, not with the number
+of windows per datapoint
+
+inputs:
+array = np array of the slice docked to zero with columns x, y, area, intensity
+voxel_size = int of window x and y dimensions
+stride = int of distance between the starts of neighbouring windows
+num_windows_x = int of number of windows in x-direction
+num_windows_y = int of number of windows in y-direction
+local_coordinates = bool whether x and y are changed to the coordinates inside the window
+
+outputs:
+tuple of the sorted array and the offsets array of size num_windows_x*num_windows_y+1,
+same as partition_array_by_voxel with the windows as voxels (a datapoint is in the
+array once per window which contains it). stride == voxel_size gives the result
+of partition_array_by_voxel
+'''
+def partition_array_by_window(array, voxel_size, stride, num_windows_x, num_windows_y, local_coordinates = True):
+    cell_size = math.gcd(voxel_size, stride)
+    cells_per_window = voxel_size // cell_size
+    cells_per_stride = stride // cell_size
+    num_cells_x = (num_windows_x - 1)*cells_per_stride + cells_per_window
+    num_cells_y = (num_windows_y - 1)*cells_per_stride + cells_per_window
+    cells_sorted, cell_offsets = partition_array_by_voxel(array, cell_size, num_cells_x, num_cells_y, local_coordinates = False)
+
+    #one segment per (window y, window x, cell row of the window), in the order of the windows
+    window_y, window_x, cell_row = np.meshgrid(np.arange(num_windows_y), np.arange(num_windows_x), np.arange(cells_per_window), indexing = 'ij')
+    first_cell = (window_y*cells_per_stride + cell_row)*num_cells_x + window_x*cells_per_stride
+    starts = cell_offsets[first_cell].ravel()
+    lengths = cell_offsets[first_cell + cells_per_window].ravel() - starts
+    window_lengths = lengths.reshape(-1, cells_per_window).sum(axis = 1)
+
+    offsets = np.zeros(num_windows_x*num_windows_y + 1, dtype = np.int64)
+    np.cumsum(window_lengths, out = offsets[1:])
+    #index of every datapoint of the output in the cell sorted array
+    segment_starts = np.cumsum(lengths) - lengths
+    gather_indices = np.arange(offsets[-1]) + np.repeat(starts - segment_starts, lengths)
+    array_sorted = cells_sorted[gather_indices]
+    if local_coordinates:
+        window_index = np.repeat(np.arange(num_windows_x*num_windows_y), window_lengths)
+        array_sorted[:,0] -= (window_index % num_windows_x) * stride
+        array_sorted[:,1] -= (window_index // num_windows_x) * stride
+    return array_sorted, offsets
+
+'''
+--------------------------------------------------------------------------------
+get_voxel_segment:
+function that returns the datapoints of a single voxel out of the result of
+partition_array_by_voxel (view, no copy)
+
+inputs:
+array_sorted = sorted np array returned by partition_array_by_voxel
+offsets = offsets array returned by partition_array_by_voxel
+current_n_vox_x = int of current voxel number in x-dimension
+current_n_vox_y = int of current voxel number in y-dimension
+num_voxels_x = int of number of voxels in x-direction
+
+outputs:
+np array with the datapoints of the voxel
+'''
+def get_voxel_segment(array_sorted, offsets, current_n_vox_x, current_n_vox_y, num_voxels_x):
+    voxel_index = current_n_vox_y * num_voxels_x + current_n_vox_x
+    return array_sorted[offsets[voxel_index]:offsets[voxel_index + 1]]
+
+'''
+--------------------------------------------------------------------------------
+fill_voxel_array:
+function that creates the full voxel_size*voxel_size grid of a voxel (same
+output as create_single_voxel_array) out of the datapoints of the voxel
+returned by get_voxel_segment (with local coordinates)
+
+inputs:
+voxel_segment = np array with the datapoints of the voxel in local coordinates
+current_n_vox_x = int of current voxel number in x-dimension
+current_n_vox_y = int of current voxel number in y-dimension
+voxel_size = int of voxel x and y dimensions
+
+outputs:
+np array of shape (voxel_size*voxel_size, 4) with columns x, y, area, intensity
+sorted by x and y; grid points without datapoint are 0
+'''
+def fill_voxel_array(voxel_segment, current_n_vox_x, current_n_vox_y, voxel_size):
+    x_axis_voxel =  np.repeat(np.arange(current_n_vox_x*voxel_size, (current_n_vox_x + 1)*voxel_size, 1),voxel_size)
+    y_axis_voxel =  np.tile(np.arange(current_n_vox_y*voxel_size, (current_n_vox_y + 1)*voxel_size, 1),voxel_size)
+    Zero_array = np.zeros(voxel_size*voxel_size, dtype=voxel_segment.dtype)
+
+    voxel_array = np.stack((x_axis_voxel, y_axis_voxel, Zero_array, Zero_array), axis=-1)
+    #grid position of a datapoint: x is repeated and y is tiled
+    grid_indices = voxel_segment[:,0] * voxel_size + voxel_segment[:,1]
+    voxel_array[grid_indices[::-1], 2] = voxel_segment[::-1, 2] #reversed -> first datapoint wins like np.unique in create_single_voxel_array
+    voxel_array[grid_indices[::-1], 3] = voxel_segment[::-1, 3]
+    return voxel_array
+
+'''
+--------------------------------------------------------------------------------
+fill_dense_slice:
+function that writes area and intensity of all the datapoints of a (docked)
+slice array into a dense grid covering the whole voxel grid
+
+inputs:
+array = np array of the slice docked to zero with columns x, y, area, intensity
+voxel_size = int of voxel x and y dimensions
+num_voxels_x = int of number of voxels in x-direction
+num_voxels_y = int of number of voxels in y-direction
+dtype = dtype of the grid
+
+outputs:
+np array of shape (num_voxels_y*voxel_size, num_voxels_x*voxel_size, 2) with
+area in channel 0 and intensity in channel 1 (0 where no datapoint exists),
+datapoints outside of the voxel grid are dropped
+'''
+def fill_dense_slice(array, voxel_size, num_voxels_x, num_voxels_y, dtype = np.int32):
+    size_y = num_voxels_y*voxel_size
+    size_x = num_voxels_x*voxel_size
+    dense_slice = np.zeros([size_y, size_x, 2], dtype = dtype)
+
+    inside_grid = (array[:,0] >= 0) & (array[:,0] < size_x) & (array[:,1] >= 0) & (array[:,1] < size_y)
+    array = array[inside_grid]
+    dense_slice[array[:,1], array[:,0]] = array[:,[2,3]]
+    return dense_slice
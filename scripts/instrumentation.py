@@ -0,0 +1,224 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Lightweight instrumentation of the voxelization: named spans (time and peak
+memory of a stage) and counters. Every process records into its own recorder,
+the worker processes hand their snapshot (collect) to the parent, which merges
+them (merge) and writes the run report as json or csv (write_report). When
+instrumentation is disabled (default) span returns a shared no-op context and
+count returns at once, nothing is recorded or printed
+
+spans:    read, zero-filter, dedup, bin, features, write, prune, index
+counters: values_trimmed (values of longer columns dropped by the trim to the
+          common length), points_in, points_filtered (area and intensity not both 0),
+          points_unique (after dedup), voxels_written (voxel slices with
+          datapoints), bytes_written (bytes of the written columns)
+
+usage:
+instrumentation.enable()
+run_slice_scheduler(config)
+instrumentation.write_report('run_report.json')
+
+The report always has max_rss_bytes, the largest peak resident memory of the
+processes of the run (one getrusage call per snapshot, no overhead). The peak
+memory per span is only measured with enable(track_memory = True), which runs
+tracemalloc: the peak of the traced memory of a span above the memory at its
+start. tracemalloc slows the allocations down (a run takes 2-4 times as long), so
+the times of such a report are not the times of a normal run. Threads of a
+process share tracemalloc, so the peaks of overlapping spans of different threads
+are approximate
+'''
+import contextlib
+import csv
+import json
+import os
+import threading
+import time
+import tracemalloc
+try:
+    import resource
+except ImportError: #not on Windows
+    resource = None
+
+SPAN_FIELDS = ('count', 'total_s', 'max_s', 'peak_bytes')
+
+#settings and data of this process
+state = {'enabled': False, 'track_memory': False}
+lock = threading.Lock()
+local = threading.local() #stack of the open spans of a thread
+NO_SPAN = contextlib.nullcontext()
+
+
+def create_empty_snapshot():
+    return {'spans': {}, 'counters': {}, 'num_snapshots': 1, 'max_rss_bytes': 0}
+
+def get_max_rss_bytes():
+    #peak resident memory of this process (ru_maxrss is in kB on Linux)
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+recorded = create_empty_snapshot()
+
+
+'''
+-------------------------------------------------------------------------------
+enable / disable / get_settings / init_process:
+switch the recording of this process on or off. get_settings returns the settings
+for the initializer of worker processes (init_process), which also drops data a
+forked worker inherited from the parent
+'''
+def enable(track_memory = False):
+    state['enabled'] = True
+    state['track_memory'] = track_memory
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    state['enabled'] = False
+    if state['track_memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    state['track_memory'] = False
+
+def is_enabled():
+    return state['enabled']
+
+def get_settings():
+    return dict(state)
+
+def init_process(settings):
+    collect()
+    if settings['enabled']:
+        enable(settings['track_memory'])
+    else:
+        disable()
+
+
+'''
+-------------------------------------------------------------------------------
+span:
+context manager which records the time (and peak memory) of a stage
+
+inputs:
+name = str of the name of the stage
+'''
+def span(name):
+    if not state['enabled']:
+        return NO_SPAN
+    return record_span(name)
+
+@contextlib.contextmanager
+def record_span(name):
+    stack = getattr(local, 'stack', None)
+    if stack is None:
+        stack = local.stack = []
+    frame = {'base': 0, 'peak': 0}
+    if state['track_memory']:
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        frame['base'] = frame['peak'] = current
+    stack.append(frame)
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start_time
+        stack.pop()
+        peak_bytes = 0
+        if state['track_memory']:
+            frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            peak_bytes = frame['peak'] - frame['base']
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], frame['peak'])
+        with lock:
+            span_data = recorded['spans'].setdefault(name, dict.fromkeys(SPAN_FIELDS, 0))
+            span_data['count'] += 1
+            span_data['total_s'] += seconds
+            span_data['max_s'] = max(span_data['max_s'], seconds)
+            span_data['peak_bytes'] = max(span_data['peak_bytes'], peak_bytes)
+
+
+'''
+-------------------------------------------------------------------------------
+count:
+function that adds value to the counter name
+'''
+def count(name, value = 1):
+    if not state['enabled']:
+        return
+    with lock:
+        recorded['counters'][name] = recorded['counters'].get(name, 0) + int(value)
+
+
+'''
+-------------------------------------------------------------------------------
+collect / merge:
+collect returns the data of this process and resets it (None if nothing was
+recorded, e.g. disabled), merge adds a snapshot of another process (times and
+counters are summed, maxima and peaks are the maximum)
+'''
+def collect():
+    global recorded
+    with lock:
+        snapshot = recorded
+        recorded = create_empty_snapshot()
+    if not snapshot['spans'] and not snapshot['counters']:
+        return None
+    snapshot['max_rss_bytes'] = max(snapshot['max_rss_bytes'], get_max_rss_bytes())
+    return snapshot
+
+def merge(snapshot):
+    if snapshot is None:
+        return
+    with lock:
+        for name, span_data in snapshot['spans'].items():
+            merged = recorded['spans'].setdefault(name, dict.fromkeys(SPAN_FIELDS, 0))
+            merged['count'] += span_data['count']
+            merged['total_s'] += span_data['total_s']
+            merged['max_s'] = max(merged['max_s'], span_data['max_s'])
+            merged['peak_bytes'] = max(merged['peak_bytes'], span_data['peak_bytes'])
+        for name, value in snapshot['counters'].items():
+            recorded['counters'][name] = recorded['counters'].get(name, 0) + value
+        recorded['num_snapshots'] += snapshot['num_snapshots']
+        recorded['max_rss_bytes'] = max(recorded['max_rss_bytes'], snapshot.get('max_rss_bytes', 0))
+
+
+'''
+-------------------------------------------------------------------------------
+write_report:
+function that writes the data recorded in (or merged into) this process as json
+or csv (by the file extension). The csv has one row per span and counter and a row
+of max_rss_bytes
+
+inputs:
+path = str of path of the report (.json or .csv)
+info = dict of further values of the json report (e.g. the config)
+
+outputs:
+dict of the report
+'''
+def write_report(path, info = None):
+    with lock:
+        report = {'spans': {name: dict(span_data) for name, span_data in sorted(recorded['spans'].items())},
+                  'counters': dict(sorted(recorded['counters'].items())),
+                  'num_snapshots': recorded['num_snapshots'],
+                  'max_rss_bytes': max(recorded['max_rss_bytes'], get_max_rss_bytes())}
+    if info:
+        report['info'] = info
+    if os.path.splitext(path)[1].lower() == '.csv':
+        with open(path, 'w', newline = '') as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(('kind', 'name') + SPAN_FIELDS + ('value',))
+            for name, span_data in report['spans'].items():
+                csv_writer.writerow(('span', name) + tuple(span_data[field] for field in SPAN_FIELDS) + ('',))
+            for name, value in report['counters'].items():
+                csv_writer.writerow(('counter', name) + ('',)*len(SPAN_FIELDS) + (value,))
+            csv_writer.writerow(('memory', 'max_rss_bytes') + ('',)*len(SPAN_FIELDS) + (report['max_rss_bytes'],))
+    else:
+        with open(path, 'w') as json_file:
+            json.dump(report, json_file, indent = 4)
+    return report
@@ -0,0 +1,153 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Export of the voxels of a voxelization run into flat arrays which can be memory
+mapped. All the selected (by default the non-empty) voxels are written densely
+with a fixed stride into one .npy file, so a consumer gets a voxel as a view into
+the memory map without any hdf5 decoding or copying
+
+files in the export folder:
+voxels.npy          (num_voxels, layers, voxel_size, voxel_size, channels)
+voxels_index.npy    voxel index rows (see voxel_index.py) of the exported voxels, row i <-> voxels[i]
+voxels_lookup.npy   (num_voxels_x, num_voxels_y, num_voxels_z) int64 row of voxel x,y,z (-1 if not exported)
+voxels_export.json  shapes, dtype, channels and source folder
+
+usage:
+voxels = MemmapVoxels('ZP_4_voxel_100_10/memmap')
+voxel = voxels.get(3, 4, 0)                         #view, paged in by the OS
+'''
+import io
+import json
+import numpy as np
+import os
+import time
+from voxel_batches import get_voxel_rows, skip_empty_voxels
+from voxel_store import VoxelStore
+
+EXPORT_FILE_NAMES = {'voxels': 'voxels.npy', 'index': 'voxels_index.npy', 'lookup': 'voxels_lookup.npy', 'header': 'voxels_export.json'}
+
+
+'''
+-------------------------------------------------------------------------------
+shrink_npy:
+function that cuts a .npy file to its first num_rows rows (in place, the header
+gets the new shape). np.save reserves the digits of the first dimension in the
+header, so the data doesn't move
+'''
+def shrink_npy(path, num_rows):
+    with open(path, 'r+b') as npy_file:
+        version = np.lib.format.read_magic(npy_file)
+        read_header, write_header = {(1, 0): (np.lib.format.read_array_header_1_0, np.lib.format.write_array_header_1_0),
+                                     (2, 0): (np.lib.format.read_array_header_2_0, np.lib.format.write_array_header_2_0)}[version]
+        shape, fortran_order, dtype = read_header(npy_file)
+        data_offset = npy_file.tell()
+        header = io.BytesIO()
+        write_header(header, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': fortran_order, 'shape': (num_rows,) + tuple(shape[1:])})
+        if len(header.getvalue()) != data_offset:
+            raise RuntimeError('the header of {} would change its size, the file can not be cut in place'.format(path))
+        npy_file.seek(0)
+        npy_file.write(header.getvalue())
+        npy_file.truncate(data_offset + num_rows*int(np.prod(shape[1:], dtype = np.int64))*dtype.itemsize)
+
+
+'''
+-------------------------------------------------------------------------------
+export_memmap:
+function that writes the voxels of a folder into the flat export files
+
+inputs:
+path_voxel_h5_folder = str of the folder of the voxel files
+path_export_folder = str of the folder of the export (None -> path_voxel_h5_folder/memmap)
+predicate = function index -> bool mask of the exported voxels (None -> all voxels)
+dtype = dtype of the exported voxels (e.g. np.int16 if Area and Intensity fit)
+chunk_size = int of number of voxels read with one get_many
+
+outputs:
+str of the export folder
+'''
+def export_memmap(path_voxel_h5_folder, path_export_folder = None, predicate = skip_empty_voxels, dtype = np.int32, chunk_size = 256):
+    start_time = time.time()
+    if path_export_folder is None:
+        path_export_folder = os.path.join(path_voxel_h5_folder, 'memmap')
+    os.makedirs(path_export_folder, exist_ok = True)
+
+    all_rows = get_voxel_rows(path_voxel_h5_folder)
+    #the dense layout has no point counts in the index -> the predicate is applied to the chunks after they were read
+    counts_known = not np.any(all_rows['num_points'] < 0)
+    candidates = all_rows[predicate(all_rows)] if counts_known and predicate is not None else all_rows
+    path_voxels = os.path.join(path_export_folder, EXPORT_FILE_NAMES['voxels'])
+    with VoxelStore(path_voxel_h5_folder, max_cache_bytes = 0, dtype = dtype) as store:
+        voxel_shape = (store.num_layers_per_voxel, store.voxel_size, store.voxel_size, len(store.channels))
+        voxels = np.lib.format.open_memmap(path_voxels, mode = 'w+', dtype = dtype, shape = (candidates.size,) + voxel_shape)
+        selected = []
+        num_rows = 0
+        #rows are sorted by z, y, x -> the layer files are read one after the other
+        for start in range(0, candidates.size, chunk_size):
+            chunk = candidates[start:start + chunk_size]
+            chunk_voxels = np.stack(store.get_many(list(zip(chunk['x'].tolist(), chunk['y'].tolist(), chunk['z'].tolist()))))
+            if not counts_known:
+                #number of written pixels (any channel not 0) of every voxel
+                chunk['num_points'] = np.count_nonzero(chunk_voxels.any(axis = -1), axis = (1, 2, 3))
+                if predicate is not None:
+                    mask = predicate(chunk)
+                    chunk, chunk_voxels = chunk[mask], chunk_voxels[mask]
+            voxels[num_rows:num_rows + chunk.size] = chunk_voxels
+            selected.append(chunk)
+            num_rows += chunk.size
+        voxels.flush()
+        channels = store.channels
+    del voxels
+    rows = np.concatenate(selected) if selected else candidates[:0]
+    if rows.size < candidates.size:
+        shrink_npy(path_voxels, rows.size)
+    shape = (rows.size,) + voxel_shape
+
+    lookup = np.full((all_rows['x'].max() + 1, all_rows['y'].max() + 1, all_rows['z'].max() + 1), -1, dtype = np.int64)
+    lookup[rows['x'], rows['y'], rows['z']] = np.arange(rows.size)
+    np.save(os.path.join(path_export_folder, EXPORT_FILE_NAMES['index']), rows)
+    np.save(os.path.join(path_export_folder, EXPORT_FILE_NAMES['lookup']), lookup)
+    with open(os.path.join(path_export_folder, EXPORT_FILE_NAMES['header']), 'w') as json_file:
+        json.dump({'source': os.path.abspath(path_voxel_h5_folder),
+                   'shape': list(shape),
+                   'dtype': np.dtype(dtype).name,
+                   'axes': ['voxel', 'slice', 'y', 'x', 'channel'],
+                   'channels': list(channels),
+                   'grid_shape': list(lookup.shape)}, json_file, indent = 4)
+    print('{} voxels exported to {} in {:.2f} s'.format(rows.size, path_export_folder, time.time() - start_time))
+    return path_export_folder
+
+
+'''
+-------------------------------------------------------------------------------
+MemmapVoxels:
+class that opens an export read-only as memory map
+
+inputs:
+path_export_folder = str of the folder of the export
+'''
+class MemmapVoxels:
+    def __init__(self, path_export_folder):
+        self.voxels = np.load(os.path.join(path_export_folder, EXPORT_FILE_NAMES['voxels']), mmap_mode = 'r')
+        self.index = np.load(os.path.join(path_export_folder, EXPORT_FILE_NAMES['index']))
+        self.lookup = np.load(os.path.join(path_export_folder, EXPORT_FILE_NAMES['lookup']))
+
+    def __len__(self):
+        return self.voxels.shape[0]
+
+    def get_row(self, n_vox_x, n_vox_y, num_z):
+        if not (0 <= n_vox_x < self.lookup.shape[0] and 0 <= n_vox_y < self.lookup.shape[1] and 0 <= num_z < self.lookup.shape[2]):
+            return -1
+        return int(self.lookup[n_vox_x, n_vox_y, num_z])
+
+    def get(self, n_vox_x, n_vox_y, num_z):
+        #view into the memory map, None if the voxel wasn't exported
+        row = self.get_row(n_vox_x, n_vox_y, num_z)
+        return None if row < 0 else self.voxels[row]
+
+
+if __name__ == '__main__':
+    path_export_folder = export_memmap('/home/jan/Documents/Trainingsdaten/ZP_4/ZP_4_voxel_100_10')
+    voxels = MemmapVoxels(path_export_folder)
+    print(len(voxels), voxels.voxels.shape)
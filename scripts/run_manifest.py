@@ -0,0 +1,156 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Completion manifest of a voxelization run. Every (voxel layer, slice) unit which
+was written and flushed is appended to a log in the output folder, together with
+a fingerprint of the inputs and the configuration. A rerun skips the completed
+units, writes the partial ones again and recomputes everything if the buildjob
+or the voxel parameters have changed
+
+layout of the manifest folder (path_voxel_h5_folder/voxelization_manifest):
+fingerprint.json        fingerprint of the run the logs belong to
+completed_{writer}.log  one line 'num_z num_slice_voxel' per completed unit, one
+                        log per writing process so no locking is needed
+'''
+import glob
+import hashlib
+import json
+import os
+import shutil
+from voxel_writer import VOXEL_TABLES_FOLDER_NAME
+from voxel_index import VOXEL_INDEX_FILE_NAME
+from voxel_features import FEATURE_TABLE_FILE_NAME
+
+MANIFEST_FOLDER_NAME = 'voxelization_manifest'
+
+
+'''
+-------------------------------------------------------------------------------
+get_input_fingerprint:
+function that returns the fingerprint of the inputs and the configuration of a
+run. The buildjob is identified by its absolute path, size and modification time
+(hashing the content of a buildjob of several GB would take as long as a scan)
+
+inputs:
+config = VoxelizationConfig
+full_grid = bool whether the run writes the full grid files (Voxel_layer:_{z}.hdf5)
+            instead of the storage reduced layer files
+
+outputs:
+str of the sha256 hex digest
+'''
+def get_input_fingerprint(config, full_grid = False):
+    stat = os.stat(config.path_buildjob_h5)
+    fingerprint_dict = config.to_dict(derived = False)
+    del fingerprint_dict['path_voxel_h5_folder']
+    fingerprint_dict['path_buildjob_h5'] = os.path.abspath(config.path_buildjob_h5)
+    fingerprint_dict['buildjob_size'] = stat.st_size
+    fingerprint_dict['buildjob_mtime'] = stat.st_mtime
+    fingerprint_dict['max_slice_number'] = config.max_slice_number
+    if full_grid:
+        #not part of the config, but another set of files -> a storage reduced run in the folder is not resumed
+        fingerprint_dict['full_grid'] = True
+    return hashlib.sha256(json.dumps(fingerprint_dict, sort_keys = True).encode()).hexdigest()
+
+
+'''
+-------------------------------------------------------------------------------
+RunManifest:
+class to read and append the completion logs of a run
+
+inputs:
+path_voxel_h5_folder = str of the output folder of the run
+writer_id = str of the name of the log this process appends to
+'''
+class RunManifest:
+    def __init__(self, path_voxel_h5_folder, writer_id = 'main'):
+        self.path_manifest_folder = os.path.join(path_voxel_h5_folder, MANIFEST_FOLDER_NAME)
+        self.path_log = os.path.join(self.path_manifest_folder, 'completed_{}.log'.format(writer_id))
+
+    def get_fingerprint(self):
+        path_fingerprint = os.path.join(self.path_manifest_folder, 'fingerprint.json')
+        if not os.path.isfile(path_fingerprint):
+            return None
+        with open(path_fingerprint) as json_file:
+            return json.load(json_file)['fingerprint']
+
+    def get_completed(self):
+        completed = set()
+        for path_log in glob.glob(os.path.join(self.path_manifest_folder, 'completed_*.log')):
+            with open(path_log) as log_file:
+                for line in log_file:
+                    values = line.split()
+                    if len(values) == 2: #a line cut by a crash is ignored -> the unit is written again
+                        completed.add((int(values[0]), int(values[1])))
+        return completed
+
+    def mark_completed(self, num_z, num_slice_voxel):
+        #only call this after the data of the unit was flushed
+        with open(self.path_log, 'a') as log_file:
+            log_file.write('{} {}\n'.format(num_z, num_slice_voxel))
+            log_file.flush()
+            os.fsync(log_file.fileno())
+
+
+'''
+-------------------------------------------------------------------------------
+prepare_manifest:
+function that is called once by the parent process before a run. If the manifest
+belongs to other inputs or another configuration, the old voxel files and logs are
+deleted and everything is recomputed
+
+inputs:
+config = resolved VoxelizationConfig (output folder has to exist)
+restart = bool whether the completed units are discarded and everything is computed again
+full_grid = bool whether the run writes the full grid files (see get_input_fingerprint)
+
+outputs:
+set of the completed (num_z, num_slice_voxel) units which can be skipped
+'''
+def prepare_manifest(config, restart = False, full_grid = False):
+    manifest = RunManifest(config.path_voxel_h5_folder)
+    fingerprint = get_input_fingerprint(config, full_grid)
+    old_fingerprint = manifest.get_fingerprint()
+
+    if old_fingerprint == fingerprint and not restart:
+        completed = manifest.get_completed()
+        print('resuming run: {} of {} voxel slices are already completed'.format(len(completed), len(config.num_z_list)*config.num_layers_per_voxel))
+        return completed
+
+    if old_fingerprint is not None:
+        print('restart or changed buildjob/voxel parameters -> all voxels are computed again')
+        for path_old in glob.glob(os.path.join(config.path_voxel_h5_folder, 'Voxel*.hdf5')):
+            os.remove(path_old)
+        shutil.rmtree(os.path.join(config.path_voxel_h5_folder, VOXEL_TABLES_FOLDER_NAME), ignore_errors = True)
+        #the tables of the old files would describe a run which doesn't exist anymore
+        for file_name in (VOXEL_INDEX_FILE_NAME, FEATURE_TABLE_FILE_NAME):
+            if os.path.isfile(os.path.join(config.path_voxel_h5_folder, file_name)):
+                os.remove(os.path.join(config.path_voxel_h5_folder, file_name))
+    os.makedirs(manifest.path_manifest_folder, exist_ok = True)
+    for path_log in glob.glob(os.path.join(manifest.path_manifest_folder, 'completed_*.log')):
+        os.remove(path_log)
+    with open(os.path.join(manifest.path_manifest_folder, 'fingerprint.json'), 'w') as json_file:
+        json.dump({'fingerprint': fingerprint, 'config': config.to_dict()}, json_file, indent = 4)
+    return set()
+
+
+'''
+-------------------------------------------------------------------------------
+get_pending_slices:
+function that returns the slice numbers of the voxel grid which are not completed
+(a slice of overlapping voxel layers is pending till it is completed in all of them)
+
+inputs:
+config = resolved VoxelizationConfig
+completed = set of the completed (num_z, num_slice_voxel) units
+slice_numbers = iterable of slice numbers to filter (default: all slices of the grid)
+
+outputs:
+list of slice numbers
+'''
+def get_pending_slices(config, completed, slice_numbers = None):
+    if slice_numbers is None:
+        slice_numbers = range(config.num_slices)
+    return [num_slice for num_slice in slice_numbers if not completed.issuperset(config.get_voxel_layers(num_slice))]
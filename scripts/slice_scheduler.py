@@ -0,0 +1,257 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Slice level scheduler for the storage reduced voxelization. Instead of mapping
+whole voxel layers onto a pool of 4 processes, every slice is a task of its own.
+The slices are handed out largest first (point counts of the bounds scan) to a
+configurable number of compute processes. The binned slices are sent to writer
+processes and every voxel layer file is owned by exactly one writer process, so
+hdf5's single writer constraint is kept without parallelizing per layer
+'''
+import concurrent.futures
+import multiprocessing
+import numpy as np
+import os
+import queue
+import threading
+import time
+from create_hdf_per_single_vox_layer_storage_reduced import create_slice_array, get_slice_columns
+from voxel_writer import create_voxel_layer_writer
+from run_manifest import RunManifest, prepare_manifest, get_pending_slices
+from voxel_index import build_voxel_index
+from voxel_features import get_feature_extractor, build_feature_table
+import instrumentation
+
+
+#set in every compute process by init_compute_process
+compute_state = {}
+
+#seconds between the checks whether a writer process died (a bounded queue of a dead writer blocks forever)
+WRITER_CHECK_SECONDS = 1
+
+'''
+-------------------------------------------------------------------------------
+init_compute_process:
+initializer of the compute processes, the config, the writer queues and the abort
+event (set by the parent if a writer process died) are handed over once per process
+and not with every slice
+'''
+def init_compute_process(config, writer_queues, abort_event, instrumentation_settings):
+    compute_state['config'] = config
+    compute_state['writer_queues'] = writer_queues
+    compute_state['abort_event'] = abort_event
+    instrumentation.init_process(instrumentation_settings)
+
+
+'''
+-------------------------------------------------------------------------------
+get_writer_index:
+function that returns the index of the writer process which owns the layer file
+of voxel layer num_z (a shard only has every num_shards-th layer, so the layers
+are counted within the shard to use all the writers)
+'''
+def get_writer_index(num_z, num_writers, num_shards = 1):
+    return (num_z // num_shards) % num_writers
+
+
+'''
+-------------------------------------------------------------------------------
+put_binned_slice:
+function that puts a binned slice into a writer queue. The queue is bounded, so
+the put is retried with a timeout and given up when the run is aborted
+'''
+def put_binned_slice(writer_queue, item, abort_event):
+    while True:
+        if abort_event.is_set():
+            raise RuntimeError('the run was aborted because a writer process failed')
+        try:
+            writer_queue.put(item, timeout = WRITER_CHECK_SECONDS)
+            return
+        except queue.Full:
+            pass
+
+
+'''
+-------------------------------------------------------------------------------
+compute_slice:
+task of the compute processes: reads, filters and bins one slice and sends the
+result to the writer process owning the layer file (to every layer file which
+contains the slice for overlapping voxel layers)
+
+inputs:
+num_slice = int of the slice number (0 -> Slice00001)
+
+outputs:
+tuple of num_slice, number of binned datapoints and the instrumentation snapshot
+of the task
+'''
+def compute_slice(num_slice):
+    config = compute_state['config']
+    writer_queues = compute_state['writer_queues']
+    abort_event = compute_state['abort_event']
+    if abort_event.is_set():
+        raise RuntimeError('the run was aborted because a writer process failed')
+
+    array_sorted, offsets = create_slice_array(num_slice, config)
+    for num_z, num_slice_voxel in config.get_voxel_layers(num_slice):
+        put_binned_slice(writer_queues[get_writer_index(num_z, len(writer_queues), config.num_shards)], (num_z, num_slice_voxel, array_sorted, offsets), abort_event)
+    return num_slice, int(offsets[-1]), instrumentation.collect()
+
+
+'''
+-------------------------------------------------------------------------------
+run_writer_process:
+loop of a writer process. Writes every binned slice it receives into its layer
+files (one flush per slice) till None is received. Every flushed slice is
+recorded in the writer's log of the run manifest. The instrumentation snapshot of
+the writer is put into report_queue at the end
+'''
+def run_writer_process(config, writer_queue, writer_index = 0, report_queue = None, instrumentation_settings = None):
+    if instrumentation_settings is not None:
+        instrumentation.init_process(instrumentation_settings)
+    manifest = RunManifest(config.path_voxel_h5_folder, 'writer_{}'.format(writer_index))
+    with create_voxel_layer_writer(config.output_format, config.path_voxel_h5_folder, config.num_voxels_x, config.num_voxels_y, config.num_layers_per_voxel,
+                                   flush_policy = 'slice', compression = config.compression, skip_empty = config.skip_empty_voxels, features = get_feature_extractor(config)) as writer:
+        while True:
+            item = writer_queue.get()
+            if item is None:
+                break
+            num_z, num_slice_voxel, array_sorted, offsets = item
+            writer.add_slice(num_z, num_slice_voxel, get_slice_columns(array_sorted), offsets, config.num_voxels_x)
+            writer.end_slice()
+            manifest.mark_completed(num_z, num_slice_voxel)
+    if report_queue is not None:
+        report_queue.put(instrumentation.collect())
+
+
+'''
+-------------------------------------------------------------------------------
+get_slice_order:
+function that returns all the slices of the voxel grid sorted by their number of
+datapoints (largest first). Slices which don't exist (e.g. in the topmost voxel
+layer) have 0 datapoints and come last
+
+inputs:
+config = resolved VoxelizationConfig
+
+outputs:
+list of slice numbers
+'''
+def get_slice_order(config):
+    num_slices = config.num_slices
+    num_points = np.zeros(num_slices, dtype = np.int64)
+    num_points_scanned = config.bounds['num_points'][:num_slices]
+    num_points[:num_points_scanned.size] = num_points_scanned
+    return np.argsort(-num_points, kind = 'stable').tolist()
+
+
+'''
+-------------------------------------------------------------------------------
+shutdown_compute_processes:
+function that shuts the pool of the compute processes down. If a writer process
+died, the abort event makes the running tasks give up and the waiting tasks are
+cancelled. The slices which are already in the queue of a dead writer are drained
+by a thread of this process, otherwise the feeder threads of the compute processes
+never finish and the pool can't shut down
+'''
+def shutdown_compute_processes(executor, writer_queues, writer_processes, abort_event):
+    if any(not writer_process.is_alive() for writer_process in writer_processes):
+        abort_event.set()
+    stop_draining = threading.Event()
+    def drain_dead_queues():
+        while not stop_draining.is_set():
+            dead_queues = [writer_queue for writer_queue, writer_process in zip(writer_queues, writer_processes) if not writer_process.is_alive()]
+            for writer_queue in dead_queues:
+                try:
+                    writer_queue.get(timeout = 0.1)
+                except queue.Empty:
+                    pass
+            if not dead_queues:
+                stop_draining.wait(0.1)
+    drain_thread = threading.Thread(target = drain_dead_queues, daemon = True)
+    drain_thread.start()
+    executor.shutdown(wait = True, cancel_futures = abort_event.is_set())
+    stop_draining.set()
+    drain_thread.join()
+
+
+'''
+-------------------------------------------------------------------------------
+run_slice_scheduler:
+function that voxelizes a part with the slice level scheduler
+
+inputs:
+config = VoxelizationConfig (output_format 'groups' or 'csr')
+max_workers = int of number of compute processes (None -> number of CPUs)
+num_writers = int of number of writer processes (None -> min(4, number of layer files))
+queue_size = int of number of binned slices which can wait per writer process
+             (bounds the memory if the writers are slower than the compute processes)
+restart = bool whether slices completed by an earlier run are computed again
+'''
+def run_slice_scheduler(config, max_workers = None, num_writers = None, queue_size = 8, restart = False):
+    if config.output_format not in ('groups', 'csr'):
+        raise ValueError('the slice scheduler writes the storage reduced layouts groups and csr, not {}'.format(config.output_format))
+    start_time = time.time()
+    config.resolve()
+    config.make_output_folder()
+    config.save_json(os.path.join(config.path_voxel_h5_folder, 'voxelization_config.json'))
+    completed = prepare_manifest(config, restart)
+
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    if num_writers is None:
+        num_writers = min(4, len(config.num_z_list))
+    num_writers = max(1, min(num_writers, len(config.num_z_list)))
+
+    writer_queues = [multiprocessing.Queue(maxsize = queue_size) for _ in range(num_writers)]
+    abort_event = multiprocessing.Event()
+    report_queue = multiprocessing.Queue()
+    writer_processes = [multiprocessing.Process(target = run_writer_process, args = (config, writer_queue, writer_index, report_queue, instrumentation.get_settings())) for writer_index, writer_queue in enumerate(writer_queues)]
+    for writer_process in writer_processes:
+        writer_process.start()
+
+    try:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers = max_workers, initializer = init_compute_process, initargs = (config, writer_queues, abort_event, instrumentation.get_settings()))
+        try:
+            futures = [executor.submit(compute_slice, num_slice) for num_slice in get_pending_slices(config, completed, get_slice_order(config))]
+            not_done = set(futures)
+            while not_done:
+                done, not_done = concurrent.futures.wait(not_done, timeout = WRITER_CHECK_SECONDS, return_when = concurrent.futures.FIRST_COMPLETED)
+                if any(not writer_process.is_alive() for writer_process in writer_processes):
+                    break #the exit codes are raised below, after the pool is shut down
+                for future in done:
+                    instrumentation.merge(future.result()[2]) #raises the exception of a failed slice
+        finally:
+            shutdown_compute_processes(executor, writer_queues, writer_processes, abort_event)
+    finally:
+        #only the writers which are still alive get the end signal, the put would block on the full queue of a dead one
+        for writer_queue, writer_process in zip(writer_queues, writer_processes):
+            while writer_process.is_alive():
+                try:
+                    writer_queue.put(None, timeout = WRITER_CHECK_SECONDS)
+                    break
+                except queue.Full:
+                    pass
+        #the snapshots are read before join, a process doesn't exit while its queue holds data
+        for writer_process in writer_processes:
+            while writer_process.is_alive() or not report_queue.empty():
+                try:
+                    instrumentation.merge(report_queue.get(timeout = 0.1))
+                except queue.Empty:
+                    pass
+            writer_process.join()
+
+    failed_writers = [writer_process.exitcode for writer_process in writer_processes if writer_process.exitcode != 0]
+    if failed_writers:
+        raise RuntimeError('{} writer process(es) failed with exit codes {}'.format(len(failed_writers), failed_writers))
+    build_voxel_index(config.path_voxel_h5_folder)
+    if config.features:
+        build_feature_table(config.path_voxel_h5_folder)
+    print("voxelization of {} slices took {} s".format(len(futures), time.time() - start_time))
+
+
+if __name__ == '__main__':
+    from Definitions import config
+    run_slice_scheduler(config)
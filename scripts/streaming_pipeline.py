@@ -0,0 +1,262 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Streaming voxelization pipeline with three stages connected by bounded queues:
+  reader (thread)    prefetches the raw columns of the next slices out of the buildjob hdf5
+  compute (processes) filter, dedup and binning of a slice
+  writer (thread)    writes the binned slices into the voxel layer files
+so reading, computing and writing overlap. A memory budget gives backpressure:
+a slice is only read when the bytes of all slices in flight (read but not yet
+written) fit into the budget. The queue depths of all stages are sampled, so the
+report shows which stage is the bottleneck
+'''
+import concurrent.futures
+import h5py
+import numpy as np
+import os
+import queue
+import threading
+import time
+import instrumentation
+from helping_functions import filter_slice_columns, SliceLoader, SLICE_COLUMN_NAMES
+from create_hdf_per_single_vox_layer_storage_reduced import bin_slice_array, get_slice_columns
+from slice_scheduler import get_slice_order
+from voxel_writer import create_voxel_layer_writer
+from run_manifest import RunManifest, prepare_manifest, get_pending_slices
+from voxel_index import build_voxel_index
+from voxel_features import get_feature_extractor, build_feature_table
+
+
+'''
+-------------------------------------------------------------------------------
+MemoryBudget:
+class that counts the bytes of all slices in flight. acquire blocks till the
+bytes fit into the budget (a single slice larger than the budget is let through
+when nothing else is in flight, otherwise the pipeline would stall)
+'''
+class MemoryBudget:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.peak_bytes = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, nbytes):
+        with self.condition:
+            while self.used_bytes > 0 and self.used_bytes + nbytes > self.max_bytes:
+                self.condition.wait()
+            self.used_bytes += nbytes
+            self.peak_bytes = max(self.peak_bytes, self.used_bytes)
+
+    def release(self, nbytes):
+        with self.condition:
+            self.used_bytes -= nbytes
+            self.condition.notify_all()
+
+
+'''
+-------------------------------------------------------------------------------
+StageMetrics:
+class that collects queue depth samples and busy times per stage
+'''
+class StageMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.depths = {}
+        self.busy_seconds = {}
+
+    def sample(self, stage, depth):
+        with self.lock:
+            self.depths.setdefault(stage, []).append(depth)
+
+    def add_busy(self, stage, seconds):
+        with self.lock:
+            self.busy_seconds[stage] = self.busy_seconds.get(stage, 0.0) + seconds
+
+    def summary(self):
+        stages = sorted(set(self.depths) | set(self.busy_seconds))
+        return {stage: {'max_depth': int(max(self.depths.get(stage, [0]))),
+                        'mean_depth': float(np.mean(self.depths.get(stage, [0]))),
+                        'busy_s': self.busy_seconds.get(stage, 0.0)} for stage in stages}
+
+
+#set in every compute process by init_compute_process
+compute_state = {}
+
+def init_compute_process(config, instrumentation_settings):
+    compute_state['config'] = config
+    instrumentation.init_process(instrumentation_settings)
+
+
+'''
+-------------------------------------------------------------------------------
+compute_raw_slice:
+task of the compute processes: filters, dedups and bins the raw columns of a slice
+
+inputs:
+num_slice = int of the slice number
+raw_columns = tuple of X-Axis, Y-Axis, Area, Intensity (None if the slice doesn't exist)
+
+outputs:
+tuple of num_slice, sorted slice array, offsets, compute time and the instrumentation
+snapshot of the task
+'''
+def compute_raw_slice(num_slice, raw_columns):
+    start_time = time.time()
+    config = compute_state['config']
+    if raw_columns is None:
+        array_not_docked = np.empty([0,4], dtype = int)
+    else:
+        array_not_docked = filter_slice_columns(*raw_columns, mode = config.reduction_mode)
+    array_sorted, offsets = bin_slice_array(array_not_docked, config)
+    return num_slice, array_sorted, offsets, time.time() - start_time, instrumentation.collect()
+
+
+'''
+-------------------------------------------------------------------------------
+estimate_slice_bytes:
+function that estimates the memory of a slice in flight out of the dataset sizes
+and dtypes (read columns + filtered array + binned copy)
+'''
+def estimate_slice_bytes(slice_group):
+    datasets = [slice_group[column_name] for column_name in SLICE_COLUMN_NAMES]
+    num_points = min(dataset.size for dataset in datasets)
+    #SliceLoader reads into int32 and switches to int64 if the values don't fit, so the
+    #size is taken from the common dtype of the datasets (at least int32)
+    itemsize = np.result_type(np.int32, *(dataset.dtype for dataset in datasets)).itemsize
+    return 3*4*itemsize*num_points
+
+
+'''
+-------------------------------------------------------------------------------
+run_streaming_pipeline:
+function that voxelizes a part with the streaming pipeline
+
+inputs:
+config = VoxelizationConfig (output_format 'groups' or 'csr')
+max_workers = int of number of compute processes (None -> number of CPUs)
+prefetch = int of number of read slices which can wait for a compute process
+memory_budget_bytes = int of bytes of all slices in flight
+report = bool whether the stage report is printed
+restart = bool whether slices completed by an earlier run are computed again
+
+outputs:
+dict with the stage metrics (max/mean queue depth, busy time), the peak bytes in
+flight and the total time
+'''
+def run_streaming_pipeline(config, max_workers = None, prefetch = 4, memory_budget_bytes = 2*1024**3, report = True, restart = False):
+    if config.output_format not in ('groups', 'csr'):
+        raise ValueError('the streaming pipeline writes the storage reduced layouts groups and csr, not {}'.format(config.output_format))
+    start_time = time.time()
+    config.resolve()
+    config.make_output_folder()
+    config.save_json(os.path.join(config.path_voxel_h5_folder, 'voxelization_config.json'))
+    completed = prepare_manifest(config, restart)
+    manifest = RunManifest(config.path_voxel_h5_folder, 'pipeline')
+    if max_workers is None:
+        max_workers = os.cpu_count()
+
+    budget = MemoryBudget(memory_budget_bytes)
+    metrics = StageMetrics()
+    read_queue = queue.Queue(maxsize = prefetch)
+    write_queue = queue.Queue()
+    in_flight = threading.Semaphore(2*max_workers) #slices submitted to the compute processes but not finished
+    errors = []
+
+    def read_stage():
+        #the columns are read into the buffers of the reader (trimmed, int32 or int64) and only the used part is copied for the worker
+        loader = SliceLoader()
+        try:
+            with h5py.File(config.path_buildjob_h5, 'r') as h5:
+                part = h5[config.part_name]
+                for num_slice in get_pending_slices(config, completed, get_slice_order(config)):
+                    Slice_name = config.get_slice_name(num_slice)
+                    nbytes = estimate_slice_bytes(part[Slice_name]) if Slice_name in part else 0
+                    budget.acquire(nbytes)
+                    stage_start = time.time()
+                    raw_columns = None
+                    if Slice_name in part:
+                        with instrumentation.span('read'):
+                            raw_columns = tuple(loader.read(part[Slice_name]).copy())
+                    metrics.add_busy('read', time.time() - stage_start)
+                    read_queue.put((num_slice, raw_columns, nbytes))
+                    metrics.sample('read', read_queue.qsize())
+                    if errors:
+                        break
+        except Exception as error:
+            errors.append(error)
+        finally:
+            read_queue.put(None)
+
+    def write_stage():
+        with create_voxel_layer_writer(config.output_format, config.path_voxel_h5_folder, config.num_voxels_x, config.num_voxels_y, config.num_layers_per_voxel,
+                                       flush_policy = 'slice', compression = config.compression, skip_empty = config.skip_empty_voxels, features = get_feature_extractor(config)) as writer:
+            while True:
+                item = write_queue.get()
+                if item is None:
+                    break
+                future, nbytes = item
+                try:
+                    num_slice, array_sorted, offsets, compute_seconds, snapshot = future.result()
+                    instrumentation.merge(snapshot)
+                    metrics.add_busy('compute', compute_seconds)
+                    stage_start = time.time()
+                    for num_z, num_slice_voxel in config.get_voxel_layers(num_slice):
+                        writer.add_slice(num_z, num_slice_voxel, get_slice_columns(array_sorted), offsets, config.num_voxels_x)
+                        writer.end_slice()
+                        manifest.mark_completed(num_z, num_slice_voxel)
+                    metrics.add_busy('write', time.time() - stage_start)
+                except Exception as error:
+                    errors.append(error)
+                finally:
+                    budget.release(nbytes)
+                metrics.sample('write', write_queue.qsize())
+
+    reader = threading.Thread(target = read_stage, daemon = True)
+    writer_thread = threading.Thread(target = write_stage, daemon = True)
+    reader.start()
+    writer_thread.start()
+
+    num_slices = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers = max_workers, initializer = init_compute_process, initargs = (config, instrumentation.get_settings())) as executor:
+        while True:
+            item = read_queue.get()
+            if item is None:
+                break
+            num_slice, raw_columns, nbytes = item
+            in_flight.acquire()
+            future = executor.submit(compute_raw_slice, num_slice, raw_columns)
+            future.add_done_callback(lambda finished_future: in_flight.release())
+            #the writer handles the slices in submission order, so the write queue depth is the compute backlog
+            write_queue.put((future, nbytes))
+            metrics.sample('compute', write_queue.qsize())
+            num_slices += 1
+            if errors:
+                #let the reader run into its end (it stops after the next slice)
+                while read_queue.get() is not None:
+                    pass
+                break
+        write_queue.put(None)
+        writer_thread.join()
+    reader.join()
+
+    if errors:
+        raise errors[0]
+    build_voxel_index(config.path_voxel_h5_folder)
+    if config.features:
+        build_feature_table(config.path_voxel_h5_folder)
+
+    result = {'stages': metrics.summary(), 'peak_bytes_in_flight': budget.peak_bytes, 'num_slices': num_slices, 'total_s': time.time() - start_time}
+    if report:
+        print('{:<10}{:>12}{:>12}{:>12}'.format('stage', 'max depth', 'mean depth', 'busy s'))
+        for stage, stage_metrics in result['stages'].items():
+            print('{:<10}{:>12}{:>12.2f}{:>12.2f}'.format(stage, stage_metrics['max_depth'], stage_metrics['mean_depth'], stage_metrics['busy_s']))
+        print('peak bytes in flight: {}, {} slices in {:.2f} s'.format(budget.peak_bytes, num_slices, result['total_s']))
+    return result
+
+
+if __name__ == '__main__':
+    from Definitions import config
+    run_streaming_pipeline(config)
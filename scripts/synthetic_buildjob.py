@@ -0,0 +1,185 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Generator of synthetic buildjob hdf5 files with the schema of the real buildjobs
+(part/SliceNNNNN/{X-Axis,Y-Axis,Area,Intensity} and the part attributes minX,
+maxX, minY, maxY, minZ, maxZ, layerThickness), so the voxelization can be run and
+benchmarked without the private Trainingsdaten. The quirks the filtering has to
+deal with are configurable: repeated x,y-positions, datapoints where area and
+intensity are 0, columns of different length and missing slices
+
+usage:
+python synthetic_buildjob.py synthetic.h5 --slices 100 --points 50000 --footprint ring
+'''
+import argparse
+import h5py
+import json
+import numpy as np
+
+FOOTPRINTS = ('rectangle', 'circle', 'ring', 'l-shape')
+
+
+'''
+-------------------------------------------------------------------------------
+get_footprint_mask:
+function that returns the bool mask of the footprint of a part (True where the
+part is exposed) on a grid of shape (width, height)
+'''
+def get_footprint_mask(footprint, width, height):
+    if footprint not in FOOTPRINTS:
+        raise ValueError('footprint has to be one of {}, not {}'.format(FOOTPRINTS, footprint))
+    x, y = np.meshgrid(np.arange(width), np.arange(height), indexing = 'ij')
+    if footprint == 'rectangle':
+        return np.ones((width, height), dtype = bool)
+    #x, y relative to the center, scaled to -1..1
+    x_rel = (x - (width - 1)/2)/(width/2)
+    y_rel = (y - (height - 1)/2)/(height/2)
+    if footprint == 'circle':
+        return x_rel**2 + y_rel**2 <= 1
+    if footprint == 'ring':
+        return (x_rel**2 + y_rel**2 <= 1) & (x_rel**2 + y_rel**2 >= 0.5**2)
+    return (x < width//2) | (y < height//2) #l-shape
+
+
+'''
+-------------------------------------------------------------------------------
+create_slice_columns:
+function that creates the raw columns of one slice: unique positions inside the
+footprint, repeated positions (with other area/intensity values, in random order),
+area/intensity pairs which are both 0 and optionally columns with extra values
+
+inputs:
+rng = np.random.Generator
+positions = np array of the flat indices of the footprint mask
+height = int of height of the footprint grid (to get x and y out of the flat index)
+origin = tuple of x and y of the corner of the footprint
+num_points = int of number of datapoints of the slice
+duplicate_ratio = float of share of datapoints on a position which occurs before
+zero_ratio = float of share of datapoints where area and intensity are 0
+mismatch = int of number of extra values of one random column (0 -> equal length)
+dtype = np dtype of the columns
+
+outputs:
+dict of column name -> np array
+'''
+def create_slice_columns(rng, positions, height, origin, num_points, duplicate_ratio, zero_ratio, mismatch, dtype):
+    num_unique = max(1, int(round(num_points*(1 - duplicate_ratio))))
+    unique_positions = rng.choice(positions, size = num_unique, replace = num_unique > positions.size)
+    repeated_positions = rng.choice(unique_positions, size = num_points - num_unique)
+    flat_positions = rng.permutation(np.concatenate((unique_positions, repeated_positions)))
+
+    #melt pool like values: most datapoints are small, some are bright. Apart from the zero pairs the values
+    #are >= 1, so the legacy pandas filter (drops a datapoint if area OR intensity is 0) gives the same result
+    area = np.maximum(1, np.round(rng.gamma(2.0, 40.0, num_points)))
+    intensity = np.maximum(1, np.round(rng.gamma(1.5, 300.0, num_points)))
+    zero_indices = rng.choice(num_points, size = int(round(num_points*zero_ratio)), replace = False)
+    area[zero_indices] = 0
+    intensity[zero_indices] = 0
+
+    columns = {'X-Axis': flat_positions // height + origin[0],
+               'Y-Axis': flat_positions % height + origin[1],
+               'Area': area,
+               'Intensity': intensity}
+    if mismatch:
+        column_name = rng.choice(list(columns))
+        columns[column_name] = np.concatenate((columns[column_name], columns[column_name][-mismatch:]))
+    return {column_name: column.astype(dtype) for column_name, column in columns.items()}
+
+
+'''
+-------------------------------------------------------------------------------
+create_synthetic_buildjob:
+function that writes a synthetic buildjob hdf5
+
+inputs:
+path = str of path of the hdf5 (overwritten)
+part_names = list of the names of the parts
+num_slices = int of number of slices per part (the last slice always exists)
+points_per_slice = int of mean number of datapoints per slice
+points_spread = float of relative spread of the number of datapoints between the slices
+duplicate_ratio = float of share of datapoints on a position which already occurs in the slice
+zero_ratio = float of share of datapoints where area and intensity are 0
+mismatch_ratio = float of share of slices where one column has extra values
+mismatch_size = int of number of extra values of the longer column
+missing_ratio = float of share of slices which are missing
+footprint = str of the shape of the part (see FOOTPRINTS)
+footprint_size = tuple of width and height of the part (units of X-Axis and Y-Axis)
+origin = tuple of x and y of the corner of the part (may be negative)
+layer_thickness = float of the layerThickness attribute
+dtype = np dtype of the columns
+seed = int of the seed (same arguments and seed -> same file)
+
+outputs:
+dict of the generation parameters (also stored as attribute 'synthetic' of the file)
+'''
+def create_synthetic_buildjob(path, part_names = ('part_0',), num_slices = 50, points_per_slice = 20000, points_spread = 0.2,
+                              duplicate_ratio = 0.1, zero_ratio = 0.05, mismatch_ratio = 0.05, mismatch_size = 1, missing_ratio = 0.02,
+                              footprint = 'rectangle', footprint_size = (1000, 600), origin = (-200, 50),
+                              layer_thickness = 0.05, dtype = np.float64, seed = 0):
+    parameters = {'part_names': list(part_names), 'num_slices': num_slices, 'points_per_slice': points_per_slice, 'points_spread': points_spread,
+                  'duplicate_ratio': duplicate_ratio, 'zero_ratio': zero_ratio, 'mismatch_ratio': mismatch_ratio, 'mismatch_size': mismatch_size, 'missing_ratio': missing_ratio,
+                  'footprint': footprint, 'footprint_size': list(footprint_size), 'origin': list(origin),
+                  'layer_thickness': layer_thickness, 'dtype': np.dtype(dtype).name, 'seed': seed}
+    width, height = footprint_size
+    positions = np.flatnonzero(get_footprint_mask(footprint, width, height))
+    rng = np.random.default_rng(seed)
+
+    with h5py.File(path, 'w') as h5:
+        h5.attrs['synthetic'] = json.dumps(parameters)
+        for part_name in part_names:
+            part = h5.create_group(part_name)
+            missing = rng.random(num_slices) < missing_ratio
+            missing[-1] = False #the highest slice number defines the number of slices of the part
+            mismatches = np.where(rng.random(num_slices) < mismatch_ratio, mismatch_size, 0)
+            num_points = np.maximum(1, np.round(points_per_slice*(1 + points_spread*rng.uniform(-1, 1, num_slices)))).astype(int)
+            for num_slice in range(num_slices):
+                if missing[num_slice]:
+                    continue
+                columns = create_slice_columns(rng, positions, height, origin, num_points[num_slice], duplicate_ratio, zero_ratio, mismatches[num_slice], dtype)
+                slice_group = part.create_group('Slice' + str("{:05d}".format(num_slice+1)))
+                for column_name, column in columns.items():
+                    slice_group.create_dataset(column_name, data = column)
+
+            part.attrs['minX'] = origin[0]
+            part.attrs['maxX'] = origin[0] + width - 1
+            part.attrs['minY'] = origin[1]
+            part.attrs['maxY'] = origin[1] + height - 1
+            part.attrs['minZ'] = 0.0
+            part.attrs['maxZ'] = num_slices*layer_thickness
+            part.attrs['layerThickness'] = layer_thickness
+    return parameters
+
+
+'''
+-------------------------------------------------------------------------------
+get_synthetic_parameters:
+function that returns the generation parameters of a synthetic buildjob (None for
+other files)
+'''
+def get_synthetic_parameters(path):
+    with h5py.File(path, 'r') as h5:
+        if 'synthetic' not in h5.attrs:
+            return None
+        return json.loads(h5.attrs['synthetic'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'write a synthetic buildjob hdf5')
+    parser.add_argument('path', help = 'path of the hdf5')
+    parser.add_argument('--parts', nargs = '+', default = ['part_0'], help = 'names of the parts')
+    parser.add_argument('--slices', type = int, default = 50, help = 'number of slices per part')
+    parser.add_argument('--points', type = int, default = 20000, help = 'mean number of datapoints per slice')
+    parser.add_argument('--duplicates', type = float, default = 0.1, help = 'share of datapoints on a repeated x,y-position')
+    parser.add_argument('--zeros', type = float, default = 0.05, help = 'share of datapoints where area and intensity are 0')
+    parser.add_argument('--mismatch', type = float, default = 0.05, help = 'share of slices with columns of different length')
+    parser.add_argument('--missing', type = float, default = 0.02, help = 'share of missing slices')
+    parser.add_argument('--footprint', default = 'rectangle', choices = FOOTPRINTS, help = 'shape of the parts')
+    parser.add_argument('--size', type = int, nargs = 2, default = [1000, 600], help = 'width and height of the parts')
+    parser.add_argument('--seed', type = int, default = 0, help = 'seed of the generator')
+    args = parser.parse_args()
+
+    create_synthetic_buildjob(args.path, part_names = args.parts, num_slices = args.slices, points_per_slice = args.points,
+                              duplicate_ratio = args.duplicates, zero_ratio = args.zeros, mismatch_ratio = args.mismatch,
+                              missing_ratio = args.missing, footprint = args.footprint, footprint_size = args.size, seed = args.seed)
@@ -0,0 +1,31 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Checks of benchmark.py on a tiny synthetic buildjob: the filtered slices and the
+binned voxels equal the legacy functions and all the schedulers write the same
+voxels. Only the checks are asserted, the timings of such a small part say nothing
+
+usage:
+python -m pytest scripts/test_benchmark.py
+'''
+import pytest
+from benchmark import run_benchmark, get_failures
+
+TINY_BUILDJOB = {'num_slices': 12, 'points_per_slice': 3000, 'footprint': 'ring', 'footprint_size': (300, 200)}
+
+
+@pytest.mark.parametrize('output_format', ['groups', 'csr'])
+def test_benchmark_checks(tmp_path, output_format):
+    result = run_benchmark(str(tmp_path), buildjob_kwargs = TINY_BUILDJOB, voxel_size = 50, num_layers_per_voxel = 4, output_format = output_format,
+                           num_sample_slices = 2, repeat = 1, max_workers = 2)
+    assert result['checks'], 'the benchmark made no checks'
+    assert [name for name, passed in result['checks'].items() if not passed] == []
+
+
+def test_get_failures():
+    result = {'checks': {'filter_equals_legacy': True, 'slice_equals_layer': False},
+              'regressions': [{'name': 'pipeline slice'}]}
+    assert get_failures(result) == ['check slice_equals_layer', 'regression pipeline slice']
+    assert get_failures({'checks': {'filter_equals_legacy': True}, 'regressions': []}) == []
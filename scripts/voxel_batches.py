@@ -0,0 +1,192 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Batched iterator over the dense voxels of a voxelization run for training. The
+batches are plain NumPy arrays (no framework needed) and are loaded ahead in a
+pool of worker processes, each with its own VoxelStore. The voxels are selected
+by a predicate on the voxel index (see voxel_index.py) and shuffled every epoch
+with a seed derived from (seed, epoch), so runs are reproducible. The shuffle is
+file locality aware: the order of the layer files is shuffled and the voxels are
+shuffled within a file, so a batch only reads from one or two files
+
+usage:
+batches = VoxelBatchIterator('ZP_4_voxel_100_10', batch_size = 32, predicate = skip_empty_voxels)
+for epoch in range(10):
+    for voxels, rows in batches.epoch(epoch):
+        ...  #voxels: (batch, layers, voxel_size, voxel_size, channels), rows: index rows of the voxels
+'''
+import concurrent.futures
+import collections
+import json
+import numpy as np
+import os
+from voxel_index import VOXEL_INDEX_FILE_NAME, VOXEL_INDEX_DTYPE, load_voxel_index, build_voxel_index
+from voxel_store import VoxelStore, CONFIG_FILE_NAME, DENSE_FILE_NAME
+
+
+'''
+-------------------------------------------------------------------------------
+skip_empty_voxels:
+predicate which selects the voxels with datapoints
+'''
+def skip_empty_voxels(index):
+    return index['num_points'] > 0
+
+
+'''
+-------------------------------------------------------------------------------
+get_voxel_rows:
+function that returns the voxel index of a folder. The index is built if it is
+missing, the dense layout has no index and gets rows with the grid positions only
+(the statistics are NaN/-1)
+'''
+def get_voxel_rows(path_voxel_h5_folder):
+    if os.path.isfile(os.path.join(path_voxel_h5_folder, VOXEL_INDEX_FILE_NAME)):
+        return load_voxel_index(path_voxel_h5_folder)
+    if not os.path.isfile(os.path.join(path_voxel_h5_folder, DENSE_FILE_NAME)):
+        return build_voxel_index(path_voxel_h5_folder)
+
+    with open(os.path.join(path_voxel_h5_folder, CONFIG_FILE_NAME)) as json_file:
+        derived = json.load(json_file)['derived']
+    num_voxels = derived['num_voxels_x']*derived['num_voxels_y']*derived['num_voxels_z']
+    index = np.zeros(num_voxels, dtype = VOXEL_INDEX_DTYPE)
+    for field_name in VOXEL_INDEX_DTYPE.names:
+        if index.dtype[field_name].kind == 'f':
+            index[field_name] = np.nan
+    index['num_points'] = -1
+    index['offset'] = -1
+    z_grid, y_grid, x_grid = np.meshgrid(np.arange(derived['num_voxels_z']), np.arange(derived['num_voxels_y']), np.arange(derived['num_voxels_x']), indexing = 'ij')
+    index['x'], index['y'], index['z'] = x_grid.ravel(), y_grid.ravel(), z_grid.ravel()
+    return index
+
+
+#set in every worker process by init_batch_worker
+worker_state = {}
+
+def init_batch_worker(path_voxel_h5_folder, store_kwargs):
+    worker_state['store'] = VoxelStore(path_voxel_h5_folder, **store_kwargs)
+
+def load_batch(voxel_keys):
+    return np.stack(worker_state['store'].get_many(voxel_keys))
+
+
+'''
+-------------------------------------------------------------------------------
+VoxelBatchIterator:
+class that yields shuffled mini batches of dense voxels
+
+inputs:
+path_voxel_h5_folder = str of the folder of the voxel files
+batch_size = int of number of voxels per batch
+predicate = function index -> bool mask which selects the voxels (None -> all voxels)
+shuffle = bool whether the voxels are shuffled every epoch
+seed = int of the seed, the shuffle of an epoch only depends on seed and epoch
+drop_last = bool whether the last smaller batch of an epoch is dropped
+num_workers = int of number of loading processes (0 -> load in this process)
+prefetch = int of number of batches loaded ahead per worker
+store_kwargs = dict of further arguments of the VoxelStore of the workers
+'''
+class VoxelBatchIterator:
+    def __init__(self, path_voxel_h5_folder, batch_size = 32, predicate = None, shuffle = True, seed = 0, drop_last = False,
+                 num_workers = 4, prefetch = 2, store_kwargs = None):
+        self.path_voxel_h5_folder = path_voxel_h5_folder
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        #every voxel is read once per epoch -> a cache doesn't pay off
+        self.store_kwargs = dict({'max_cache_bytes': 0}, **(store_kwargs or {}))
+
+        index = get_voxel_rows(path_voxel_h5_folder)
+        if predicate is not None:
+            index = index[predicate(index)]
+        self.index = index
+        self.num_epochs_started = 0
+        self.executor = None
+        self.store = None
+
+    def __len__(self):
+        if self.drop_last:
+            return self.index.size // self.batch_size
+        return -(-self.index.size // self.batch_size)
+
+    def get_epoch_order(self, epoch):
+        #index rows are sorted by z, y, x -> blocks of rows of one layer file
+        if not self.shuffle:
+            return np.arange(self.index.size)
+        rng = np.random.default_rng([self.seed, epoch])
+        layer_blocks = [np.flatnonzero(self.index['z'] == num_z) for num_z in np.unique(self.index['z'])]
+        order = [rng.permutation(layer_blocks[num_block]) for num_block in rng.permutation(len(layer_blocks))]
+        return np.concatenate(order) if order else np.empty(0, dtype = np.int64)
+
+    def get_batches(self, epoch):
+        order = self.get_epoch_order(epoch)
+        batches = [order[start:start + self.batch_size] for start in range(0, order.size, self.batch_size)]
+        if self.drop_last and batches and batches[-1].size < self.batch_size:
+            batches = batches[:-1]
+        return batches
+
+    def epoch(self, epoch):
+        batches = self.get_batches(epoch)
+        get_keys = lambda rows: list(zip(rows['x'].tolist(), rows['y'].tolist(), rows['z'].tolist()))
+
+        if self.num_workers == 0:
+            if self.store is None:
+                self.store = VoxelStore(self.path_voxel_h5_folder, **self.store_kwargs)
+            for batch in batches:
+                rows = self.index[batch]
+                yield np.stack(self.store.get_many(get_keys(rows))), rows
+            return
+
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers = self.num_workers, initializer = init_batch_worker,
+                                                                   initargs = (self.path_voxel_h5_folder, self.store_kwargs))
+        #the batches are yielded in submission order -> deterministic for a seed
+        in_flight = collections.deque()
+        batch_iterator = iter(batches)
+        try:
+            for batch in batch_iterator:
+                rows = self.index[batch]
+                in_flight.append((self.executor.submit(load_batch, get_keys(rows)), rows))
+                if len(in_flight) >= self.num_workers*self.prefetch:
+                    break
+            while in_flight:
+                future, rows = in_flight.popleft()
+                for batch in batch_iterator:
+                    next_rows = self.index[batch]
+                    in_flight.append((self.executor.submit(load_batch, get_keys(next_rows)), next_rows))
+                    break
+                yield future.result(), rows
+        finally:
+            for future, _ in in_flight:
+                future.cancel()
+
+    def __iter__(self):
+        #every iteration is the next epoch
+        epoch = self.num_epochs_started
+        self.num_epochs_started += 1
+        return self.epoch(epoch)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures = True)
+            self.executor = None
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == '__main__':
+    with VoxelBatchIterator('/home/jan/Documents/Trainingsdaten/ZP_4/ZP_4_voxel_100_10', batch_size = 32, predicate = skip_empty_voxels) as batches:
+        for voxels, rows in batches.epoch(0):
+            print(voxels.shape, rows['num_points'].sum())
@@ -0,0 +1,285 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Configuration of a voxelization run. Importing this module has no side effects:
+the bounding box scan and the grid calculations are only done when a derived
+value is needed for the first time and are memoized afterwards. A config which
+was resolved in the parent process is a small picklable object, so worker
+processes get all the derived values without scanning the buildjob again
+'''
+import h5py
+import os
+import json
+from helping_functions import get_number_voxel, REDUCTION_MODES
+from get_part_bounds import get_part_bounds
+from voxel_writer import OUTPUT_FORMATS
+from compression_profiles import get_dataset_kwargs
+from voxel_features import FEATURE_FUNCTIONS
+
+
+'''
+-------------------------------------------------------------------------------
+get_slice_numbers:
+function that returns the slice numbers of the Slice subgroups of a part group
+(Slice01593 -> 1593). Other keys which start with Slice but have no number are
+skipped
+
+inputs:
+part = h5py.Group of the part
+
+outputs:
+list of int
+'''
+def get_slice_numbers(part):
+    return [int(key[len('Slice'):]) for key in part.keys() if key.startswith('Slice') and key[len('Slice'):].isdigit()]
+
+
+'''
+-------------------------------------------------------------------------------
+get_max_slice_number:
+function that returns the greatest slice number of a part (Slice01593 -> 1593)
+
+inputs:
+h5_path = str of path to the buildjob hdf5
+part_name = str of name of the part
+
+outputs:
+int of the greatest slice number
+'''
+def get_max_slice_number(h5_path, part_name):
+    with h5py.File(h5_path,'r') as h5:
+        slice_numbers = get_slice_numbers(h5[part_name])
+    if not slice_numbers:
+        raise ValueError('no slices found for part {} in {}'.format(part_name, h5_path))
+    return max(slice_numbers)
+
+
+'''
+-------------------------------------------------------------------------------
+VoxelizationConfig:
+class that holds the input values of a voxelization run and computes the derived
+values (bounds, number of voxels, ...) lazily
+
+inputs:
+path_buildjob_h5 = str of path of the hdf5 of the buildjob
+path_voxel_h5_folder = str of the folder where the voxel files are stored
+part_name = str of the name of the part
+voxel_size = int of x and y dimension of a voxel
+num_layers_per_voxel = int of number of slices per voxel
+max_slice_number_part = int of number of the highest slice of the part (None -> read from the hdf5)
+output_format = str of the layout of the voxel files (see voxel_writer.OUTPUT_FORMATS)
+compression = str of the compression profile (see compression_profiles.py, None -> 'none'
+              and 'shuffle-gzip' for the dense layout, its grid is mostly zeros)
+reduction_mode = str of the reduction of multiple x,y-occurences (see helping_functions.reduce_duplicate_xy)
+scan_workers = int of number of processes for the bounding box scan
+skip_empty_voxels = bool whether voxel slices without datapoints are not written (layout 'groups')
+stride_xy = int of distance between the starts of neighbouring voxels in x and y
+            (None -> voxel_size, stride_xy < voxel_size -> overlapping voxels)
+stride_z = int of number of slices between the starts of neighbouring voxel layers
+           (None -> num_layers_per_voxel, stride_z < num_layers_per_voxel -> overlapping layers)
+features = list of the names of the features computed per voxel slice while writing (see voxel_features.py)
+shard_index = int of the shard of the run (0..num_shards-1), see voxel_shards.py
+num_shards = int of number of independent runs the voxel layers are split into. A shard
+             only computes the voxel layers num_z with num_z % num_shards == shard_index
+
+derived values:
+max_slice_number, bounds, minX, maxX, minY, maxY, num_voxels_x, num_voxels_y,
+num_voxels_z, num_z_list, num_slices
+'''
+class VoxelizationConfig:
+    def __init__(self, path_buildjob_h5, path_voxel_h5_folder, part_name, voxel_size = 100, num_layers_per_voxel = 10,
+                 max_slice_number_part = None, output_format = 'groups', compression = None, reduction_mode = 'max', scan_workers = None,
+                 skip_empty_voxels = False, stride_xy = None, stride_z = None, features = (), shard_index = 0, num_shards = 1):
+        if output_format not in OUTPUT_FORMATS + ('dense',):
+            raise ValueError('output_format has to be one of {}, not {}'.format(OUTPUT_FORMATS + ('dense',), output_format))
+        if reduction_mode not in REDUCTION_MODES:
+            raise ValueError('reduction_mode has to be one of {}, not {}'.format(REDUCTION_MODES, reduction_mode))
+        if compression is None:
+            compression = 'shuffle-gzip' if output_format == 'dense' else 'none'
+        get_dataset_kwargs(compression) #raises for unknown profiles
+        if stride_xy is not None and not 0 < int(stride_xy) <= int(voxel_size):
+            raise ValueError('stride_xy has to be in 1..voxel_size, not {}'.format(stride_xy))
+        if stride_z is not None and not 0 < int(stride_z) <= int(num_layers_per_voxel):
+            raise ValueError('stride_z has to be in 1..num_layers_per_voxel, not {}'.format(stride_z))
+        unknown_features = [name for name in features if name not in FEATURE_FUNCTIONS]
+        if unknown_features:
+            raise ValueError('unknown features {}, registered are {}'.format(unknown_features, sorted(FEATURE_FUNCTIONS)))
+        if not 0 <= int(shard_index) < int(num_shards):
+            raise ValueError('shard_index has to be in 0..num_shards-1, not {} of {}'.format(shard_index, num_shards))
+
+        self.path_buildjob_h5 = path_buildjob_h5
+        self.path_voxel_h5_folder = path_voxel_h5_folder
+        self.part_name = part_name
+        self.voxel_size = int(voxel_size)
+        self.num_layers_per_voxel = int(num_layers_per_voxel)
+        self.max_slice_number_part = max_slice_number_part
+        self.output_format = output_format
+        self.compression = compression
+        self.reduction_mode = reduction_mode
+        self.scan_workers = scan_workers
+        self.skip_empty_voxels = bool(skip_empty_voxels)
+        self.stride_xy = None if stride_xy is None else int(stride_xy)
+        self.stride_z = None if stride_z is None else int(stride_z)
+        self.features = tuple(features)
+        self.shard_index = int(shard_index)
+        self.num_shards = int(num_shards)
+        if self.is_strided and output_format == 'dense':
+            raise ValueError('overlapping voxels (stride_xy, stride_z) can not be stored in the dense layout')
+
+        #memoized derived values
+        self._max_slice_number = None
+        self._bounds = None
+        self._num_voxels = None
+
+    @property
+    def max_slice_number(self):
+        if self._max_slice_number is None:
+            if self.max_slice_number_part is not None:
+                self._max_slice_number = int(self.max_slice_number_part)
+            else:
+                self._max_slice_number = get_max_slice_number(self.path_buildjob_h5, self.part_name)
+        return self._max_slice_number
+
+    @property
+    def bounds(self):
+        if self._bounds is None:
+            self._bounds = get_part_bounds(self.path_buildjob_h5, self.part_name, self.max_slice_number, max_workers = self.scan_workers)
+        return self._bounds
+
+    @bounds.setter
+    def bounds(self, bounds):
+        #bounds computed elsewhere (e.g. by the batch mode in a shared pool), see get_part_bounds for the keys
+        self._bounds = bounds
+        self._num_voxels = None
+
+    @property
+    def minX(self):
+        return int(self.bounds['minX'])
+
+    @property
+    def maxX(self):
+        return int(self.bounds['maxX'])
+
+    @property
+    def minY(self):
+        return int(self.bounds['minY'])
+
+    @property
+    def maxY(self):
+        return int(self.bounds['maxY'])
+
+    @property
+    def voxel_stride(self):
+        return self.voxel_size if self.stride_xy is None else self.stride_xy
+
+    @property
+    def layer_stride(self):
+        return self.num_layers_per_voxel if self.stride_z is None else self.stride_z
+
+    @property
+    def is_strided(self):
+        return self.voxel_stride != self.voxel_size or self.layer_stride != self.num_layers_per_voxel
+
+    @property
+    def num_voxels(self):
+        if self._num_voxels is None:
+            length_x_part = abs(self.maxX - self.minX)
+            length_y_part = abs(self.maxY - self.minY)
+            if not self.is_strided:
+                self._num_voxels = tuple(int(num) for num in get_number_voxel(length_x_part, length_y_part, self.max_slice_number, self.voxel_size, self.num_layers_per_voxel))
+            else:
+                #windows till the part is covered, the last window may reach over the part
+                get_num_windows = lambda length, size, stride: -(-max(int(length) - size, 0) // stride) + 1
+                self._num_voxels = (get_num_windows(length_x_part, self.voxel_size, self.voxel_stride),
+                                    get_num_windows(length_y_part, self.voxel_size, self.voxel_stride),
+                                    get_num_windows(self.max_slice_number, self.num_layers_per_voxel, self.layer_stride))
+        return self._num_voxels
+
+    @property
+    def num_voxels_x(self):
+        return self.num_voxels[0]
+
+    @property
+    def num_voxels_y(self):
+        return self.num_voxels[1]
+
+    @property
+    def num_voxels_z(self):
+        return self.num_voxels[2]
+
+    def is_shard_layer(self, num_z):
+        #whether voxel layer num_z is computed by this run (always True without shards)
+        return num_z % self.num_shards == self.shard_index
+
+    @property
+    def num_z_list(self):
+        return list(range(self.shard_index, self.num_voxels_z, self.num_shards))
+
+    @property
+    def num_slices(self):
+        #number of slices covered by the voxel layers
+        return (self.num_voxels_z - 1)*self.layer_stride + self.num_layers_per_voxel
+
+    def get_layer_slices(self, num_z):
+        #slice numbers of voxel layer num_z
+        return range(num_z*self.layer_stride, num_z*self.layer_stride + self.num_layers_per_voxel)
+
+    def get_voxel_layers(self, num_slice):
+        #(num_z, num_slice_voxel) of every voxel layer of this run which contains the slice (more than one for stride_z < num_layers_per_voxel)
+        first_num_z = max(0, -(-(num_slice - self.num_layers_per_voxel + 1) // self.layer_stride))
+        last_num_z = min(self.num_voxels_z - 1, num_slice // self.layer_stride)
+        return [(num_z, num_slice - num_z*self.layer_stride) for num_z in range(first_num_z, last_num_z + 1) if self.is_shard_layer(num_z)]
+
+    def get_slice_name(self, num_slice):
+        return 'Slice' + str("{:05d}".format(num_slice+1)) #"{:05d}" -> 1 becomes 00001 for accessibility in h5 file
+
+    def resolve(self):
+        #computes all derived values (call this in the parent before the config is sent to workers)
+        self.num_voxels
+        return self
+
+    def make_output_folder(self):
+        os.makedirs(self.path_voxel_h5_folder, exist_ok = True)
+
+    def to_dict(self, derived = True):
+        config_dict = {'path_buildjob_h5': self.path_buildjob_h5,
+                       'path_voxel_h5_folder': self.path_voxel_h5_folder,
+                       'part_name': self.part_name,
+                       'voxel_size': self.voxel_size,
+                       'num_layers_per_voxel': self.num_layers_per_voxel,
+                       'max_slice_number_part': self.max_slice_number_part,
+                       'output_format': self.output_format,
+                       'compression': self.compression,
+                       'reduction_mode': self.reduction_mode,
+                       'skip_empty_voxels': self.skip_empty_voxels,
+                       'stride_xy': self.stride_xy,
+                       'stride_z': self.stride_z,
+                       'features': list(self.features),
+                       'shard_index': self.shard_index,
+                       'num_shards': self.num_shards}
+        if derived:
+            config_dict['derived'] = {'max_slice_number': self.max_slice_number,
+                                      'minX': self.minX, 'maxX': self.maxX,
+                                      'minY': self.minY, 'maxY': self.maxY,
+                                      'num_voxels_x': self.num_voxels_x,
+                                      'num_voxels_y': self.num_voxels_y,
+                                      'num_voxels_z': self.num_voxels_z}
+        return config_dict
+
+    @classmethod
+    def from_dict(cls, config_dict):
+        return cls(**{key: value for key, value in config_dict.items() if key != 'derived'})
+
+    def save_json(self, path):
+        with open(path, 'w') as json_file:
+            json.dump(self.to_dict(), json_file, indent = 4)
+
+    @classmethod
+    def load_json(cls, path):
+        with open(path) as json_file:
+            return cls.from_dict(json.load(json_file))
+
+    def __repr__(self):
+        return 'VoxelizationConfig({})'.format(', '.join('{}={!r}'.format(key, value) for key, value in self.to_dict(derived = False).items()))
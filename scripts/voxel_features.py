@@ -0,0 +1,210 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Per voxel slice features which are computed while voxelizing. The writers hand
+the binned slice (columns sorted by voxel and the number of datapoints of every
+voxel, see partition_array_by_voxel) to a FeatureExtractor, which computes all
+the features of all the voxels of the slice with segmented reductions (reduceat,
+bincount, one lexsort for the percentiles) - no loop over the voxels and no second
+pass over the voxel files. The features are stored per layer file as 'features'
+(shape (num_voxels_x, num_voxels_y, num_layers_per_voxel, number of feature
+columns), attrs 'feature_names') and collected by build_feature_table into one
+table keyed by x, y, z and slice:
+
+table = load_feature_table(path_voxel_h5_folder)
+table[table['intensity_p90'] > 3]
+
+Further features are added with register_feature, a feature function gets the
+columns of the slice, the counts of the voxels and the voxel size and returns a
+np array of shape (number of voxels, number of feature columns)
+'''
+import h5py
+import numpy as np
+import os
+from voxel_writer import load_voxel_tables
+
+FEATURE_TABLE_FILE_NAME = 'voxel_features.npy'
+FEATURE_CHANNELS = ('Area', 'Intensity')
+FEATURE_PERCENTILES = (10, 50, 90)
+HISTOGRAM_EDGES = np.concatenate([[0], 2.0**np.arange(16)]) #power of two bins, values above the last edge are in the last bin
+
+#name -> (function, names of the feature columns)
+FEATURE_FUNCTIONS = {}
+
+
+'''
+-------------------------------------------------------------------------------
+register_feature:
+decorator which adds a feature function to FEATURE_FUNCTIONS
+
+inputs:
+name = str of the name of the feature (used in VoxelizationConfig.features)
+column_names = list of the names of the feature columns the function returns
+'''
+def register_feature(name, column_names):
+    def decorator(function):
+        FEATURE_FUNCTIONS[name] = (function, tuple(column_names))
+        return function
+    return decorator
+
+
+'''
+-------------------------------------------------------------------------------
+segmented helpers: the segments are the contiguous voxels of a binned slice,
+counts holds their lengths (empty segments give NaN)
+'''
+def get_segment_sums(values, counts):
+    sums = np.zeros(counts.size)
+    nonempty = counts > 0
+    if nonempty.any():
+        sums[nonempty] = np.add.reduceat(values, (np.cumsum(counts) - counts)[nonempty])
+    return sums
+
+def get_segment_percentiles(values, counts, percentiles):
+    #values are sorted within every segment, the percentile is interpolated linearly (like np.percentile)
+    segment_ids = np.repeat(np.arange(counts.size), counts)
+    values_sorted = values[np.lexsort((values, segment_ids))]
+    starts = np.cumsum(counts) - counts
+    result = np.full((counts.size, len(percentiles)), np.nan)
+    nonempty = counts > 0
+    for i, percentile in enumerate(percentiles):
+        position = starts[nonempty] + percentile/100*(counts[nonempty] - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        result[nonempty, i] = values_sorted[lower] + (values_sorted[upper] - values_sorted[lower])*(position - lower)
+    return result
+
+def get_segment_histograms(values, counts, edges):
+    num_bins = len(edges) - 1
+    bins = np.clip(np.searchsorted(edges, values, side = 'right') - 1, 0, num_bins - 1)
+    segment_ids = np.repeat(np.arange(counts.size), counts)
+    return np.bincount(segment_ids*num_bins + bins, minlength = counts.size*num_bins).reshape(counts.size, num_bins)
+
+
+@register_feature('fill_fraction', ['num_points', 'fill_fraction'])
+def get_fill_fraction(columns, counts, voxel_size):
+    return np.stack([counts, counts/voxel_size**2], axis = 1)
+
+@register_feature('mean', ['{}_mean'.format(channel.lower()) for channel in FEATURE_CHANNELS])
+def get_mean(columns, counts, voxel_size):
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return np.stack([get_segment_sums(np.asarray(columns[channel], dtype = np.float64), counts)/counts for channel in FEATURE_CHANNELS], axis = 1)
+
+@register_feature('std', ['{}_std'.format(channel.lower()) for channel in FEATURE_CHANNELS])
+def get_std(columns, counts, voxel_size):
+    stds = []
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        for channel in FEATURE_CHANNELS:
+            values = np.asarray(columns[channel], dtype = np.float64)
+            mean = get_segment_sums(values, counts)/counts
+            stds.append(np.sqrt(np.maximum(get_segment_sums(values**2, counts)/counts - mean**2, 0)))
+    return np.stack(stds, axis = 1)
+
+@register_feature('percentiles', ['{}_p{}'.format(channel.lower(), percentile) for channel in FEATURE_CHANNELS for percentile in FEATURE_PERCENTILES])
+def get_percentiles(columns, counts, voxel_size):
+    return np.concatenate([get_segment_percentiles(np.asarray(columns[channel], dtype = np.float64), counts, FEATURE_PERCENTILES) for channel in FEATURE_CHANNELS], axis = 1)
+
+@register_feature('histogram', ['{}_hist_{:g}'.format(channel.lower(), edge) for channel in FEATURE_CHANNELS for edge in HISTOGRAM_EDGES[:-1]])
+def get_histogram(columns, counts, voxel_size):
+    return np.concatenate([get_segment_histograms(np.asarray(columns[channel]), counts, HISTOGRAM_EDGES) for channel in FEATURE_CHANNELS], axis = 1)
+
+
+'''
+-------------------------------------------------------------------------------
+FeatureExtractor:
+class that computes the selected features of all the voxels of a slice
+
+inputs:
+feature_names = list of the names of registered features (see FEATURE_FUNCTIONS)
+voxel_size = int of voxel x and y dimensions
+'''
+class FeatureExtractor:
+    def __init__(self, feature_names, voxel_size):
+        unknown = [name for name in feature_names if name not in FEATURE_FUNCTIONS]
+        if unknown:
+            raise ValueError('unknown features {}, registered are {}'.format(unknown, sorted(FEATURE_FUNCTIONS)))
+        self.feature_names = tuple(feature_names)
+        self.voxel_size = voxel_size
+        self.column_names = tuple(column_name for name in self.feature_names for column_name in FEATURE_FUNCTIONS[name][1])
+
+    def compute(self, columns, counts):
+        #columns: dict of the columns of the slice sorted by voxel, counts: datapoints per voxel
+        counts = np.asarray(counts, dtype = np.int64)
+        return np.concatenate([FEATURE_FUNCTIONS[name][0](columns, counts, self.voxel_size) for name in self.feature_names], axis = 1).astype(np.float32)
+
+    def create_empty_table(self, grid_shape):
+        return np.full(tuple(grid_shape) + (len(self.column_names),), np.nan, dtype = np.float32)
+
+
+'''
+-------------------------------------------------------------------------------
+get_feature_extractor:
+function that returns the FeatureExtractor of a config (None without features)
+'''
+def get_feature_extractor(config):
+    if not config.features:
+        return None
+    return FeatureExtractor(config.features, config.voxel_size)
+
+
+'''
+-------------------------------------------------------------------------------
+build_feature_table:
+function that collects the features of all the layer files of a folder (saved in
+their tables, see save_voxel_tables) into one
+structured array with the fields x, y, z, slice and the feature columns (one row
+per voxel slice with datapoints, sorted by z, y, x, slice) and saves it as
+voxel_features.npy
+
+inputs:
+path_voxel_h5_folder = str of the folder of the voxel layer files
+save = bool whether the table is saved in the folder
+
+outputs:
+structured np array
+'''
+def build_feature_table(path_voxel_h5_folder, save = True):
+    tables = []
+    column_names = None
+    for file_name in os.listdir(path_voxel_h5_folder):
+        if not (file_name.startswith('Voxel_layer_') and file_name.endswith('.hdf5')):
+            continue
+        with h5py.File(os.path.join(path_voxel_h5_folder, file_name), 'r') as voxel_hdf:
+            num_z = int(voxel_hdf.attrs['num_z']) if 'num_z' in voxel_hdf.attrs else None
+        layer_tables = load_voxel_tables(path_voxel_h5_folder, num_z) if num_z is not None else None
+        if layer_tables is None or 'features' not in layer_tables:
+            raise KeyError('{} has no features, it was written without features'.format(file_name))
+        column_names = tuple(str(column_name) for column_name in layer_tables['feature_names'])
+        tables.append((num_z, layer_tables['point_counts'], layer_tables['features']))
+    if column_names is None:
+        raise FileNotFoundError('no voxel layer files in {}'.format(path_voxel_h5_folder))
+
+    dtype = np.dtype([('x', np.int32), ('y', np.int32), ('z', np.int32), ('slice', np.int32)] + [(column_name, np.float32) for column_name in column_names])
+    parts = []
+    for num_z, counts, features in sorted(tables, key = lambda table: table[0]):
+        #(x, y, slice) -> rows sorted by y, x, slice
+        n_vox_x, n_vox_y, num_slice_voxel = np.nonzero(counts > 0)
+        order = np.lexsort((num_slice_voxel, n_vox_x, n_vox_y))
+        part = np.empty(order.size, dtype = dtype)
+        part['x'], part['y'], part['slice'] = n_vox_x[order], n_vox_y[order], num_slice_voxel[order]
+        part['z'] = num_z
+        values = features[n_vox_x[order], n_vox_y[order], num_slice_voxel[order]]
+        for i, column_name in enumerate(column_names):
+            part[column_name] = values[:, i]
+        parts.append(part)
+    table = np.concatenate(parts)
+
+    if save:
+        np.save(os.path.join(path_voxel_h5_folder, FEATURE_TABLE_FILE_NAME), table)
+    return table
+
+
+def load_feature_table(path_voxel_h5_folder):
+    return np.load(os.path.join(path_voxel_h5_folder, FEATURE_TABLE_FILE_NAME), allow_pickle = False)
+
+
+if __name__ == '__main__':
+    table = build_feature_table('/home/jan/Documents/Trainingsdaten/ZP_4/ZP_4_voxel_100_10')
+    print('{} voxel slices, features: {}'.format(table.size, table.dtype.names[4:]))
@@ -0,0 +1,168 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Per voxel summary index of a voxelization run. The index is built out of the small
+tables the writers save per layer (point_counts and slice_stats in
+voxel_tables/layer_{z}.npz, offsets of the csr layout), so no voxel data is read. It is saved as one structured NumPy array
+(voxel_index.npy in the output folder) with one row per voxel of the grid, so a
+selection is a boolean mask:
+
+index = load_voxel_index(path_voxel_h5_folder)
+index[index['num_points'] >= 1000]
+index[index['intensity_max'] > 3]
+index[index['edge']]
+
+The data of a row is in the layer file Voxel_layer_{z}.hdf5: in the group
+voxel_{x}_{y}_{z} (layout 'groups') or at 'offset' of the columns (layout 'csr',
+offset of the first written slice of the voxel, see offsets table for the others)
+'''
+import h5py
+import numpy as np
+import os
+import instrumentation
+from voxel_writer import load_voxel_tables
+
+VOXEL_INDEX_FILE_NAME = 'voxel_index.npy'
+
+VOXEL_INDEX_DTYPE = np.dtype([('x', np.int32), ('y', np.int32), ('z', np.int32),
+                              ('num_points', np.int64),
+                              ('area_min', np.float64), ('area_max', np.float64), ('area_mean', np.float64),
+                              ('intensity_min', np.float64), ('intensity_max', np.float64), ('intensity_mean', np.float64),
+                              ('offset', np.int64),
+                              ('edge', np.bool_)])
+
+
+'''
+-------------------------------------------------------------------------------
+read_layer_tables:
+function that reads the per voxel tables of a layer file (saved next to it by
+the writer, see save_voxel_tables)
+
+inputs:
+path_voxel_h5 = str of path of the voxel layer file
+
+outputs:
+tuple of num_z, point counts (nvx, nvy, layers), slice stats (nvx, nvy, layers, 6)
+and offsets (nvx, nvy, layers, -1 for the 'groups' layout)
+'''
+def read_layer_tables(path_voxel_h5):
+    with h5py.File(path_voxel_h5, 'r') as voxel_hdf:
+        num_z = int(voxel_hdf.attrs['num_z']) if 'num_z' in voxel_hdf.attrs else None
+        offsets = voxel_hdf['offsets'][()] if voxel_hdf.attrs.get('layout', 'groups') == 'csr' else None
+    tables = load_voxel_tables(os.path.dirname(path_voxel_h5), num_z) if num_z is not None else None
+    if tables is None or 'slice_stats' not in tables:
+        raise KeyError('{} has no slice_stats, it was written without the voxel grid (full grid or an older version)'.format(path_voxel_h5))
+    point_counts = tables['point_counts']
+    if offsets is None:
+        offsets = np.full(point_counts.shape, -1, dtype = np.int64)
+    return num_z, point_counts, tables['slice_stats'], offsets
+
+
+'''
+-------------------------------------------------------------------------------
+get_edge_voxels:
+function that marks the occupied voxels which have an empty (or no) neighbour
+in x-, y- or z-direction, i.e. the voxels at the surface of the part
+
+inputs:
+occupancy = np bool array of shape (nvx, nvy, nvz)
+
+outputs:
+np bool array of the same shape
+'''
+def get_edge_voxels(occupancy):
+    padded = np.pad(occupancy, 1, constant_values = False)
+    all_neighbours = np.ones(occupancy.shape, dtype = bool)
+    for axis in range(3):
+        for shift in (-1, 1):
+            all_neighbours &= np.roll(padded, shift, axis = axis)[1:-1, 1:-1, 1:-1]
+    return occupancy & ~all_neighbours
+
+
+'''
+-------------------------------------------------------------------------------
+build_voxel_index:
+function that builds the summary index of all the layer files of a folder and
+saves it as voxel_index.npy
+
+inputs:
+path_voxel_h5_folder = str of the folder of the voxel layer files
+save = bool whether the index is saved in the folder
+
+outputs:
+structured np array of dtype VOXEL_INDEX_DTYPE, sorted by z, y, x
+'''
+def build_voxel_index(path_voxel_h5_folder, save = True):
+    with instrumentation.span('index'):
+        return create_voxel_index(path_voxel_h5_folder, save)
+
+def create_voxel_index(path_voxel_h5_folder, save = True):
+    layer_files = [file_name for file_name in os.listdir(path_voxel_h5_folder) if file_name.startswith('Voxel_layer_') and file_name.endswith('.hdf5')]
+    if not layer_files:
+        raise FileNotFoundError('no voxel layer files in {}'.format(path_voxel_h5_folder))
+    layers = sorted((read_layer_tables(os.path.join(path_voxel_h5_folder, file_name)) for file_name in layer_files), key = lambda layer: layer[0])
+    num_voxels_x, num_voxels_y = layers[0][1].shape[:2]
+    num_voxels_z = layers[-1][0] + 1
+
+    #(nvx, nvy, nvz) tables, layer files which don't exist stay empty
+    num_points = np.zeros((num_voxels_x, num_voxels_y, num_voxels_z), dtype = np.int64)
+    stats = np.full((num_voxels_x, num_voxels_y, num_voxels_z, 6), np.nan)
+    offset = np.full((num_voxels_x, num_voxels_y, num_voxels_z), -1, dtype = np.int64)
+    for num_z, point_counts, slice_stats, offsets in layers:
+        num_points[:,:,num_z] = point_counts.sum(axis = 2)
+        stats[:,:,num_z,0] = np.fmin.reduce(slice_stats[...,0], axis = 2)
+        stats[:,:,num_z,1] = np.fmax.reduce(slice_stats[...,1], axis = 2)
+        stats[:,:,num_z,2] = slice_stats[...,2].sum(axis = 2)
+        stats[:,:,num_z,3] = np.fmin.reduce(slice_stats[...,3], axis = 2)
+        stats[:,:,num_z,4] = np.fmax.reduce(slice_stats[...,4], axis = 2)
+        stats[:,:,num_z,5] = slice_stats[...,5].sum(axis = 2)
+        written_offsets = np.where((offsets >= 0) & (point_counts > 0), offsets, np.iinfo(np.int64).max)
+        offset[:,:,num_z] = np.where(written_offsets.min(axis = 2) == np.iinfo(np.int64).max, -1, written_offsets.min(axis = 2))
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        area_mean = np.where(num_points > 0, stats[...,2]/num_points, np.nan)
+        intensity_mean = np.where(num_points > 0, stats[...,5]/num_points, np.nan)
+    edge = get_edge_voxels(num_points > 0)
+
+    #rows sorted by z, y, x -> transpose the (x, y, z) tables
+    index = np.empty(num_voxels_x*num_voxels_y*num_voxels_z, dtype = VOXEL_INDEX_DTYPE)
+    z_grid, y_grid, x_grid = np.meshgrid(np.arange(num_voxels_z), np.arange(num_voxels_y), np.arange(num_voxels_x), indexing = 'ij')
+    flat = lambda table: table.transpose(2, 1, 0).ravel()
+    index['x'] = x_grid.ravel()
+    index['y'] = y_grid.ravel()
+    index['z'] = z_grid.ravel()
+    index['num_points'] = flat(num_points)
+    index['area_min'] = flat(stats[...,0])
+    index['area_max'] = flat(stats[...,1])
+    index['area_mean'] = flat(area_mean)
+    index['intensity_min'] = flat(stats[...,3])
+    index['intensity_max'] = flat(stats[...,4])
+    index['intensity_mean'] = flat(intensity_mean)
+    index['offset'] = flat(offset)
+    index['edge'] = flat(edge)
+
+    if save:
+        np.save(os.path.join(path_voxel_h5_folder, VOXEL_INDEX_FILE_NAME), index)
+    return index
+
+
+'''
+-------------------------------------------------------------------------------
+load_voxel_index:
+function that loads the summary index of a folder (see build_voxel_index)
+
+inputs:
+path_voxel_h5_folder = str of the folder of the voxel layer files
+
+outputs:
+structured np array of dtype VOXEL_INDEX_DTYPE
+'''
+def load_voxel_index(path_voxel_h5_folder):
+    return np.load(os.path.join(path_voxel_h5_folder, VOXEL_INDEX_FILE_NAME), allow_pickle = False)
+
+
+if __name__ == '__main__':
+    index = build_voxel_index('/home/jan/Documents/Trainingsdaten/ZP_4/ZP_4_voxel_100_10')
+    print('{} voxels, {} occupied, {} at the edge'.format(index.size, np.count_nonzero(index['num_points']), np.count_nonzero(index['edge'])))
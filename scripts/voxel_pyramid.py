@@ -0,0 +1,158 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Multi resolution pyramid of the voxel statistics of a voxelization run for quick
+previews (e.g. a heat map of 8x coarser voxels) without voxelizing the buildjob
+again. Level 0 are the voxels of the run (out of the voxel index, see
+voxel_index.py), level k+1 merges blocks of factor x factor x factor voxels of
+level k: the point counts are summed, the means are weighted with the point
+counts and the minima/maxima are the minima/maxima of the block. Every level is
+built out of the level below, not out of the datapoints. The saved levels belong
+to the voxel index they were built of and are built again if the index changed
+
+The levels 1..n are saved in voxel_pyramid.hdf5 in the output folder:
+level_{k}/{field} = np array of shape (nvx_k, nvy_k, nvz_k)
+level_{k}.attrs: voxel_size, num_layers_per_voxel (of the coarse voxels), factor
+'''
+import h5py
+import hashlib
+import json
+import numpy as np
+import os
+from voxel_index import VOXEL_INDEX_FILE_NAME, load_voxel_index, build_voxel_index
+from voxel_store import CONFIG_FILE_NAME
+
+PYRAMID_FILE_NAME = 'voxel_pyramid.hdf5'
+PYRAMID_FIELDS = ('num_points', 'area_min', 'area_max', 'area_mean', 'intensity_min', 'intensity_max', 'intensity_mean')
+
+
+'''
+-------------------------------------------------------------------------------
+get_base_level:
+function that turns the voxel index (rows sorted by z, y, x) into the level 0
+grids of shape (nvx, nvy, nvz)
+'''
+def get_base_level(index):
+    grid_shape = (int(index['z'].max()) + 1, int(index['y'].max()) + 1, int(index['x'].max()) + 1)
+    level = {}
+    for field_name in PYRAMID_FIELDS:
+        grid = np.full(grid_shape, 0 if field_name == 'num_points' else np.nan, dtype = index.dtype[field_name])
+        grid[index['z'], index['y'], index['x']] = index[field_name]
+        level[field_name] = grid.transpose(2, 1, 0).copy()
+    return level
+
+
+'''
+-------------------------------------------------------------------------------
+downsample_level:
+function that merges blocks of factor^3 voxels of a level into the voxels of the
+next coarser level. Grids which aren't a multiple of factor are padded with empty
+voxels
+
+inputs:
+level = dict of field name -> np array of shape (nvx, nvy, nvz)
+factor = int of number of voxels merged per direction
+
+outputs:
+dict of field name -> np array of shape (ceil(nvx/factor), ceil(nvy/factor), ceil(nvz/factor))
+'''
+def downsample_level(level, factor = 2):
+    shape = level['num_points'].shape
+    coarse_shape = tuple(-(-size // factor) for size in shape)
+    padding = [(0, coarse_size*factor - size) for size, coarse_size in zip(shape, coarse_shape)]
+    #(nvx_c, factor, nvy_c, factor, nvz_c, factor) -> reduce over the factor axes
+    get_blocks = lambda grid, fill_value: np.pad(grid, padding, constant_values = fill_value).reshape(coarse_shape[0], factor, coarse_shape[1], factor, coarse_shape[2], factor)
+    block_axes = (1, 3, 5)
+
+    num_points = get_blocks(level['num_points'], 0)
+    coarse_level = {'num_points': num_points.sum(axis = block_axes)}
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        for channel in ('area', 'intensity'):
+            coarse_level[channel + '_min'] = np.fmin.reduce(get_blocks(level[channel + '_min'], np.nan), axis = block_axes)
+            coarse_level[channel + '_max'] = np.fmax.reduce(get_blocks(level[channel + '_max'], np.nan), axis = block_axes)
+            weighted_sum = np.where(num_points > 0, get_blocks(level[channel + '_mean'], np.nan)*num_points, 0).sum(axis = block_axes)
+            coarse_level[channel + '_mean'] = np.where(coarse_level['num_points'] > 0, weighted_sum/coarse_level['num_points'], np.nan)
+    return coarse_level
+
+
+'''
+-------------------------------------------------------------------------------
+build_voxel_pyramid:
+function that builds the coarser levels of the voxels of a folder and saves them
+in voxel_pyramid.hdf5. Levels which are already saved are reused, only the missing
+levels are built out of the highest saved level (or out of the voxel index). Saved
+levels of another voxel index (a new run in the folder) are dropped
+
+inputs:
+path_voxel_h5_folder = str of the folder of the voxel files
+num_levels = int of number of coarser levels (3 -> 2x, 4x and 8x coarser voxels for factor 2)
+factor = int of number of voxels merged per direction from one level to the next
+rebuild = bool whether the voxel index and all the levels are built again
+
+outputs:
+list of the levels 0..num_levels (dicts of field name -> np array)
+'''
+def build_voxel_pyramid(path_voxel_h5_folder, num_levels = 3, factor = 2, rebuild = False):
+    with open(os.path.join(path_voxel_h5_folder, CONFIG_FILE_NAME)) as json_file:
+        config_dict = json.load(json_file)
+    if config_dict.get('stride_xy') not in (None, config_dict['voxel_size']) or config_dict.get('stride_z') not in (None, config_dict['num_layers_per_voxel']):
+        raise ValueError('overlapping voxels (stride_xy, stride_z) can not be merged into a pyramid')
+    if config_dict['output_format'] == 'dense':
+        raise ValueError('the dense layout has no voxel index, a pyramid needs the layouts groups or csr')
+
+    if os.path.isfile(os.path.join(path_voxel_h5_folder, VOXEL_INDEX_FILE_NAME)) and not rebuild:
+        index = load_voxel_index(path_voxel_h5_folder)
+    else:
+        index = build_voxel_index(path_voxel_h5_folder)
+    levels = [get_base_level(index)]
+    index_hash = hashlib.sha1(index.tobytes()).hexdigest()
+
+    path_pyramid = os.path.join(path_voxel_h5_folder, PYRAMID_FILE_NAME)
+    with h5py.File(path_pyramid, 'a') as pyramid_hdf:
+        if rebuild or pyramid_hdf.attrs.get('index_hash') != index_hash:
+            for level_name in list(pyramid_hdf.keys()):
+                del pyramid_hdf[level_name]
+        pyramid_hdf.attrs['layout'] = 'pyramid' #not a layer file, e.g. for delete_empty_voxels
+        pyramid_hdf.attrs['index_hash'] = index_hash
+        for num_level in range(1, num_levels + 1):
+            level_name = 'level_{}'.format(num_level)
+            if level_name in pyramid_hdf and pyramid_hdf[level_name].attrs['factor'] == factor:
+                levels.append({field_name: pyramid_hdf[level_name][field_name][()] for field_name in PYRAMID_FIELDS})
+                continue
+            if level_name in pyramid_hdf:
+                del pyramid_hdf[level_name]
+            levels.append(downsample_level(levels[-1], factor))
+            level_group = pyramid_hdf.create_group(level_name)
+            for field_name in PYRAMID_FIELDS:
+                level_group.create_dataset(field_name, data = levels[-1][field_name])
+            level_group.attrs['factor'] = factor
+            level_group.attrs['voxel_size'] = config_dict['voxel_size']*factor**num_level
+            level_group.attrs['num_layers_per_voxel'] = config_dict['num_layers_per_voxel']*factor**num_level
+    return levels
+
+
+'''
+-------------------------------------------------------------------------------
+load_voxel_pyramid_level:
+function that loads one level of the pyramid of a folder (level 0 out of the voxel index)
+
+inputs:
+path_voxel_h5_folder = str of the folder of the voxel files
+num_level = int of the level
+
+outputs:
+dict of field name -> np array of shape (nvx_k, nvy_k, nvz_k)
+'''
+def load_voxel_pyramid_level(path_voxel_h5_folder, num_level):
+    if num_level == 0:
+        return get_base_level(load_voxel_index(path_voxel_h5_folder))
+    with h5py.File(os.path.join(path_voxel_h5_folder, PYRAMID_FILE_NAME), 'r') as pyramid_hdf:
+        return {field_name: pyramid_hdf['level_{}'.format(num_level)][field_name][()] for field_name in PYRAMID_FIELDS}
+
+
+if __name__ == '__main__':
+    levels = build_voxel_pyramid('/home/jan/Documents/Trainingsdaten/ZP_4/ZP_4_voxel_100_10')
+    for num_level, level in enumerate(levels):
+        print('level {}: {} voxels, max intensity {}'.format(num_level, level['num_points'].shape, np.nanmax(level['intensity_max'])))
@@ -0,0 +1,138 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+The functions are used to read the data of voxels out of the voxel layer files.
+The layouts 'groups' (voxel_{x}_{y}_{z}/slice_{n}/..., written by VoxelLayerWriter),
+'csr' (few large columns plus offsets table, written by CSRVoxelLayerWriter) and
+'dense' (one chunked dataset per part, written by DenseVoxelWriter) are supported
+'''
+import h5py
+import numpy as np
+
+
+'''
+-------------------------------------------------------------------------------
+get_layout:
+function that returns the layout of an open voxel layer file
+
+inputs:
+voxel_hdf = open h5py.File of a voxel layer
+
+outputs:
+str 'groups', 'csr' or 'dense'
+'''
+def get_layout(voxel_hdf):
+    return voxel_hdf.attrs.get('layout', 'groups')
+
+
+'''
+-------------------------------------------------------------------------------
+read_voxel_slice:
+function that reads the columns of one slice of a voxel
+
+inputs:
+voxel_hdf = open h5py.File of a voxel layer
+n_vox_x = int of voxel number in x-dimension
+n_vox_y = int of voxel number in y-dimension
+num_z = int of voxel number in z-dimension
+num_slice_voxel = int of number of the slice inside of the voxel
+column_names = list of names of the columns to read
+
+outputs:
+dict with column name -> np array (empty arrays if the voxel slice doesn't exist)
+'''
+def read_voxel_slice(voxel_hdf, n_vox_x, n_vox_y, num_z, num_slice_voxel, column_names = ('X-Axis', 'Y-Axis', 'Area', 'Intensity')):
+    columns = {}
+    if get_layout(voxel_hdf) == 'csr':
+        offset = voxel_hdf['offsets'][n_vox_x, n_vox_y, num_slice_voxel]
+        count = voxel_hdf['counts'][n_vox_x, n_vox_y, num_slice_voxel]
+        for column_name in column_names:
+            if offset < 0 or column_name not in voxel_hdf:
+                columns[column_name] = np.empty(0, dtype = int)
+            else:
+                columns[column_name] = voxel_hdf[column_name][offset:offset + count]
+    else:
+        group_name = 'voxel_{}_{}_{}'.format(n_vox_x, n_vox_y, num_z)
+        slice_name = 'slice_{}'.format(num_slice_voxel)
+        for column_name in column_names:
+            if group_name in voxel_hdf and slice_name in voxel_hdf[group_name]:
+                columns[column_name] = voxel_hdf[group_name][slice_name][column_name][:]
+            else:
+                columns[column_name] = np.empty(0, dtype = int)
+    return columns
+
+
+'''
+-------------------------------------------------------------------------------
+read_voxel:
+function that reads the columns of all the slices of a voxel
+
+inputs:
+path_voxel_h5 = str of path of the voxel layer file
+n_vox_x = int of voxel number in x-dimension
+n_vox_y = int of voxel number in y-dimension
+num_z = int of voxel number in z-dimension
+num_layers_per_voxel = int of number of slices per voxel
+column_names = list of names of the columns to read
+
+outputs:
+list with one dict (column name -> np array) per slice
+'''
+def read_voxel(path_voxel_h5, n_vox_x, n_vox_y, num_z, num_layers_per_voxel, column_names = ('X-Axis', 'Y-Axis', 'Area', 'Intensity')):
+    with h5py.File(path_voxel_h5, 'r') as voxel_hdf:
+        return [read_voxel_slice(voxel_hdf, n_vox_x, n_vox_y, num_z, num_slice_voxel, column_names) for num_slice_voxel in range(num_layers_per_voxel)]
+
+
+'''
+-------------------------------------------------------------------------------
+read_dense_voxel:
+function that reads one voxel out of a file of the 'dense' layout (one chunk read)
+
+inputs:
+voxel_hdf = open h5py.File of the dense voxel file
+dataset_name = str of the name of the dataset (e.g. the part name)
+n_vox_x = int of voxel number in x-dimension
+n_vox_y = int of voxel number in y-dimension
+num_z = int of voxel number in z-dimension
+
+outputs:
+np array of shape (num_layers_per_voxel, voxel_size, voxel_size, channels) with
+the axes slice, y, x, channel (channels: see dataset attribute 'channels')
+'''
+def read_dense_voxel(voxel_hdf, dataset_name, n_vox_x, n_vox_y, num_z):
+    dataset = voxel_hdf[dataset_name]
+    voxel_size = int(dataset.attrs['voxel_size'])
+    num_layers_per_voxel = int(dataset.attrs['num_layers_per_voxel'])
+    return dataset[num_z*num_layers_per_voxel:(num_z + 1)*num_layers_per_voxel,
+                   n_vox_y*voxel_size:(n_vox_y + 1)*voxel_size,
+                   n_vox_x*voxel_size:(n_vox_x + 1)*voxel_size]
+
+
+'''
+-------------------------------------------------------------------------------
+densify_voxel:
+function that writes the sparse slices of a voxel (result of read_voxel with local
+coordinates, layouts 'groups' and 'csr' or the full grid files) into a dense array
+
+inputs:
+voxel_slices = list with one dict (column name -> np array) per slice
+voxel_size = int of voxel x and y dimensions
+channels = list of names of the columns which become the channels
+dtype = dtype of the dense array
+
+outputs:
+np array of shape (len(voxel_slices), voxel_size, voxel_size, len(channels)) with
+the axes slice, y, x, channel (0 where no datapoint exists) like read_dense_voxel
+'''
+def densify_voxel(voxel_slices, voxel_size, channels = ('Area', 'Intensity'), dtype = np.int32):
+    dense_voxel = np.zeros([len(voxel_slices), voxel_size, voxel_size, len(channels)], dtype = dtype)
+    for num_slice_voxel, columns in enumerate(voxel_slices):
+        x_axis = np.asarray(columns['X-Axis'], dtype = np.int64)
+        y_axis = np.asarray(columns['Y-Axis'], dtype = np.int64)
+        if x_axis.size == 0:
+            continue
+        for channel, column_name in enumerate(channels):
+            dense_voxel[num_slice_voxel, y_axis, x_axis, channel] = columns[column_name]
+    return dense_voxel
@@ -0,0 +1,297 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Sharded voxelization: a run is split into num_shards independent runs (e.g. on
+several nodes) which only share the filesystem. Shard i computes the voxel layers
+num_z with num_z % num_shards == i, so every layer file is written by exactly one
+shard and no locking is needed. Every shard writes into its own folder
+output_root/shard_{i}_of_{num_shards} with its own config json and manifest, so an
+interrupted shard is resumed on its own by starting it again.
+
+merge_shards stitches the shards into output_root without copying voxel data:
+every layer file of a shard gets a small file Voxel_layer_{z}.hdf5 in output_root
+with the attributes of the layer file and external links to its groups and
+datasets (the small per voxel tables in voxel_tables are copied), the dense layout gets one virtual dataset out of the layers of all the
+shards. The voxel index and the feature table are built on the merged folder, so
+output_root can be used like the folder of a single run (VoxelStore, pyramid,
+memmap, ...). The links are relative, so output_root can be moved as a whole.
+Empty voxels should be pruned in the shards before the merge, prune on the merged
+folder only deletes the links
+
+usage (one command per node, the bounds scan is done once beforehand):
+python voxelize.py scan  --buildjob ZP_4_full_part.h5 --part ZP4_combined
+python voxelize.py run   --buildjob ZP_4_full_part.h5 --part ZP4_combined --output ZP_4_voxel_100_10 --shard 0/4
+...
+python voxelize.py run   --buildjob ZP_4_full_part.h5 --part ZP4_combined --output ZP_4_voxel_100_10 --shard 3/4
+python voxelize.py merge --output ZP_4_voxel_100_10
+
+or all shards as local processes (see launch_local_shards):
+launch_local_shards(config, num_shards = 4, workers_per_shard = 2)
+'''
+import glob
+import h5py
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+from voxel_config import VoxelizationConfig
+from run_manifest import RunManifest, MANIFEST_FOLDER_NAME
+from voxel_index import build_voxel_index
+from voxel_features import build_feature_table
+from voxel_store import CONFIG_FILE_NAME, DENSE_FILE_NAME
+from voxel_writer import VOXEL_TABLES_FOLDER_NAME
+
+SHARD_FOLDER_NAME = 'shard_{}_of_{}'
+
+
+'''
+-------------------------------------------------------------------------------
+get_shard_config:
+function that returns the config of one shard of a run
+
+inputs:
+config = VoxelizationConfig of the whole run (path_voxel_h5_folder is the output root)
+shard_index = int of the shard (0..num_shards-1)
+num_shards = int of number of shards
+
+outputs:
+VoxelizationConfig which writes into output_root/shard_{shard_index}_of_{num_shards}
+'''
+def get_shard_config(config, shard_index, num_shards):
+    if config.num_shards != 1:
+        raise ValueError('the config is already the config of shard {} of {}'.format(config.shard_index, config.num_shards))
+    config_dict = config.to_dict(derived = False)
+    config_dict['path_voxel_h5_folder'] = os.path.join(config.path_voxel_h5_folder, SHARD_FOLDER_NAME.format(shard_index, num_shards))
+    config_dict['shard_index'] = shard_index
+    config_dict['num_shards'] = num_shards
+    return VoxelizationConfig.from_dict(config_dict)
+
+
+'''
+-------------------------------------------------------------------------------
+get_shard_folders:
+function that finds the shard folders of an output root and checks that they
+belong to one split (same num_shards, none missing)
+
+inputs:
+path_output_root = str of the folder with the shard_{i}_of_{num_shards} folders
+
+outputs:
+list of the shard folders, sorted by shard index
+'''
+def get_shard_folders(path_output_root):
+    shards = {}
+    for path_folder in glob.glob(os.path.join(path_output_root, 'shard_*_of_*')):
+        match = re.fullmatch(r'shard_(\d+)_of_(\d+)', os.path.basename(path_folder))
+        if match and os.path.isdir(path_folder):
+            shards[(int(match.group(1)), int(match.group(2)))] = path_folder
+    if not shards:
+        raise FileNotFoundError('no shard folders in {}'.format(path_output_root))
+    split_sizes = sorted(set(num_shards for _, num_shards in shards))
+    if len(split_sizes) != 1:
+        raise ValueError('{} has shards of different splits {}, delete the folders of the old split'.format(path_output_root, split_sizes))
+    num_shards = split_sizes[0]
+    missing = [shard_index for shard_index in range(num_shards) if (shard_index, num_shards) not in shards]
+    if missing:
+        raise ValueError('the shards {} of {} are missing in {}'.format(missing, num_shards, path_output_root))
+    return [shards[(shard_index, num_shards)] for shard_index in range(num_shards)]
+
+
+'''
+-------------------------------------------------------------------------------
+get_missing_units:
+function that returns the (num_z, num_slice_voxel) units of a shard which are not
+in its manifest, i.e. the shard is not finished yet (the derived values of the
+saved config are used, so the buildjob isn't scanned)
+
+inputs:
+config_dict = dict of the saved config of the shard (with the derived values)
+
+outputs:
+set of the missing (num_z, num_slice_voxel) units
+'''
+def get_missing_units(config_dict):
+    shard_layers = range(config_dict['shard_index'], config_dict['derived']['num_voxels_z'], config_dict['num_shards'])
+    expected = set((num_z, num_slice_voxel) for num_z in shard_layers for num_slice_voxel in range(config_dict['num_layers_per_voxel']))
+    return expected - RunManifest(config_dict['path_voxel_h5_folder']).get_completed()
+
+
+'''
+-------------------------------------------------------------------------------
+link_layer_file:
+function that writes a layer file which only consists of external links to the
+root members of another layer file (and a copy of its attributes)
+
+inputs:
+path_source = str of path of the layer file of the shard
+path_link = str of path of the file with the links (overwritten)
+'''
+def link_layer_file(path_source, path_link):
+    relative_path = os.path.relpath(path_source, os.path.dirname(path_link))
+    with h5py.File(path_source, 'r') as source_hdf, h5py.File(path_link, 'w') as link_hdf:
+        for key, value in source_hdf.attrs.items():
+            link_hdf.attrs[key] = value
+        for name in source_hdf:
+            link_hdf[name] = h5py.ExternalLink(relative_path, '/' + name)
+
+
+'''
+-------------------------------------------------------------------------------
+link_dense_files:
+function that writes the dense file of the merged folder as a virtual dataset,
+every voxel layer maps onto the dense file of the shard which computed it
+
+inputs:
+config_dicts = list of the saved configs of the shards
+path_link = str of path of the virtual dense file (overwritten)
+
+outputs:
+int of number of linked dense files
+'''
+def link_dense_files(config_dicts, path_link):
+    dataset_name = config_dicts[0]['part_name']
+    num_layers_per_voxel = config_dicts[0]['num_layers_per_voxel']
+    layout = None
+    num_linked = 0
+    for config_dict in config_dicts:
+        path_source = os.path.join(config_dict['path_voxel_h5_folder'], DENSE_FILE_NAME)
+        if not os.path.isfile(path_source):
+            continue #shard without voxel layers
+        with h5py.File(path_source, 'r') as source_hdf:
+            dataset = source_hdf[dataset_name]
+            if layout is None:
+                layout = h5py.VirtualLayout(shape = dataset.shape, dtype = dataset.dtype)
+                file_attributes = dict(source_hdf.attrs)
+                dataset_attributes = dict(dataset.attrs)
+            source = h5py.VirtualSource(os.path.relpath(path_source, os.path.dirname(path_link)), dataset_name, shape = dataset.shape)
+        for num_z in range(config_dict['shard_index'], config_dict['derived']['num_voxels_z'], config_dict['num_shards']):
+            rows = slice(num_z*num_layers_per_voxel, (num_z + 1)*num_layers_per_voxel)
+            layout[rows] = source[rows]
+        num_linked += 1
+    if layout is None:
+        raise FileNotFoundError('no shard has a {}'.format(DENSE_FILE_NAME))
+    with h5py.File(path_link, 'w') as link_hdf:
+        for key, value in file_attributes.items():
+            link_hdf.attrs[key] = value
+        dataset = link_hdf.create_virtual_dataset(dataset_name, layout, fillvalue = 0)
+        for key, value in dataset_attributes.items():
+            dataset.attrs[key] = value
+    return num_linked
+
+
+'''
+-------------------------------------------------------------------------------
+merge_shards:
+function that stitches the shard folders of an output root into the output root
+(links only, no voxel data is copied) and builds the voxel index and the feature
+table of the merged folder. The merge can be repeated, e.g. after a shard was
+completed
+
+inputs:
+path_output_root = str of the folder with the shard_{i}_of_{num_shards} folders
+allow_incomplete = bool whether shards which are not finished are merged as well
+                   (their missing voxel slices stay empty)
+
+outputs:
+int of number of linked files (layer files or dense files of the shards)
+'''
+def merge_shards(path_output_root, allow_incomplete = False):
+    if os.path.isdir(os.path.join(path_output_root, MANIFEST_FOLDER_NAME)):
+        raise ValueError('{} is the folder of a single run, the shards are merged into a folder of their own'.format(path_output_root))
+    config_dicts = []
+    for path_folder in get_shard_folders(path_output_root):
+        path_config = os.path.join(path_folder, CONFIG_FILE_NAME)
+        if not os.path.isfile(path_config):
+            raise FileNotFoundError('{} has no {}, the shard was not started'.format(path_folder, CONFIG_FILE_NAME))
+        with open(path_config) as json_file:
+            config_dict = json.load(json_file)
+        config_dict['path_voxel_h5_folder'] = path_folder #the shard may have been written under another mount point
+        config_dicts.append(config_dict)
+
+    #the shards have to be the same run apart from the shard
+    get_run_dict = lambda config_dict: {key: value for key, value in config_dict.items() if key not in ('path_voxel_h5_folder', 'shard_index')}
+    different = [config_dict['shard_index'] for config_dict in config_dicts if get_run_dict(config_dict) != get_run_dict(config_dicts[0])]
+    if different:
+        raise ValueError('the configs of the shards {} differ from the config of shard 0'.format(different))
+    incomplete = {config_dict['shard_index']: len(get_missing_units(config_dict)) for config_dict in config_dicts}
+    incomplete = {shard_index: num_missing for shard_index, num_missing in incomplete.items() if num_missing}
+    if incomplete and not allow_incomplete:
+        raise ValueError('shards are not finished (shard -> missing voxel slices): {}, start them again to resume'.format(incomplete))
+
+    #the old links are replaced (the output root only has links and the files of the merge)
+    for path_old in glob.glob(os.path.join(path_output_root, 'Voxel*.hdf5')):
+        os.remove(path_old)
+    shutil.rmtree(os.path.join(path_output_root, VOXEL_TABLES_FOLDER_NAME), ignore_errors = True)
+    num_linked = 0
+    if config_dicts[0]['output_format'] == 'dense':
+        num_linked = link_dense_files(config_dicts, os.path.join(path_output_root, DENSE_FILE_NAME))
+    else:
+        for config_dict in config_dicts:
+            for file_name in sorted(os.listdir(config_dict['path_voxel_h5_folder'])):
+                if file_name.startswith('Voxel_layer') and file_name.endswith('.hdf5'):
+                    link_layer_file(os.path.join(config_dict['path_voxel_h5_folder'], file_name), os.path.join(path_output_root, file_name))
+                    num_linked += 1
+            path_tables_folder = os.path.join(config_dict['path_voxel_h5_folder'], VOXEL_TABLES_FOLDER_NAME)
+            if os.path.isdir(path_tables_folder):
+                os.makedirs(os.path.join(path_output_root, VOXEL_TABLES_FOLDER_NAME), exist_ok = True)
+                for file_name in os.listdir(path_tables_folder):
+                    if file_name.endswith('.npz'):
+                        shutil.copyfile(os.path.join(path_tables_folder, file_name), os.path.join(path_output_root, VOXEL_TABLES_FOLDER_NAME, file_name))
+
+    merged_dict = dict(config_dicts[0], path_voxel_h5_folder = path_output_root, shard_index = 0, num_shards = 1)
+    with open(os.path.join(path_output_root, CONFIG_FILE_NAME), 'w') as json_file:
+        json.dump(merged_dict, json_file, indent = 4)
+    if glob.glob(os.path.join(path_output_root, 'Voxel_layer_*.hdf5')): #storage reduced layouts, the full grid files have no tables
+        build_voxel_index(path_output_root)
+        if merged_dict['features']:
+            build_feature_table(path_output_root)
+    print('merged {} shards into {}: {} files linked{}'.format(len(config_dicts), path_output_root, num_linked,
+                                                                    ', incomplete shards {}'.format(incomplete) if incomplete else ''))
+    return num_linked
+
+
+'''
+-------------------------------------------------------------------------------
+launch_local_shards:
+function that runs all the shards of a run as processes of this machine (each
+with voxelize.py run --shard i/num_shards) and merges them afterwards. The bounds
+are scanned once before, so the shards read the cached scan. Mostly useful to
+test a split before it is run on several nodes
+
+inputs:
+config = VoxelizationConfig of the whole run (path_voxel_h5_folder is the output root)
+num_shards = int of number of shards
+workers_per_shard = int of number of compute processes per shard (None -> default of the scheduler)
+scheduler = str of the scheduler of the shards (see voxelize.py run)
+restart = bool whether the shards compute all slices again
+
+outputs:
+int of number of linked files (see merge_shards)
+'''
+def launch_local_shards(config, num_shards, workers_per_shard = None, scheduler = 'slice', restart = False):
+    config.resolve()
+    config.make_output_folder()
+    path_config = os.path.join(config.path_voxel_h5_folder, CONFIG_FILE_NAME)
+    config.save_json(path_config)
+    path_voxelize = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'voxelize.py')
+    processes = []
+    for shard_index in range(num_shards):
+        command = [sys.executable, path_voxelize, 'run', '--config', path_config, '--shard', '{}/{}'.format(shard_index, num_shards), '--scheduler', scheduler]
+        if workers_per_shard is not None:
+            command += ['--workers', str(workers_per_shard)]
+        if restart:
+            command.append('--restart')
+        processes.append(subprocess.Popen(command))
+    failed = [shard_index for shard_index, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise RuntimeError('the shards {} of {} failed, start them again to resume'.format(failed, num_shards))
+    return merge_shards(config.path_voxel_h5_folder)
+
+
+if __name__ == '__main__':
+    config = VoxelizationConfig('/home/jan/Documents/Trainingsdaten/ZP_4/ZP_4_full_part.h5', '/home/jan/Documents/Trainingsdaten/ZP_4/ZP_4_voxel_100_10_sharded', 'ZP4_combined')
+    launch_local_shards(config, num_shards = 4, workers_per_shard = 2)
@@ -0,0 +1,187 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Random access to the voxels of a voxelization run, independent of the output
+format ('groups', 'csr', 'dense' or the full grid files). Open files are kept in
+a LRU pool and decoded voxels in a LRU cache bounded by bytes, so repeated and
+neighbouring requests don't reopen files or decode the same voxel again
+
+usage:
+with VoxelStore('ZP_4_voxel_100_10') as store:
+    voxel = store.get(3, 4, 0)                            #(layers, voxel_size, voxel_size, channels)
+    voxels = store.get_many([(3, 4, 0), (3, 5, 0), (0, 0, 2)])
+'''
+import collections
+import h5py
+import json
+import numpy as np
+import os
+from voxel_reader import get_layout, read_voxel_slice, read_dense_voxel, densify_voxel
+from voxel_writer import DENSE_CHANNELS
+
+CONFIG_FILE_NAME = 'voxelization_config.json'
+DENSE_FILE_NAME = 'Voxels_dense.hdf5'
+LAYER_FILE_NAMES = ('Voxel_layer_{}.hdf5', 'Voxel_layer:_{}.hdf5') #storage reduced, full grid
+
+
+def get_voxel_nbytes(voxel):
+    #dense voxel (np array) or list of slice dicts
+    if isinstance(voxel, np.ndarray):
+        return voxel.nbytes
+    return sum(column.nbytes for columns in voxel for column in columns.values())
+
+
+'''
+-------------------------------------------------------------------------------
+VoxelStore:
+class for random access to the voxels of an output folder
+
+inputs:
+path_voxel_h5_folder = str of the folder of the voxel files
+voxel_size = int of voxel x and y dimensions (None -> voxelization_config.json of the folder)
+num_layers_per_voxel = int of number of slices per voxel (None -> voxelization_config.json)
+dataset_name = str of the dataset of the dense layout (None -> part name of the config)
+max_open_files = int of number of files which are kept open
+max_cache_bytes = int of bytes of decoded voxels which are cached (0 -> no cache),
+                  the arrays of cached voxels are read-only
+channels = list of the columns which become the channels of a dense voxel
+dtype = dtype of dense voxels
+'''
+class VoxelStore:
+    def __init__(self, path_voxel_h5_folder, voxel_size = None, num_layers_per_voxel = None, dataset_name = None,
+                 max_open_files = 16, max_cache_bytes = 512*1024**2, channels = DENSE_CHANNELS, dtype = np.int32):
+        self.path_voxel_h5_folder = path_voxel_h5_folder
+        config_dict = {}
+        if os.path.isfile(os.path.join(path_voxel_h5_folder, CONFIG_FILE_NAME)):
+            with open(os.path.join(path_voxel_h5_folder, CONFIG_FILE_NAME)) as json_file:
+                config_dict = json.load(json_file)
+        self.voxel_size = int(voxel_size if voxel_size is not None else config_dict['voxel_size'])
+        self.num_layers_per_voxel = int(num_layers_per_voxel if num_layers_per_voxel is not None else config_dict['num_layers_per_voxel'])
+        self.dataset_name = dataset_name if dataset_name is not None else config_dict.get('part_name')
+        self.path_dense_h5 = os.path.join(path_voxel_h5_folder, DENSE_FILE_NAME)
+        self.is_dense = os.path.isfile(self.path_dense_h5)
+        self.max_open_files = max_open_files
+        self.max_cache_bytes = max_cache_bytes
+        self.channels = tuple(channels)
+        self.dtype = dtype
+
+        self.files = collections.OrderedDict() #path -> [open h5py.File, csr tables (offsets, counts) or None]
+        self.cache = collections.OrderedDict() #(x, y, z, dense) -> decoded voxel
+        self.cache_bytes = 0
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def get_path(self, num_z):
+        if self.is_dense:
+            return self.path_dense_h5
+        for file_name in LAYER_FILE_NAMES:
+            path_voxel_h5 = os.path.join(self.path_voxel_h5_folder, file_name.format(num_z))
+            if os.path.isfile(path_voxel_h5):
+                return path_voxel_h5
+        raise KeyError('no layer file for voxel layer {} in {}'.format(num_z, self.path_voxel_h5_folder))
+
+    def get_file(self, path_voxel_h5):
+        if path_voxel_h5 in self.files:
+            self.files.move_to_end(path_voxel_h5)
+        else:
+            while len(self.files) >= self.max_open_files:
+                _, (voxel_hdf, _) = self.files.popitem(last = False)
+                voxel_hdf.close()
+            voxel_hdf = h5py.File(path_voxel_h5, 'r')
+            #the offsets table of the csr layout is small and read once per open
+            tables = (voxel_hdf['offsets'][()], voxel_hdf['counts'][()]) if get_layout(voxel_hdf) == 'csr' else None
+            self.files[path_voxel_h5] = [voxel_hdf, tables]
+        return self.files[path_voxel_h5]
+
+    def read_voxel_slices(self, n_vox_x, n_vox_y, num_z):
+        voxel_hdf, tables = self.get_file(self.get_path(num_z))
+        column_names = ('X-Axis', 'Y-Axis') + self.channels
+        if tables is None:
+            return [read_voxel_slice(voxel_hdf, n_vox_x, n_vox_y, num_z, num_slice_voxel, column_names) for num_slice_voxel in range(self.num_layers_per_voxel)]
+
+        offsets, counts = tables
+        voxel_slices = []
+        for num_slice_voxel in range(self.num_layers_per_voxel):
+            offset = offsets[n_vox_x, n_vox_y, num_slice_voxel]
+            count = counts[n_vox_x, n_vox_y, num_slice_voxel]
+            if offset < 0 or count == 0:
+                voxel_slices.append({column_name: np.empty(0, dtype = int) for column_name in column_names})
+            else:
+                voxel_slices.append({column_name: voxel_hdf[column_name][offset:offset + count] for column_name in column_names})
+        return voxel_slices
+
+    def read(self, n_vox_x, n_vox_y, num_z, dense = True):
+        #uncached read of one voxel
+        if not self.is_dense:
+            voxel_slices = self.read_voxel_slices(n_vox_x, n_vox_y, num_z)
+            return densify_voxel(voxel_slices, self.voxel_size, self.channels, self.dtype) if dense else voxel_slices
+
+        voxel_hdf, _ = self.get_file(self.path_dense_h5)
+        dense_voxel = read_dense_voxel(voxel_hdf, self.dataset_name, n_vox_x, n_vox_y, num_z)
+        if dense:
+            return dense_voxel.astype(self.dtype, copy = False)
+        voxel_slices = []
+        for voxel_slice in dense_voxel:
+            y_axis, x_axis = np.nonzero(voxel_slice.any(axis = -1))
+            columns = {'X-Axis': x_axis, 'Y-Axis': y_axis}
+            columns.update({column_name: voxel_slice[y_axis, x_axis, channel] for channel, column_name in enumerate(self.channels)})
+            voxel_slices.append(columns)
+        return voxel_slices
+
+    def get(self, n_vox_x, n_vox_y, num_z, dense = True):
+        key = (n_vox_x, n_vox_y, num_z, dense)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.num_hits += 1
+            return self.cache[key]
+        self.num_misses += 1
+        voxel = self.read(n_vox_x, n_vox_y, num_z, dense)
+        self.add_to_cache(key, voxel)
+        return voxel
+
+    def get_many(self, voxel_keys, dense = True):
+        #voxel_keys: list of (x, y, z). The reads are sorted by file and position in
+        #the file, the result has the order of voxel_keys
+        voxel_keys = [tuple(voxel_key) for voxel_key in voxel_keys]
+        voxels = {}
+        for n_vox_x, n_vox_y, num_z in sorted(set(voxel_keys), key = lambda voxel_key: (voxel_key[2], voxel_key[1], voxel_key[0])):
+            voxels[(n_vox_x, n_vox_y, num_z)] = self.get(n_vox_x, n_vox_y, num_z, dense)
+        return [voxels[voxel_key] for voxel_key in voxel_keys]
+
+    def add_to_cache(self, key, voxel):
+        nbytes = get_voxel_nbytes(voxel)
+        if nbytes > self.max_cache_bytes:
+            return
+        #cached arrays are shared by all callers
+        if isinstance(voxel, np.ndarray):
+            voxel.flags.writeable = False
+        else:
+            for columns in voxel:
+                for column in columns.values():
+                    column.flags.writeable = False
+        self.cache[key] = voxel
+        self.cache_bytes += nbytes
+        while self.cache_bytes > self.max_cache_bytes:
+            _, evicted = self.cache.popitem(last = False)
+            self.cache_bytes -= get_voxel_nbytes(evicted)
+
+    def close(self):
+        for voxel_hdf, _ in self.files.values():
+            voxel_hdf.close()
+        self.files = collections.OrderedDict()
+        self.cache = collections.OrderedDict()
+        self.cache_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == '__main__':
+    with VoxelStore('/home/jan/Documents/Trainingsdaten/ZP_4/ZP_4_voxel_100_10') as store:
+        voxel = store.get(0, 0, 0)
+        print(voxel.shape, voxel.dtype)
@@ -0,0 +1,207 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Sweep mode which voxelizes one part with several voxel grids (voxel_size,
+num_layers_per_voxel) in one pass over the buildjob. Reading, filtering and
+dedup of a slice dominate a run and don't depend on the grid, so every slice is
+loaded and filtered once and then binned for every grid. Every grid gets its own
+output folder (output_root/{part}_voxel_{voxel_size}_{layers}) with its own config
+json and manifest, so a folder is the same as the one of a single run and an
+interrupted sweep is resumed per grid
+
+usage:
+configs = create_sweep_configs(path_buildjob_h5, output_root, part_name, [(50, 10), (100, 10), (200, 5)])
+run_voxel_sweep(configs)
+'''
+import concurrent.futures
+import h5py
+import itertools
+import numpy as np
+import os
+import time
+import instrumentation
+from helping_functions import get_slice_loader
+from voxel_config import VoxelizationConfig
+from create_hdf_per_single_vox_layer_storage_reduced import bin_slice_array, get_slice_columns
+from slice_scheduler import get_slice_order
+from voxel_writer import create_voxel_layer_writer
+from run_manifest import RunManifest, prepare_manifest, get_pending_slices
+from voxel_index import build_voxel_index
+from voxel_features import get_feature_extractor, build_feature_table
+
+#the filtered slice has to be the same for all the grids
+SHARED_CONFIG_ATTRIBUTES = ('path_buildjob_h5', 'part_name', 'reduction_mode')
+
+
+'''
+-------------------------------------------------------------------------------
+create_sweep_configs:
+function that creates one VoxelizationConfig per voxel grid of a sweep
+
+inputs:
+path_buildjob_h5 = str of path of the hdf5 of the buildjob
+output_root = str of the folder which gets one subfolder per grid
+part_name = str of the name of the part
+grids = list of tuples (voxel_size, num_layers_per_voxel)
+**config_kwargs = further arguments of VoxelizationConfig (output_format, compression, ...)
+
+outputs:
+list of VoxelizationConfig
+'''
+def create_sweep_configs(path_buildjob_h5, output_root, part_name, grids, **config_kwargs):
+    if len(set(grids)) != len(grids):
+        raise ValueError('the grids of a sweep have to be different, got {}'.format(grids))
+    return [VoxelizationConfig(path_buildjob_h5, os.path.join(output_root, '{}_voxel_{}_{}'.format(part_name, voxel_size, num_layers_per_voxel)), part_name,
+                               voxel_size = voxel_size, num_layers_per_voxel = num_layers_per_voxel, **config_kwargs)
+            for voxel_size, num_layers_per_voxel in grids]
+
+
+#set in every compute process by init_compute_process
+compute_state = {}
+
+def init_compute_process(configs, instrumentation_settings):
+    compute_state['configs'] = configs
+    compute_state['h5_file'] = None
+    instrumentation.init_process(instrumentation_settings)
+
+
+'''
+-------------------------------------------------------------------------------
+compute_sweep_slice:
+task of the pool: reads and filters one slice once and bins it for every grid
+which still needs it. The process keeps the buildjob open for all its tasks
+
+inputs:
+num_slice = int of the slice number (0 -> Slice00001)
+config_indices = list of the indices of the configs which need the slice
+
+outputs:
+tuple of num_slice, list of (config index, sorted slice array, offsets) and the
+instrumentation snapshot of the task
+'''
+def compute_sweep_slice(num_slice, config_indices):
+    configs = compute_state['configs']
+    config = configs[config_indices[0]]
+    if compute_state['h5_file'] is None:
+        compute_state['h5_file'] = h5py.File(config.path_buildjob_h5, 'r')
+    part = compute_state['h5_file'][config.part_name]
+    Slice_name = config.get_slice_name(num_slice)
+    if Slice_name in part:
+        loader = get_slice_loader()
+        with instrumentation.span('read'):
+            loader.read(part[Slice_name])
+        array_not_docked = loader.filter(config.reduction_mode)
+    else:
+        array_not_docked = np.empty([0,4], dtype = int)
+
+    binned = []
+    for config_index in config_indices:
+        #bin_slice_array docks the array in place -> every grid gets its own copy
+        array_sorted, offsets = bin_slice_array(array_not_docked.copy(), configs[config_index])
+        binned.append((config_index, array_sorted, offsets))
+    return num_slice, binned, instrumentation.collect()
+
+
+'''
+-------------------------------------------------------------------------------
+resolve_sweep_configs:
+function that checks that the configs can share the filtered slices and resolves
+them with one bounds scan (the bounds of the part don't depend on the grid)
+'''
+def resolve_sweep_configs(configs):
+    if not configs:
+        raise ValueError('a sweep needs at least one config')
+    for config in configs:
+        if config.output_format not in ('groups', 'csr'):
+            raise ValueError('the sweep writes the storage reduced layouts groups and csr, not {}'.format(config.output_format))
+        different = [attribute for attribute in SHARED_CONFIG_ATTRIBUTES if getattr(config, attribute) != getattr(configs[0], attribute)]
+        if different:
+            raise ValueError('the configs of a sweep have to share {}, {} differ'.format(SHARED_CONFIG_ATTRIBUTES, different))
+    folders = [config.path_voxel_h5_folder for config in configs]
+    if None in folders or len(set(folders)) != len(folders):
+        raise ValueError('every config of a sweep needs its own output folder, got {}'.format(folders))
+
+    configs[0].resolve()
+    for config in configs[1:]:
+        config.bounds = configs[0].bounds
+        config.resolve()
+    return configs
+
+
+'''
+-------------------------------------------------------------------------------
+run_voxel_sweep:
+function that voxelizes a part with all the grids of configs in one pass. The
+slices are handed out largest first, the binned slices are written by this
+process (one writer per grid). Slices which are completed for every grid by an
+earlier run are not read again
+
+inputs:
+configs = list of VoxelizationConfig (see create_sweep_configs, output_format 'groups' or 'csr')
+max_workers = int of number of compute processes (None -> number of CPUs)
+restart = bool whether slices completed by an earlier run are computed again
+max_in_flight = int of number of slices submitted but not written (None -> 2*max_workers)
+
+outputs:
+dict of output folder -> number of slices written into it
+'''
+def run_voxel_sweep(configs, max_workers = None, restart = False, max_in_flight = None):
+    start_time = time.time()
+    configs = resolve_sweep_configs(list(configs))
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    if max_in_flight is None:
+        max_in_flight = 2*max_workers
+
+    #slice -> configs which still need it
+    config_indices = {}
+    for config_index, config in enumerate(configs):
+        config.make_output_folder()
+        config.save_json(os.path.join(config.path_voxel_h5_folder, 'voxelization_config.json'))
+        completed = prepare_manifest(config, restart)
+        for num_slice in get_pending_slices(config, completed):
+            config_indices.setdefault(num_slice, []).append(config_index)
+    largest_config = max(configs, key = lambda config: config.num_slices)
+    tasks = [(num_slice, config_indices[num_slice]) for num_slice in get_slice_order(largest_config) if num_slice in config_indices]
+
+    result = {config.path_voxel_h5_folder: 0 for config in configs}
+    writers = [create_voxel_layer_writer(config.output_format, config.path_voxel_h5_folder, config.num_voxels_x, config.num_voxels_y, config.num_layers_per_voxel,
+                                         flush_policy = 'slice', compression = config.compression, skip_empty = config.skip_empty_voxels, features = get_feature_extractor(config))
+               for config in configs]
+    manifests = [RunManifest(config.path_voxel_h5_folder, 'sweep') for config in configs]
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = max_workers, initializer = init_compute_process, initargs = (configs, instrumentation.get_settings())) as executor:
+            task_iterator = iter(tasks)
+            in_flight = set(executor.submit(compute_sweep_slice, *task) for task in itertools.islice(task_iterator, max_in_flight))
+            while in_flight:
+                done, in_flight = concurrent.futures.wait(in_flight, return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    num_slice, binned, snapshot = future.result()
+                    instrumentation.merge(snapshot)
+                    for config_index, array_sorted, offsets in binned:
+                        config = configs[config_index]
+                        for num_z, num_slice_voxel in config.get_voxel_layers(num_slice):
+                            writers[config_index].add_slice(num_z, num_slice_voxel, get_slice_columns(array_sorted), offsets, config.num_voxels_x)
+                            writers[config_index].end_slice()
+                            manifests[config_index].mark_completed(num_z, num_slice_voxel)
+                        result[config.path_voxel_h5_folder] += 1
+                    for task in itertools.islice(task_iterator, 1):
+                        in_flight.add(executor.submit(compute_sweep_slice, *task))
+    finally:
+        for writer in writers:
+            writer.close()
+
+    for config in configs:
+        build_voxel_index(config.path_voxel_h5_folder)
+        if config.features:
+            build_feature_table(config.path_voxel_h5_folder)
+    print('sweep of {} grids over {} slices took {} s'.format(len(configs), len(tasks), time.time() - start_time))
+    return result
+
+
+if __name__ == '__main__':
+    path_buildjob_h5 = '/home/jan/Documents/Trainingsdaten/ZP_4/ZP_4_full_part.h5'
+    output_root = '/home/jan/Documents/Trainingsdaten/ZP_4'
+    run_voxel_sweep(create_sweep_configs(path_buildjob_h5, output_root, 'ZP4_combined', [(50, 10), (100, 10), (200, 10), (100, 5)]))
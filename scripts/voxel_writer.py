@@ -0,0 +1,487 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+The class is used to write the voxel layer files (Voxel_layer_{num_z}.hdf5).
+Instead of opening the layer file for every single voxel, one handle per layer
+file is kept open and the voxel data is collected in memory and written in
+one batch
+'''
+import h5py
+import numpy as np
+import os
+import instrumentation
+from compression_profiles import get_dataset_kwargs
+
+
+'''
+-------------------------------------------------------------------------------
+VoxelLayerWriter:
+class that owns one open file handle per voxel layer file and buffers the data
+of the voxels till the buffer is flushed. The layout of the files is the same as
+before: voxel_{x}_{y}_{z}/slice_{n}/{column name}
+
+inputs:
+path_voxel_h5_folder = str of the folder where the layer files are stored
+flush_policy = str of when the buffer is written to the files:
+               'voxel' (after every voxel), 'slice' (after end_slice),
+               'layer' (after end_layer) or 'manual' (only flush/close)
+max_buffer_bytes = int of bytes that can be buffered before the buffer is written
+                   regardless of the flush policy
+file_name = str of the name of the layer files, {} is replaced by num_z
+compression = str of the compression profile of the datasets (see compression_profiles.py)
+grid_shape = tuple of (num_voxels_x, num_voxels_y, num_layers_per_voxel) or None. If
+             given, the number of datapoints of every voxel slice is counted while
+             writing and stored in the tables of the layer (see save_voxel_tables)
+             as 'point_counts' (shape of grid_shape) together with the occupancy
+             bitmap 'occupancy' (shape (num_voxels_x, num_voxels_y), True if the
+             voxel has any datapoint) and min, max and sum of Area and Intensity
+             per voxel slice as 'slice_stats' (shape grid_shape + (6,), see
+             SLICE_STATS_FIELDS)
+skip_empty = bool whether voxel slices without datapoints are not written at all
+             (needs grid_shape, read_voxel_slice returns empty arrays for them)
+features = FeatureExtractor (see voxel_features.py) or None. The features of the
+           voxel slices are computed out of the columns while they are written and
+           stored in the tables of the layer as 'features' (shape grid_shape +
+           (number of feature columns,), needs grid_shape) and 'feature_names'
+
+usage:
+with VoxelLayerWriter(path_voxel_h5_folder, flush_policy = 'slice') as writer:
+    writer.add_voxel(num_z, n_vox_x, n_vox_y, num_slice_voxel, {'Area': ..., 'Intensity': ...})
+    writer.end_slice()
+
+add_slice adds all the voxels of a slice at once out of the result of
+partition_array_by_voxel
+'''
+FLUSH_POLICIES = ('voxel', 'slice', 'layer', 'manual')
+
+
+'''
+-------------------------------------------------------------------------------
+get_segment_stats:
+function that computes min, max and sum of Area and Intensity of contiguous
+segments of the columns (e.g. the voxels of a partitioned slice) in one pass
+
+inputs:
+columns = dict of column name -> np array (needs 'Area' and 'Intensity')
+counts = np array of the lengths of the segments (sum of counts = length of the columns)
+
+outputs:
+np array of shape (len(counts), 6) with the fields of SLICE_STATS_FIELDS
+(min and max are NaN, sums are 0 for empty segments)
+'''
+SLICE_STATS_FIELDS = ('area_min', 'area_max', 'area_sum', 'intensity_min', 'intensity_max', 'intensity_sum')
+
+def get_segment_stats(columns, counts):
+    counts = np.asarray(counts)
+    stats = create_empty_slice_stats(counts.shape)
+    nonempty = counts > 0
+    starts = (np.cumsum(counts) - counts)[nonempty]
+    if starts.size != 0:
+        for i, column_name in enumerate(('Area', 'Intensity')):
+            column = np.asarray(columns[column_name], dtype = np.float64)
+            stats[nonempty, 3*i] = np.minimum.reduceat(column, starts)
+            stats[nonempty, 3*i + 1] = np.maximum.reduceat(column, starts)
+            stats[nonempty, 3*i + 2] = np.add.reduceat(column, starts)
+    return stats
+
+def create_empty_slice_stats(shape):
+    stats = np.full(tuple(shape) + (len(SLICE_STATS_FIELDS),), np.nan)
+    stats[..., 2] = 0
+    stats[..., 5] = 0
+    return stats
+
+
+'''
+-------------------------------------------------------------------------------
+write_voxel_tables:
+function that writes (or overwrites) datasets of a layer file which are written
+again on every flush (offsets and counts of the csr layout)
+'''
+def write_voxel_tables(voxel_hdf, tables):
+    for dataset_name, data in tables.items():
+        if dataset_name in voxel_hdf:
+            voxel_hdf[dataset_name][...] = data
+        else:
+            voxel_hdf.create_dataset(dataset_name, data = data)
+
+
+'''
+-------------------------------------------------------------------------------
+save_voxel_tables:
+function that saves the per voxel tables of voxel layer num_z (point_counts,
+occupancy, slice_stats, ...), so prune, the voxel index and the feature table
+don't need to touch the voxel data. The tables are kept next to the layer files
+in voxel_tables/layer_{z}.npz and not in the layer file, so the root of a
+'groups' layer file only holds the voxel groups like before (readers which loop
+over h5.keys() keep working). The file is written under a temporary name and
+renamed, an interrupted save leaves the tables of the last flush
+
+inputs:
+path_voxel_h5_folder = str of the folder of the voxel layer files
+num_z = int of the voxel layer
+tables = dict of table name -> np array
+'''
+VOXEL_TABLES_FOLDER_NAME = 'voxel_tables'
+
+def get_voxel_tables_path(path_voxel_h5_folder, num_z):
+    return os.path.join(path_voxel_h5_folder, VOXEL_TABLES_FOLDER_NAME, 'layer_{}.npz'.format(num_z))
+
+def save_voxel_tables(path_voxel_h5_folder, num_z, tables):
+    path_tables = get_voxel_tables_path(path_voxel_h5_folder, num_z)
+    os.makedirs(os.path.dirname(path_tables), exist_ok = True)
+    with open(path_tables + '.tmp', 'wb') as npz_file:
+        np.savez(npz_file, **tables)
+    os.replace(path_tables + '.tmp', path_tables)
+
+def load_voxel_tables(path_voxel_h5_folder, num_z):
+    #dict of table name -> np array, None if the layer has no tables (full grid files or not written yet)
+    path_tables = get_voxel_tables_path(path_voxel_h5_folder, num_z)
+    if not os.path.isfile(path_tables):
+        return None
+    with np.load(path_tables, allow_pickle = False) as npz_file:
+        return {table_name: npz_file[table_name] for table_name in npz_file.files}
+
+class VoxelLayerWriter:
+    def __init__(self, path_voxel_h5_folder, flush_policy = 'slice', max_buffer_bytes = 256*1024**2, file_name = 'Voxel_layer_{}.hdf5', compression = 'none',
+                 grid_shape = None, skip_empty = False, features = None):
+        get_dataset_kwargs(compression) #raises for unknown profiles
+        if flush_policy not in FLUSH_POLICIES:
+            raise ValueError('flush_policy has to be one of {}, not {}'.format(FLUSH_POLICIES, flush_policy))
+        if skip_empty and grid_shape is None:
+            raise ValueError('skip_empty needs the grid_shape, otherwise the skipped voxels are not recorded')
+        if features is not None and grid_shape is None:
+            raise ValueError('features need the grid_shape')
+        self.path_voxel_h5_folder = path_voxel_h5_folder
+        self.flush_policy = flush_policy
+        self.max_buffer_bytes = max_buffer_bytes
+        self.file_name = file_name
+        self.compression = compression
+        self.grid_shape = None if grid_shape is None else tuple(int(num) for num in grid_shape)
+        self.skip_empty = skip_empty
+        self.features = features
+
+        self.files = {} #num_z -> open h5py.File
+        self.point_counts = {} #num_z -> np array of shape grid_shape (only with grid_shape)
+        self.slice_stats = {} #num_z -> np array of shape grid_shape + (6,) (only with grid_shape)
+        self.feature_tables = {} #num_z -> np array of shape grid_shape + (number of feature columns,) (only with features)
+        self.buffer = [] #list of (num_z, n_vox_x, n_vox_y, num_slice_voxel, dict of columns)
+        self.buffer_bytes = 0
+
+    def get_path(self, num_z):
+        return os.path.join(self.path_voxel_h5_folder, self.file_name.format(num_z))
+
+    def get_file(self, num_z):
+        if num_z not in self.files:
+            voxel_hdf = h5py.File(self.get_path(num_z), 'a')
+            tables = {}
+            if self.grid_shape is not None:
+                tables = load_voxel_tables(self.path_voxel_h5_folder, num_z) or {}
+                if 'point_counts' not in tables:
+                    voxel_hdf.attrs['num_z'] = num_z
+                    voxel_hdf.attrs['grid_shape'] = self.grid_shape
+                    self.point_counts[num_z] = np.zeros(self.grid_shape, dtype = np.int64)
+                elif tables['point_counts'].shape != self.grid_shape:
+                    voxel_hdf.close()
+                    raise ValueError('{} has the voxel grid {} and not {}'.format(self.get_path(num_z), tables['point_counts'].shape, self.grid_shape))
+                else:
+                    self.point_counts[num_z] = tables['point_counts']
+                self.slice_stats[num_z] = tables['slice_stats'] if 'slice_stats' in tables else create_empty_slice_stats(self.grid_shape)
+            self.files[num_z] = voxel_hdf
+            self.load_feature_table(num_z, tables)
+        return self.files[num_z]
+
+    def load_feature_table(self, num_z, tables):
+        if self.features is None:
+            return
+        if 'features' in tables and tuple(tables['feature_names']) == self.features.column_names:
+            self.feature_tables[num_z] = tables['features']
+        else:
+            self.feature_tables[num_z] = self.features.create_empty_table(self.grid_shape)
+
+    def add_features(self, num_z, n_vox_x, n_vox_y, num_slice_voxel, columns, counts):
+        #features of a run of voxels of one slice (columns sorted by voxel, counts per voxel)
+        if self.features is not None:
+            self.get_file(num_z)
+            with instrumentation.span('features'):
+                self.feature_tables[num_z][n_vox_x, n_vox_y, num_slice_voxel] = self.features.compute(columns, counts)
+
+    def write_tables(self, num_z, tables):
+        #per voxel tables of a layer which are saved on flush
+        if self.features is not None:
+            tables['features'] = self.feature_tables[num_z]
+            tables['feature_names'] = np.array(self.features.column_names)
+        save_voxel_tables(self.path_voxel_h5_folder, num_z, tables)
+
+    def add_voxel(self, num_z, n_vox_x, n_vox_y, num_slice_voxel, columns):
+        self.add_features(num_z, np.array([n_vox_x]), np.array([n_vox_y]), num_slice_voxel, columns, [len(next(iter(columns.values())))])
+        self.buffer_voxel(num_z, n_vox_x, n_vox_y, num_slice_voxel, columns)
+
+    def buffer_voxel(self, num_z, n_vox_x, n_vox_y, num_slice_voxel, columns):
+        self.buffer.append((num_z, n_vox_x, n_vox_y, num_slice_voxel, columns))
+        self.buffer_bytes += sum(column.nbytes for column in columns.values())
+
+        if self.flush_policy == 'voxel' or self.buffer_bytes >= self.max_buffer_bytes:
+            self.flush()
+
+    def add_slice(self, num_z, num_slice_voxel, columns, offsets, num_voxels_x):
+        #columns are the columns of the whole slice partitioned by partition_array_by_voxel
+        num_voxels_y = (offsets.size - 1) // num_voxels_x
+        self.add_features(num_z, np.tile(np.arange(num_voxels_x), num_voxels_y), np.repeat(np.arange(num_voxels_y), num_voxels_x), num_slice_voxel,
+                          {column_name: column[offsets[0]:offsets[-1]] for column_name, column in columns.items()}, np.diff(offsets))
+        for voxel_index in range(offsets.size - 1):
+            n_vox_y, n_vox_x = divmod(voxel_index, num_voxels_x)
+            self.buffer_voxel(num_z, n_vox_x, n_vox_y, num_slice_voxel,
+                              {column_name: column[offsets[voxel_index]:offsets[voxel_index + 1]] for column_name, column in columns.items()})
+
+    def end_slice(self):
+        if self.flush_policy == 'slice':
+            self.flush()
+
+    def end_layer(self):
+        if self.flush_policy in ('slice', 'layer'):
+            self.flush()
+
+    def flush(self):
+        with instrumentation.span('write'):
+            self.write_buffer()
+
+    def write_buffer(self):
+        written_files = set()
+        for num_z, n_vox_x, n_vox_y, num_slice_voxel, columns in self.buffer:
+            voxel_hdf = self.get_file(num_z)
+            written_files.add(num_z)
+            group_name = 'voxel_{}_{}_{}'.format(n_vox_x, n_vox_y, num_z)
+            slice_name = 'slice_{}'.format(num_slice_voxel)
+            num_points = len(next(iter(columns.values())))
+            if self.grid_shape is not None:
+                self.point_counts[num_z][n_vox_x, n_vox_y, num_slice_voxel] = num_points
+                if 'Area' in columns and 'Intensity' in columns:
+                    self.slice_stats[num_z][n_vox_x, n_vox_y, num_slice_voxel] = get_segment_stats(columns, [num_points])[0]
+            if num_points == 0 and self.skip_empty:
+                if group_name in voxel_hdf and slice_name in voxel_hdf[group_name]:
+                    del voxel_hdf[group_name][slice_name]
+                continue
+
+            voxel_group = voxel_hdf.require_group(group_name)
+            if slice_name in voxel_group:
+                #partially written slice of an interrupted run is written again
+                del voxel_group[slice_name]
+            slice_group = voxel_group.create_group(slice_name)
+            for column_name, column in columns.items():
+                slice_group.create_dataset(column_name, data = column, **get_dataset_kwargs(self.compression, column.dtype))
+            instrumentation.count('voxels_written', num_points > 0)
+            instrumentation.count('bytes_written', sum(column.nbytes for column in columns.values()))
+
+        for num_z in written_files:
+            #the voxel data is flushed before the tables which describe it
+            self.files[num_z].flush()
+            if self.grid_shape is not None:
+                self.write_tables(num_z, {'point_counts': self.point_counts[num_z],
+                                          'occupancy': self.point_counts[num_z].sum(axis = 2) > 0,
+                                          'slice_stats': self.slice_stats[num_z]})
+        self.buffer = []
+        self.buffer_bytes = 0
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            for voxel_hdf in self.files.values():
+                voxel_hdf.close()
+            self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+'''
+-------------------------------------------------------------------------------
+CSRVoxelLayerWriter:
+writer for the compact 'csr' layout. Instead of one group per voxel and slice a
+layer file only holds one large 1D dataset per column (X-Axis, Y-Axis, Area,
+Intensity, coordinates inside the voxel) and an offsets and counts table of shape
+(num_voxels_x, num_voxels_y, num_layers_per_voxel). The datapoints of voxel x,y
+and slice n are column[offsets[x,y,n]:offsets[x,y,n] + counts[x,y,n]]
+(offsets is -1 for voxel slices which haven't been written). The same interface
+as VoxelLayerWriter is used, so the writers can be exchanged
+
+inputs:
+path_voxel_h5_folder = str of the folder where the layer files are stored
+num_voxels_x = int of number of voxels in x-direction
+num_voxels_y = int of number of voxels in y-direction
+num_layers_per_voxel = int of number of slices per voxel
+flush_policy, max_buffer_bytes, file_name, compression, features: see VoxelLayerWriter
+'''
+CSR_CHUNK_SIZE = 2**16
+
+class CSRVoxelLayerWriter(VoxelLayerWriter):
+    def __init__(self, path_voxel_h5_folder, num_voxels_x, num_voxels_y, num_layers_per_voxel, flush_policy = 'slice', max_buffer_bytes = 256*1024**2, file_name = 'Voxel_layer_{}.hdf5', compression = 'none',
+                 skip_empty = True, features = None):
+        #empty voxel slices never take space in the csr layout, skip_empty is only accepted for the common interface
+        grid_shape = (num_voxels_x, num_voxels_y, num_layers_per_voxel)
+        super().__init__(path_voxel_h5_folder, flush_policy, max_buffer_bytes, file_name, compression, grid_shape = grid_shape, features = features)
+        self.tables = {} #num_z -> [offsets, counts, slice_stats] (kept in memory, written on flush)
+
+    def get_file(self, num_z):
+        if num_z not in self.files:
+            voxel_hdf = h5py.File(self.get_path(num_z), 'a')
+            if 'offsets' not in voxel_hdf:
+                voxel_hdf.attrs['layout'] = 'csr'
+                voxel_hdf.attrs['num_z'] = num_z
+                voxel_hdf.attrs['grid_shape'] = self.grid_shape
+                voxel_hdf.create_dataset('offsets', data = np.full(self.grid_shape, -1, dtype = np.int64))
+                voxel_hdf.create_dataset('counts', data = np.zeros(self.grid_shape, dtype = np.int64))
+            elif tuple(voxel_hdf.attrs['grid_shape']) != self.grid_shape:
+                grid_shape = tuple(int(num) for num in voxel_hdf.attrs['grid_shape'])
+                voxel_hdf.close()
+                raise ValueError('{} has the voxel grid {} and not {}'.format(self.get_path(num_z), grid_shape, self.grid_shape))
+            self.files[num_z] = voxel_hdf
+            tables = load_voxel_tables(self.path_voxel_h5_folder, num_z) or {}
+            slice_stats = tables['slice_stats'] if 'slice_stats' in tables else create_empty_slice_stats(self.grid_shape)
+            self.tables[num_z] = [voxel_hdf['offsets'][()], voxel_hdf['counts'][()], slice_stats]
+            self.load_feature_table(num_z, tables)
+        return self.files[num_z]
+
+    def add_voxel(self, num_z, n_vox_x, n_vox_y, num_slice_voxel, columns):
+        counts = np.array([len(next(iter(columns.values())))])
+        self.add_entry(num_z, np.array([n_vox_x]), np.array([n_vox_y]), num_slice_voxel, counts, columns)
+
+    def add_slice(self, num_z, num_slice_voxel, columns, offsets, num_voxels_x):
+        #the voxels of the partitioned slice are already contiguous -> the whole slice is one entry
+        num_voxels_y = (offsets.size - 1) // num_voxels_x
+        n_vox_x = np.tile(np.arange(num_voxels_x), num_voxels_y)
+        n_vox_y = np.repeat(np.arange(num_voxels_y), num_voxels_x)
+        columns = {column_name: column[offsets[0]:offsets[-1]] for column_name, column in columns.items()}
+        self.add_entry(num_z, n_vox_x, n_vox_y, num_slice_voxel, np.diff(offsets), columns)
+
+    def add_entry(self, num_z, n_vox_x, n_vox_y, num_slice_voxel, counts, columns):
+        self.add_features(num_z, n_vox_x, n_vox_y, num_slice_voxel, columns, counts)
+        self.buffer.append((num_z, n_vox_x, n_vox_y, num_slice_voxel, counts, columns))
+        self.buffer_bytes += sum(column.nbytes for column in columns.values())
+
+        if self.flush_policy == 'voxel' or self.buffer_bytes >= self.max_buffer_bytes:
+            self.flush()
+
+    def write_buffer(self):
+        entries_per_file = {}
+        for entry in self.buffer:
+            entries_per_file.setdefault(entry[0], []).append(entry)
+
+        for num_z, entries in entries_per_file.items():
+            voxel_hdf = self.get_file(num_z)
+            offsets, counts, slice_stats = self.tables[num_z]
+
+            column_names = list(entries[0][5].keys())
+            start = voxel_hdf[column_names[0]].shape[0] if column_names[0] in voxel_hdf else 0
+            for _, n_vox_x, n_vox_y, num_slice_voxel, entry_counts, entry_columns in entries:
+                offsets[n_vox_x, n_vox_y, num_slice_voxel] = start + np.cumsum(entry_counts) - entry_counts
+                counts[n_vox_x, n_vox_y, num_slice_voxel] = entry_counts
+                if 'Area' in entry_columns and 'Intensity' in entry_columns:
+                    slice_stats[n_vox_x, n_vox_y, num_slice_voxel] = get_segment_stats(entry_columns, entry_counts)
+                start += entry_counts.sum()
+
+            #one write per column and file
+            for column_name in column_names:
+                column = np.concatenate([entry[5][column_name] for entry in entries])
+                if column_name not in voxel_hdf:
+                    voxel_hdf.create_dataset(column_name, shape = (0,), maxshape = (None,), dtype = column.dtype, chunks = (CSR_CHUNK_SIZE,),
+                                             **get_dataset_kwargs(self.compression, column.dtype))
+                dataset = voxel_hdf[column_name]
+                size_before = dataset.shape[0]
+                dataset.resize((size_before + column.size,))
+                dataset[size_before:] = column
+                instrumentation.count('bytes_written', column.nbytes)
+            instrumentation.count('voxels_written', sum(np.count_nonzero(entry[4]) for entry in entries))
+
+            #offsets and counts locate the voxel data and stay in the layer file
+            write_voxel_tables(voxel_hdf, {'offsets': offsets, 'counts': counts})
+            voxel_hdf.flush()
+            self.write_tables(num_z, {'point_counts': counts,
+                                      'occupancy': counts.sum(axis = 2) > 0,
+                                      'slice_stats': slice_stats})
+        self.buffer = []
+        self.buffer_bytes = 0
+
+
+'''
+-------------------------------------------------------------------------------
+create_voxel_layer_writer:
+function that returns the writer for an output format
+
+inputs:
+output_format = str 'groups' (VoxelLayerWriter) or 'csr' (CSRVoxelLayerWriter)
+path_voxel_h5_folder = str of the folder where the layer files are stored
+num_voxels_x, num_voxels_y, num_layers_per_voxel = int of the voxel grid
+further keyword arguments are passed to the writer (flush_policy, ...)
+
+outputs:
+writer object
+'''
+OUTPUT_FORMATS = ('groups', 'csr')
+
+def create_voxel_layer_writer(output_format, path_voxel_h5_folder, num_voxels_x, num_voxels_y, num_layers_per_voxel, **kwargs):
+    if output_format == 'groups':
+        return VoxelLayerWriter(path_voxel_h5_folder, grid_shape = (num_voxels_x, num_voxels_y, num_layers_per_voxel), **kwargs)
+    elif output_format == 'csr':
+        return CSRVoxelLayerWriter(path_voxel_h5_folder, num_voxels_x, num_voxels_y, num_layers_per_voxel, **kwargs)
+    raise ValueError('output_format has to be one of {}, not {}'.format(OUTPUT_FORMATS, output_format))
+
+
+'''
+-------------------------------------------------------------------------------
+DenseVoxelWriter:
+writer for the 'dense' layout. The whole part is one chunked and compressed
+dataset of shape (slices, Y, X, channels) with the channels Area and Intensity.
+The chunk shape is (num_layers_per_voxel, voxel_size, voxel_size, channels), so
+one voxel is exactly one chunk and the coordinate grids don't need to be stored.
+Data is written per voxel layer (write_layer), so every write covers whole chunks
+
+inputs:
+path_voxel_h5 = str of path of the hdf5 file
+dataset_name = str of the name of the dataset (e.g. the part name)
+num_voxels_x, num_voxels_y, num_voxels_z = int of number of voxels in x-, y- and z-direction
+voxel_size = int of voxel x and y dimensions
+num_layers_per_voxel = int of number of slices per voxel
+dtype = dtype of the dataset
+compression = str of the compression profile of the dataset (see compression_profiles.py)
+'''
+DENSE_CHANNELS = ('Area', 'Intensity')
+
+class DenseVoxelWriter:
+    def __init__(self, path_voxel_h5, dataset_name, num_voxels_x, num_voxels_y, num_voxels_z, voxel_size, num_layers_per_voxel, dtype = np.int32, compression = 'shuffle-gzip'):
+        self.num_layers_per_voxel = num_layers_per_voxel
+        self.voxel_hdf = h5py.File(path_voxel_h5, 'a')
+        self.voxel_hdf.attrs['layout'] = 'dense'
+        shape = (num_voxels_z*num_layers_per_voxel, num_voxels_y*voxel_size, num_voxels_x*voxel_size, len(DENSE_CHANNELS))
+        if dataset_name not in self.voxel_hdf:
+            self.dataset = self.voxel_hdf.create_dataset(dataset_name, shape = shape, dtype = dtype,
+                                                         chunks = (num_layers_per_voxel, voxel_size, voxel_size, len(DENSE_CHANNELS)),
+                                                         fillvalue = 0, **get_dataset_kwargs(compression, dtype))
+            self.dataset.attrs['channels'] = DENSE_CHANNELS
+            self.dataset.attrs['voxel_size'] = voxel_size
+            self.dataset.attrs['num_layers_per_voxel'] = num_layers_per_voxel
+        else:
+            self.dataset = self.voxel_hdf[dataset_name]
+            if self.dataset.shape != shape:
+                dataset_shape = self.dataset.shape
+                self.voxel_hdf.close()
+                raise ValueError('dataset {} has the shape {} and not {}'.format(dataset_name, dataset_shape, shape))
+
+    def write_layer(self, num_z, layer_block):
+        #layer_block: np array of shape (num_layers_per_voxel, Y, X, channels), e.g. stacked fill_dense_slice results
+        self.dataset[num_z*self.num_layers_per_voxel:(num_z + 1)*self.num_layers_per_voxel] = layer_block
+        self.voxel_hdf.flush()
+
+    def close(self):
+        self.voxel_hdf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,357 @@
+'''
+@ coop: Fraunhofer IWU
+@ author: Jan Klein
+@ date: 18-10-2026
+
+Command line entry point of the voxelization. All the parameters are given as
+arguments (or as a json written by 'export'/'run'), so Definitions.py doesn't
+need to be edited for a run
+
+usage:
+python voxelize.py scan   --buildjob ZP_4_full_part.h5 --part ZP4_combined
+python voxelize.py run    --buildjob ZP_4_full_part.h5 --part ZP4_combined --output ZP_4_voxel_100_10 --voxel-size 100 --layers 10
+python voxelize.py prune  --output ZP_4_voxel_100_10
+python voxelize.py export --buildjob ZP_4_full_part.h5 --part ZP4_combined --output ZP_4_voxel_100_10 --to config.json
+python voxelize.py index  --output ZP_4_voxel_100_10
+python voxelize.py pyramid --output ZP_4_voxel_100_10 --levels 3
+python voxelize.py memmap --output ZP_4_voxel_100_10 --to ZP_4_voxel_100_10/memmap
+python voxelize.py batch  --buildjob examplerRun.h5 --output examplerRun_voxel_100_10 --voxel-size 100 --layers 10
+python voxelize.py sweep  --buildjob ZP_4_full_part.h5 --part ZP4_combined --output ZP_4 --grid 50:10 100:10 200:5
+python voxelize.py run    --buildjob ZP_4_full_part.h5 --part ZP4_combined --output ZP_4_voxel_100_10 --shard 0/4
+python voxelize.py merge  --output ZP_4_voxel_100_10
+
+run --shard i/N computes every N-th voxel layer into output/shard_i_of_N (one
+command per node), merge links the shards into the output folder, see voxel_shards.py
+
+run, batch and sweep write a report of the stage times, peak memory and point/byte
+counters with --report run_report.json (or .csv), see instrumentation.py. The peak
+memory per stage is only measured with --report-memory (tracemalloc, slow)
+'''
+import argparse
+import os
+import sys
+import instrumentation
+from voxel_config import VoxelizationConfig
+from compression_profiles import COMPRESSION_PROFILES
+from helping_functions import REDUCTION_MODES
+from voxel_features import FEATURE_FUNCTIONS
+
+CONFIG_FILE_NAME = 'voxelization_config.json'
+
+
+'''
+-------------------------------------------------------------------------------
+add_config_arguments:
+function that adds the arguments of a VoxelizationConfig to a (sub)parser
+'''
+def add_config_arguments(parser):
+    parser.add_argument('--config', help = 'json of a config (written by run or export), replaces the other config arguments')
+    parser.add_argument('--buildjob', help = 'path of the hdf5 of the buildjob')
+    parser.add_argument('--part', help = 'name of the part')
+    parser.add_argument('--output', help = 'folder of the voxel files')
+    parser.add_argument('--voxel-size', type = int, default = 100, help = 'x and y dimension of a voxel')
+    parser.add_argument('--layers', type = int, default = 10, help = 'number of slices per voxel')
+    parser.add_argument('--max-slice', type = int, default = None, help = 'number of the highest slice of the part (default: read from the hdf5)')
+    parser.add_argument('--format', default = 'groups', choices = ('groups', 'csr', 'dense'), help = 'layout of the voxel files')
+    parser.add_argument('--compression', default = None, choices = sorted(COMPRESSION_PROFILES), help = 'compression profile of the datasets (default: none, shuffle-gzip for --format dense)')
+    parser.add_argument('--mode', default = 'max', choices = REDUCTION_MODES, help = 'reduction of multiple x,y-occurences')
+    parser.add_argument('--scan-workers', type = int, default = None, help = 'number of processes for the bounding box scan')
+    parser.add_argument('--skip-empty', action = 'store_true', help = 'do not write voxel slices without datapoints (layout groups)')
+    parser.add_argument('--stride', type = int, default = None, help = 'distance between the starts of neighbouring voxels in x and y (default: voxel size, smaller -> overlapping voxels)')
+    parser.add_argument('--stride-z', type = int, default = None, help = 'number of slices between the starts of neighbouring voxel layers (default: layers)')
+    parser.add_argument('--features', nargs = '+', default = [], choices = sorted(FEATURE_FUNCTIONS), help = 'features computed per voxel slice while writing (see voxel_features.py)')
+
+
+'''
+-------------------------------------------------------------------------------
+get_config:
+function that creates the VoxelizationConfig out of the parsed arguments
+'''
+def get_config(args):
+    if args.config is not None:
+        return VoxelizationConfig.load_json(args.config)
+    if args.buildjob is None or args.part is None:
+        raise SystemExit('either --config or --buildjob and --part are needed')
+    return VoxelizationConfig(args.buildjob, args.output, args.part,
+                              voxel_size = args.voxel_size,
+                              num_layers_per_voxel = args.layers,
+                              max_slice_number_part = args.max_slice,
+                              output_format = args.format,
+                              compression = args.compression,
+                              reduction_mode = args.mode,
+                              scan_workers = args.scan_workers,
+                              skip_empty_voxels = args.skip_empty,
+                              stride_xy = args.stride,
+                              stride_z = args.stride_z,
+                              features = args.features)
+
+
+def scan(args):
+    config = get_config(args)
+    bounds = config.bounds
+    print('slices:   {}'.format(config.max_slice_number))
+    print('minX {} maxX {}'.format(config.minX, config.maxX))
+    print('minY {} maxY {}'.format(config.minY, config.maxY))
+    print('datapoints: {}'.format(int(bounds['num_points'].sum())))
+    print('voxels x/y/z: {} {} {}'.format(config.num_voxels_x, config.num_voxels_y, config.num_voxels_z))
+
+
+def run(args):
+    config = get_config(args)
+    if config.path_voxel_h5_folder is None:
+        raise SystemExit('--output is needed for run')
+    #the pyramid is built after the run, a combination it can't be built for is rejected before
+    if args.pyramid and (config.output_format == 'dense' or args.full_grid):
+        raise SystemExit('--pyramid needs the voxel index of the storage reduced layouts groups or csr, not {}'.format('--full-grid' if args.full_grid else '--format dense'))
+    if args.pyramid and config.is_strided:
+        raise SystemExit('--pyramid can not merge overlapping voxels (--stride, --stride-z)')
+    if args.shard is not None:
+        from voxel_shards import get_shard_config
+        if args.pyramid:
+            raise SystemExit('the pyramid of a sharded run is built after merge (voxelize.py pyramid --output ...)')
+        config = get_shard_config(config, *args.shard)
+        if not config.num_z_list:
+            #more shards than voxel layers, the config json tells merge that the shard is done
+            config.make_output_folder()
+            config.save_json(os.path.join(config.path_voxel_h5_folder, CONFIG_FILE_NAME))
+            print('shard {} of {} has no voxel layers ({} voxel layers)'.format(config.shard_index, config.num_shards, config.num_voxels_z))
+            return
+    if args.report:
+        instrumentation.enable(track_memory = args.report_memory)
+    if config.output_format == 'dense' or args.full_grid:
+        from create_hdf_per_single_vox_layer import create_voxel_layers
+        create_voxel_layers(config, max_workers = args.workers or 4, restart = args.restart)
+    elif args.scheduler == 'pipeline':
+        from streaming_pipeline import run_streaming_pipeline
+        run_streaming_pipeline(config, max_workers = args.workers, prefetch = args.prefetch, memory_budget_bytes = args.memory_budget*1024**2, restart = args.restart)
+    elif args.scheduler == 'layer':
+        from create_hdf_per_single_vox_layer_storage_reduced import create_voxel_layers
+        create_voxel_layers(config, max_workers = args.workers or 4, restart = args.restart)
+    else:
+        from slice_scheduler import run_slice_scheduler
+        run_slice_scheduler(config, max_workers = args.workers, num_writers = args.writers, restart = args.restart)
+    if args.pyramid:
+        from voxel_pyramid import build_voxel_pyramid
+        build_voxel_pyramid(config.path_voxel_h5_folder, num_levels = args.pyramid)
+    if args.report:
+        instrumentation.write_report(args.report, info = {'scheduler': 'full-grid' if args.full_grid else args.scheduler, 'config': config.to_dict()})
+
+
+def merge(args):
+    from voxel_shards import merge_shards
+    folder = args.output if args.config is None else VoxelizationConfig.load_json(args.config).path_voxel_h5_folder
+    if folder is None:
+        raise SystemExit('either --config or --output is needed')
+    merge_shards(folder, allow_incomplete = args.allow_incomplete)
+
+
+def prune(args):
+    from delete_empty_voxels import delete_empty_voxels
+    folder = args.output if args.config is None else VoxelizationConfig.load_json(args.config).path_voxel_h5_folder
+    if folder is None:
+        raise SystemExit('--output or --config is needed for prune')
+    num_layers_per_voxel = args.layers
+    if os.path.isfile(os.path.join(folder, CONFIG_FILE_NAME)):
+        num_layers_per_voxel = VoxelizationConfig.load_json(os.path.join(folder, CONFIG_FILE_NAME)).num_layers_per_voxel
+    num_deleted = delete_empty_voxels(folder, num_layers_per_voxel, repack = args.repack)
+    print('{} empty voxels deleted in {} layer files'.format(sum(num_deleted.values()), len(num_deleted)))
+
+
+def export(args):
+    config = get_config(args)
+    config.resolve()
+    config.save_json(args.to)
+    print('config written to {}'.format(args.to))
+
+
+def index(args):
+    from voxel_index import build_voxel_index
+    folder = args.output if args.config is None else VoxelizationConfig.load_json(args.config).path_voxel_h5_folder
+    if folder is None:
+        raise SystemExit('--output or --config is needed for index')
+    voxel_index = build_voxel_index(folder)
+    print('{} voxels, {} occupied, {} at the edge'.format(voxel_index.size, int((voxel_index['num_points'] > 0).sum()), int(voxel_index['edge'].sum())))
+
+
+def pyramid(args):
+    from voxel_pyramid import build_voxel_pyramid
+    folder = args.output if args.config is None else VoxelizationConfig.load_json(args.config).path_voxel_h5_folder
+    if folder is None:
+        raise SystemExit('--output or --config is needed for pyramid')
+    levels = build_voxel_pyramid(folder, num_levels = args.levels, factor = args.factor, rebuild = args.rebuild)
+    for num_level, level in enumerate(levels):
+        print('level {}: {} voxels, {} occupied'.format(num_level, 'x'.join(str(size) for size in level['num_points'].shape), int((level['num_points'] > 0).sum())))
+
+
+def memmap(args):
+    import numpy as np
+    from memmap_export import export_memmap
+    from voxel_batches import skip_empty_voxels
+    folder = args.output if args.config is None else VoxelizationConfig.load_json(args.config).path_voxel_h5_folder
+    if folder is None:
+        raise SystemExit('--output or --config is needed for memmap')
+    export_memmap(folder, args.to, predicate = None if args.all else skip_empty_voxels, dtype = np.dtype(args.dtype))
+
+
+def batch(args):
+    from batch_voxelization import create_batch_configs, run_batch, save_batch_json
+    configs = create_batch_configs(args.buildjob, args.output, part_names = args.parts,
+                                   voxel_size = args.voxel_size,
+                                   num_layers_per_voxel = args.layers,
+                                   output_format = args.format,
+                                   compression = args.compression,
+                                   reduction_mode = args.mode,
+                                   skip_empty_voxels = args.skip_empty,
+                                   stride_xy = args.stride,
+                                   stride_z = args.stride_z,
+                                   features = args.features)
+    os.makedirs(args.output, exist_ok = True)
+    if args.report:
+        instrumentation.enable(track_memory = args.report_memory)
+    result = run_batch(configs, max_workers = args.workers, grid_source = args.grid_from, restart = args.restart)
+    save_batch_json(args.buildjob, args.output, result)
+    if args.report:
+        instrumentation.write_report(args.report, info = {'scheduler': 'batch', 'parts': sorted(result)})
+    for part_name, part_result in result.items():
+        print('{}: {} slices, {}'.format(part_name, part_result['num_slices'], part_result['status']))
+
+
+def parse_grid(value):
+    #'100:10' -> (voxel_size, num_layers_per_voxel)
+    try:
+        voxel_size, num_layers_per_voxel = (int(number) for number in value.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('a grid is VOXEL_SIZE:LAYERS, e.g. 100:10, not {}'.format(value))
+    return voxel_size, num_layers_per_voxel
+
+
+def parse_shard(value):
+    #'1/4' -> (shard_index, num_shards), the shards are counted from 0
+    try:
+        shard_index, num_shards = (int(number) for number in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('a shard is INDEX/COUNT, e.g. 0/4, not {}'.format(value))
+    if not 0 <= shard_index < num_shards:
+        raise argparse.ArgumentTypeError('the shard index has to be in 0..COUNT-1, not {}'.format(value))
+    return shard_index, num_shards
+
+
+def sweep(args):
+    from voxel_sweep import create_sweep_configs, run_voxel_sweep
+    configs = create_sweep_configs(args.buildjob, args.output, args.part, args.grid,
+                                   max_slice_number_part = args.max_slice,
+                                   output_format = args.format,
+                                   compression = args.compression,
+                                   reduction_mode = args.mode,
+                                   skip_empty_voxels = args.skip_empty,
+                                   features = args.features)
+    if args.report:
+        instrumentation.enable(track_memory = args.report_memory)
+    result = run_voxel_sweep(configs, max_workers = args.workers, restart = args.restart)
+    if args.report:
+        instrumentation.write_report(args.report, info = {'scheduler': 'sweep', 'configs': [config.to_dict() for config in configs]})
+    for folder, num_slices in result.items():
+        print('{}: {} slices'.format(folder, num_slices))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'voxelization of buildjob hdf5 data')
+    subparsers = parser.add_subparsers(dest = 'command')
+    subparsers.required = True
+
+    parser_scan = subparsers.add_parser('scan', help = 'scan (and cache) the bounding box and print the voxel grid')
+    add_config_arguments(parser_scan)
+    parser_scan.set_defaults(func = scan)
+
+    parser_run = subparsers.add_parser('run', help = 'voxelize a part')
+    add_config_arguments(parser_run)
+    parser_run.add_argument('--workers', type = int, default = None, help = 'number of compute processes (default: number of CPUs for the slice scheduler, 4 otherwise)')
+    parser_run.add_argument('--scheduler', default = 'slice', choices = ('slice', 'pipeline', 'layer'),
+                            help = 'slice: single slices largest first with dedicated writer processes, pipeline: prefetching reader -> compute -> writer with a memory budget, layer: one task per voxel layer')
+    parser_run.add_argument('--prefetch', type = int, default = 4, help = 'number of slices the reader of the pipeline reads ahead')
+    parser_run.add_argument('--memory-budget', type = int, default = 2048, help = 'MB of all the slices in flight in the pipeline')
+    parser_run.add_argument('--writers', type = int, default = None, help = 'number of writer processes of the slice scheduler')
+    parser_run.add_argument('--full-grid', action = 'store_true', help = 'store the full voxel_size^2 grid per voxel and slice (not storage reduced)')
+    parser_run.add_argument('--restart', action = 'store_true', help = 'compute all slices again instead of resuming the run in the output folder')
+    parser_run.add_argument('--pyramid', type = int, default = 0, help = 'number of coarser levels (2x, 4x, ...) of the voxel statistics built after the run (see voxel_pyramid.py)')
+    parser_run.add_argument('--report', default = None, help = 'path of a report (.json or .csv) of the stage times, peak memory and counters of the run')
+    parser_run.add_argument('--report-memory', action = 'store_true', help = 'measure the peak memory per stage with tracemalloc (slows the run down, the times of the report get longer)')
+    parser_run.add_argument('--shard', type = parse_shard, default = None, help = 'INDEX/COUNT, e.g. 0/4: compute only every COUNT-th voxel layer into output/shard_INDEX_of_COUNT (see merge)')
+    parser_run.set_defaults(func = run)
+
+    parser_merge = subparsers.add_parser('merge', help = 'link the shard folders of a sharded run into the output folder (no data is copied) and build the index')
+    add_config_arguments(parser_merge)
+    parser_merge.add_argument('--allow-incomplete', action = 'store_true', help = 'merge shards which are not finished as well (their missing voxel slices stay empty)')
+    parser_merge.set_defaults(func = merge)
+
+    parser_prune = subparsers.add_parser('prune', help = 'delete empty voxels')
+    add_config_arguments(parser_prune)
+    parser_prune.add_argument('--repack', action = 'store_true', help = 'rewrite the layer files afterwards, so the space of the deleted voxels is given back')
+    parser_prune.set_defaults(func = prune)
+
+    parser_export = subparsers.add_parser('export', help = 'write the resolved config as json')
+    add_config_arguments(parser_export)
+    parser_export.add_argument('--to', required = True, help = 'path of the json')
+    parser_export.set_defaults(func = export)
+
+    parser_index = subparsers.add_parser('index', help = 'build the per voxel summary index (voxel_index.npy) out of the layer files')
+    add_config_arguments(parser_index)
+    parser_index.set_defaults(func = index)
+
+    parser_pyramid = subparsers.add_parser('pyramid', help = 'build coarser levels of the voxel statistics (voxel_pyramid.hdf5)')
+    add_config_arguments(parser_pyramid)
+    parser_pyramid.add_argument('--levels', type = int, default = 3, help = 'number of coarser levels')
+    parser_pyramid.add_argument('--factor', type = int, default = 2, help = 'number of voxels merged per direction from one level to the next')
+    parser_pyramid.add_argument('--rebuild', action = 'store_true', help = 'build the voxel index and all the levels again')
+    parser_pyramid.set_defaults(func = pyramid)
+
+    parser_memmap = subparsers.add_parser('memmap', help = 'export the voxels into flat .npy files for memory mapped reads')
+    add_config_arguments(parser_memmap)
+    parser_memmap.add_argument('--to', default = None, help = 'folder of the export (default: <output>/memmap)')
+    parser_memmap.add_argument('--all', action = 'store_true', help = 'export the empty voxels as well')
+    parser_memmap.add_argument('--dtype', default = 'int32', choices = ('int16', 'int32', 'int64', 'float32'), help = 'dtype of the exported voxels')
+    parser_memmap.set_defaults(func = memmap)
+
+    parser_batch = subparsers.add_parser('batch', help = 'voxelize all (or the given) parts of a buildjob, one output folder per part')
+    parser_batch.add_argument('--buildjob', required = True, help = 'path of the hdf5 of the buildjob')
+    parser_batch.add_argument('--output', required = True, help = 'folder which gets one subfolder per part')
+    parser_batch.add_argument('--parts', nargs = '+', default = None, help = 'names of the parts (default: all parts of the buildjob)')
+    parser_batch.add_argument('--voxel-size', type = int, default = 100, help = 'x and y dimension of a voxel')
+    parser_batch.add_argument('--layers', type = int, default = 10, help = 'number of slices per voxel')
+    parser_batch.add_argument('--format', default = 'groups', choices = ('groups', 'csr'), help = 'layout of the voxel files')
+    parser_batch.add_argument('--compression', default = None, choices = sorted(COMPRESSION_PROFILES), help = 'compression profile of the datasets (default: none)')
+    parser_batch.add_argument('--mode', default = 'max', choices = REDUCTION_MODES, help = 'reduction of multiple x,y-occurences')
+    parser_batch.add_argument('--skip-empty', action = 'store_true', help = 'do not write voxel slices without datapoints (layout groups)')
+    parser_batch.add_argument('--stride', type = int, default = None, help = 'distance between the starts of neighbouring voxels in x and y (default: voxel size)')
+    parser_batch.add_argument('--stride-z', type = int, default = None, help = 'number of slices between the starts of neighbouring voxel layers (default: layers)')
+    parser_batch.add_argument('--features', nargs = '+', default = [], choices = sorted(FEATURE_FUNCTIONS), help = 'features computed per voxel slice while writing')
+    parser_batch.add_argument('--workers', type = int, default = None, help = 'number of processes shared by all parts (default: number of CPUs)')
+    parser_batch.add_argument('--grid-from', default = 'scan', choices = ('scan', 'attributes'), help = 'bounds of the parts out of the (cached) scan or the part attributes minX/maxX/minY/maxY')
+    parser_batch.add_argument('--restart', action = 'store_true', help = 'compute all slices again instead of resuming')
+    parser_batch.add_argument('--report', default = None, help = 'path of a report (.json or .csv) of the stage times, peak memory and counters of all the parts')
+    parser_batch.add_argument('--report-memory', action = 'store_true', help = 'measure the peak memory per stage with tracemalloc (slows the run down, the times of the report get longer)')
+    parser_batch.set_defaults(func = batch)
+
+    parser_sweep = subparsers.add_parser('sweep', help = 'voxelize a part with several voxel grids in one pass, one output folder per grid')
+    parser_sweep.add_argument('--buildjob', required = True, help = 'path of the hdf5 of the buildjob')
+    parser_sweep.add_argument('--part', required = True, help = 'name of the part')
+    parser_sweep.add_argument('--output', required = True, help = 'folder which gets one subfolder per grid ({part}_voxel_{size}_{layers})')
+    parser_sweep.add_argument('--grid', nargs = '+', required = True, type = parse_grid, help = 'voxel grids as VOXEL_SIZE:LAYERS, e.g. 50:10 100:10 200:5')
+    parser_sweep.add_argument('--max-slice', type = int, default = None, help = 'number of the highest slice of the part (default: read from the hdf5)')
+    parser_sweep.add_argument('--format', default = 'groups', choices = ('groups', 'csr'), help = 'layout of the voxel files')
+    parser_sweep.add_argument('--compression', default = None, choices = sorted(COMPRESSION_PROFILES), help = 'compression profile of the datasets (default: none)')
+    parser_sweep.add_argument('--mode', default = 'max', choices = REDUCTION_MODES, help = 'reduction of multiple x,y-occurences')
+    parser_sweep.add_argument('--skip-empty', action = 'store_true', help = 'do not write voxel slices without datapoints (layout groups)')
+    parser_sweep.add_argument('--features', nargs = '+', default = [], choices = sorted(FEATURE_FUNCTIONS), help = 'features computed per voxel slice while writing')
+    parser_sweep.add_argument('--workers', type = int, default = None, help = 'number of compute processes (default: number of CPUs)')
+    parser_sweep.add_argument('--restart', action = 'store_true', help = 'compute all slices again instead of resuming')
+    parser_sweep.add_argument('--report', default = None, help = 'path of a report (.json or .csv) of the stage times, peak memory and counters of the sweep')
+    parser_sweep.add_argument('--report-memory', action = 'store_true', help = 'measure the peak memory per stage with tracemalloc (slows the run down, the times of the report get longer)')
+    parser_sweep.set_defaults(func = sweep)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])